@@ -0,0 +1,439 @@
+"""Benchmark reproduzível de transferências através do proxy de defeitos (impairment.py).
+
+Servidor, proxy e cliente rodam em processos separados na mesma máquina. Para cada cenário
+(defeitos do proxy + opções do cliente), cada tamanho de arquivo e cada repetição, um proxy
+novo é iniciado com uma semente derivada de --seed, o cliente baixa o arquivo através dele e
+o resultado é conferido byte a byte. Cada execução gera uma linha com:
+
+* seconds: tempo total do cliente (completion time);
+* goodput_mbps: tamanho do arquivo / tempo;
+* throughput_mbps: bytes enviados pelo servidor / tempo (inclui retransmissões e controle);
+* retransmission_ratio: datagramas do servidor além do mínimo, sobre o mínimo de segmentos;
+* client_cpu_s / server_cpu_s: tempo de CPU (usuário + sistema) de cada lado durante a execução.
+
+Os resultados são gravados em JSON e/ou CSV; com --compare, as medianas são comparadas com
+as de um JSON anterior (a linha de base). Exemplos:
+
+    python benchmark.py --sizes 1M,16M --repeat 3 --json base.json
+    python benchmark.py --sizes 1M,16M --repeat 3 --json novo.json --compare base.json
+
+Os cenários padrão estão em SCENARIOS; --scenarios lê uma lista no mesmo formato de um
+arquivo JSON. Os tempos de CPU do servidor vêm de /proc (Linux).
+
+Com --clients, o benchmark mede a escalabilidade do servidor: para cada número de processos
+servidores de --workers (SO_REUSEPORT) e cada número de clientes de --clients, os clientes
+baixam o arquivo ao mesmo tempo, direto do servidor (sem o proxy, que seria o gargalo), e a
+vazão agregada (bytes de todos os clientes / tempo até o último terminar) é comparada com a
+de um cliente só com os mesmos processos servidores:
+
+    python benchmark.py --sizes 16M --clients 1,2,4,8 --workers 1,4 --repeat 3
+
+tests/test_concurrency.py usa run_concurrency para verificar que a vazão agregada cresce com
+o número de clientes e que vários processos servidores não a reduzem.
+"""
+import argparse
+import csv
+import filecmp
+import json
+import logging
+import os
+import random
+import resource
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import protocol
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - BENCHMARK - %(levelname)s - %(message)s')
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Opções do proxy usam os nomes de impairment.py (sem '--'); as do cliente, CLIENT_FLAGS
+SCENARIOS = [
+    {'name': 'limpo', 'proxy': {}, 'client': {}},
+    {'name': 'latencia-25ms', 'proxy': {'delay': 25, 'jitter': 5}, 'client': {}},
+    {'name': 'perda-1%', 'proxy': {'delay': 5, 'loss': 0.01}, 'client': {}},
+    {'name': 'perda-rajadas', 'proxy': {'delay': 5, 'burst-rate': 0.002, 'burst-length': 20}, 'client': {}},
+    {'name': 'reordem-duplicacao', 'proxy': {'delay': 5, 'jitter': 2, 'reorder': 0.02, 'duplicate': 0.01}, 'client': {}},
+    {'name': 'corrupcao', 'proxy': {'delay': 5, 'corrupt': 0.005}, 'client': {'checksum': 'crc32'}},
+    {'name': 'banda-50mbit', 'proxy': {'delay': 10, 'rate': 50}, 'client': {}},
+    {'name': 'fixo-perda-1%', 'proxy': {'delay': 5, 'loss': 0.01}, 'client': {'flow': protocol.FLOW_FIXED}},
+]
+
+CLIENT_FLAGS = {
+    'flow': '-f',
+    'checksum': '-c',
+    'timeout': '-t',
+    'retries': '-r',
+    'streams': '-s',
+    'payload_size': '--payload-size',
+    'compression': '-z',
+}
+
+FIELDS = ['scenario', 'size', 'run', 'ok', 'seconds', 'goodput_mbps', 'throughput_mbps', 'wire_bytes', 'datagrams',
+          'segments', 'retransmission_ratio', 'client_cpu_s', 'server_cpu_s']
+
+CONCURRENCY_FIELDS = ['workers', 'clients', 'size', 'run', 'ok', 'seconds', 'aggregate_mbps', 'client_cpu_s', 'server_cpu_s']
+
+RUN_TIMEOUT = 600 # Segundos até uma execução do cliente ser abortada
+
+
+def parse_size(text):
+    """'512K', '16M', '1G' ou bytes."""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    text = text.strip().upper()
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def process_cpu_seconds(pid):
+    """Tempo de CPU (usuário + sistema) de um processo em execução, lido de /proc; None fora do Linux."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def process_tree_cpu_seconds(pid):
+    """Tempo de CPU de um processo e dos seus descendentes em execução (servidor com --workers)."""
+    total = process_cpu_seconds(pid)
+    if total is None:
+        return None
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = [int(child) for child in f.read().split()]
+    except OSError:
+        children = []
+    for child in children:
+        total += process_tree_cpu_seconds(child) or 0.0
+    return total
+
+
+def children_cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def make_file(directory, size, content, seed):
+    """Arquivo de teste determinístico: bytes aleatórios ou texto (repetições de text.txt)."""
+    filename = os.path.join(directory, f"bench_{content}_{size}.bin")
+    if os.path.exists(filename) and os.path.getsize(filename) == size:
+        return filename
+    with open(filename, 'wb') as f:
+        if content == 'text':
+            with open(os.path.join(HERE, 'text.txt'), 'rb') as source:
+                sample = source.read() or b'\0'
+            for start in range(0, size, len(sample)):
+                f.write(sample[:size - start])
+        else:
+            rng = random.Random(seed)
+            for start in range(0, size, 1 << 20):
+                f.write(rng.randbytes(min(1 << 20, size - start)))
+    return filename
+
+
+def query_segments(server_address, filename, payload_size, compression_name, attempts=20):
+    """Total de segmentos da transferência (HEAD direto ao servidor); também espera o servidor subir."""
+    options = {}
+    if payload_size:
+        options[protocol.OPTION_PAYLOAD] = payload_size
+    if compression_name:
+        options[protocol.OPTION_COMPRESSION] = compression_name
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(0.5)
+        for _ in range(attempts):
+            try:
+                sock.sendto(protocol.build_head_request(filename, options), server_address)
+                message = sock.recv(65536)
+            except (socket.timeout, ConnectionError):
+                continue
+            if message.startswith(protocol.OK_PREFIX):
+                return int(protocol.parse_ok_response(message)[protocol.OPTION_SEGMENTS])
+            raise RuntimeError(f"Servidor recusou HEAD de {filename}: {message[:100]!r}")
+    raise RuntimeError(f"Servidor em {server_address} não respondeu")
+
+
+def start_proxy(server_port, proxy_options, seed, stats_file):
+    command = [sys.executable, os.path.join(HERE, 'impairment.py'), '--listen', '127.0.0.1:0',
+               '--server', f"127.0.0.1:{server_port}", '--seed', str(seed), '--stats-file', stats_file]
+    for key, value in proxy_options.items():
+        command += [f"--{key}", str(value)]
+    proxy = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    line = proxy.stdout.readline() # "listening <host>:<porta>"
+    if not line.startswith('listening '):
+        proxy.kill()
+        raise RuntimeError(f"Proxy não iniciou: {' '.join(command)}")
+    return proxy, int(line.rsplit(':', 1)[1])
+
+
+def stop_proxy(proxy, stats_file):
+    proxy.send_signal(signal.SIGTERM)
+    proxy.wait(timeout=10)
+    with open(stats_file) as f:
+        return json.load(f)
+
+
+def run_once(scenario, filename, size, run, server, server_port, workdir, seed):
+    """Executa uma transferência e retorna a linha de resultado."""
+    client_options = scenario.get('client', {})
+    segments = query_segments(('127.0.0.1', server_port), filename, client_options.get('payload_size'), client_options.get('compression'))
+    stats_file = os.path.join(workdir, 'proxy_stats.json')
+    output_filename = os.path.join(workdir, 'download.bin')
+    for leftover in os.listdir(workdir):
+        if leftover.startswith('download.bin'):
+            os.remove(os.path.join(workdir, leftover)) # Restos de uma execução anterior seriam retomados
+
+    proxy, proxy_port = start_proxy(server_port, scenario.get('proxy', {}), seed, stats_file)
+    command = [sys.executable, os.path.join(HERE, 'client.py'), f"127.0.0.1:{proxy_port}", filename, '-o', output_filename, '-l', '0']
+    for key, value in client_options.items():
+        command += [CLIENT_FLAGS[key], str(value)]
+
+    server_cpu = process_cpu_seconds(server.pid)
+    client_cpu = children_cpu_seconds()
+    start = time.perf_counter()
+    with open(os.path.join(workdir, 'client.log'), 'w') as log:
+        client = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            client.wait(timeout=RUN_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            client.kill()
+            client.wait()
+    seconds = time.perf_counter() - start
+    client_cpu = children_cpu_seconds() - client_cpu
+    server_cpu_end = process_cpu_seconds(server.pid)
+    stats = stop_proxy(proxy, stats_file)
+
+    ok = os.path.exists(output_filename) and filecmp.cmp(output_filename, filename, shallow=False)
+    datagrams = stats['downstream']['received']
+    wire_bytes = stats['downstream']['bytes_received']
+    return {
+        'scenario': scenario['name'],
+        'size': size,
+        'run': run,
+        'ok': ok,
+        'seconds': round(seconds, 4),
+        'goodput_mbps': round(size * 8 / seconds / 1e6, 3) if ok else 0.0,
+        'throughput_mbps': round(wire_bytes * 8 / seconds / 1e6, 3),
+        'wire_bytes': wire_bytes,
+        'datagrams': datagrams,
+        'segments': segments,
+        'retransmission_ratio': round(max(0, datagrams - segments) / segments, 4),
+        'client_cpu_s': round(client_cpu, 3),
+        'server_cpu_s': round(server_cpu_end - server_cpu, 3) if server_cpu is not None else None,
+    }
+
+
+def start_server(workdir, workers=1):
+    """Inicia o servidor (com workers processos) numa porta livre; retorna (processo, porta, log)."""
+    server_port = free_port()
+    server_log = open(os.path.join(workdir, 'server.log'), 'w')
+    server = subprocess.Popen([sys.executable, os.path.join(HERE, 'server.py'), '--host', '127.0.0.1', '-p', str(server_port), '-w', str(workers)],
+                              stdout=server_log, stderr=subprocess.STDOUT)
+    return server, server_port, server_log
+
+
+def stop_server(server, server_log):
+    server.send_signal(signal.SIGINT)
+    try:
+        server.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        server.kill()
+    server_log.close()
+
+
+def run_benchmark(scenarios, sizes, repeat, workdir, content='random', seed=1):
+    os.makedirs(workdir, exist_ok=True)
+    files = {size: make_file(workdir, size, content, seed) for size in sizes}
+    server, server_port, server_log = start_server(workdir)
+    results = []
+    try:
+        query_segments(('127.0.0.1', server_port), files[sizes[0]], None, None) # Espera o servidor
+        for scenario in scenarios:
+            for size in sizes:
+                for run in range(repeat):
+                    row = run_once(scenario, files[size], size, run, server, server_port, workdir, seed + run)
+                    results.append(row)
+                    logging.info(f"{row['scenario']:<20} {size:>11} #{run} {'OK' if row['ok'] else 'FALHA':<5} {row['seconds']:>8.3f} s "
+                                 f"{row['goodput_mbps']:>9.2f} Mbit/s  retransmissão {row['retransmission_ratio']:.2%}  "
+                                 f"CPU cliente {row['client_cpu_s']:.2f} s, servidor {row['server_cpu_s']} s")
+    finally:
+        stop_server(server, server_log)
+    return results
+
+
+def run_concurrent(filename, size, clients, run, server, server_port, workdir, client_options=()):
+    """Baixa o arquivo com clients clientes simultâneos (com as opções extras client_options) e retorna a linha de resultado."""
+    outputs = [os.path.join(workdir, f"download.{index}.bin") for index in range(clients)]
+    for leftover in os.listdir(workdir):
+        if leftover.startswith('download.'):
+            os.remove(os.path.join(workdir, leftover))
+
+    server_cpu = process_tree_cpu_seconds(server.pid)
+    client_cpu = children_cpu_seconds()
+    start = time.perf_counter()
+    processes = []
+    logs = []
+    for index, output_filename in enumerate(outputs):
+        log = open(os.path.join(workdir, f"client.{index}.log"), 'w')
+        logs.append(log)
+        processes.append(subprocess.Popen([sys.executable, os.path.join(HERE, 'client.py'), f"127.0.0.1:{server_port}", filename,
+                                           '-o', output_filename, '-l', '0', *client_options], stdout=log, stderr=subprocess.STDOUT))
+    deadline = start + RUN_TIMEOUT
+    for process in processes:
+        try:
+            process.wait(timeout=max(0.0, deadline - time.perf_counter()))
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+    seconds = time.perf_counter() - start
+    client_cpu = children_cpu_seconds() - client_cpu
+    server_cpu_end = process_tree_cpu_seconds(server.pid)
+    for log in logs:
+        log.close()
+
+    ok = all(os.path.exists(output_filename) and filecmp.cmp(output_filename, filename, shallow=False) for output_filename in outputs)
+    return {
+        'workers': None, # Preenchido por run_concurrency
+        'clients': clients,
+        'size': size,
+        'run': run,
+        'ok': ok,
+        'seconds': round(seconds, 4),
+        'aggregate_mbps': round(clients * size * 8 / seconds / 1e6, 3) if ok else 0.0,
+        'client_cpu_s': round(client_cpu, 3),
+        'server_cpu_s': round(server_cpu_end - server_cpu, 3) if server_cpu is not None and server_cpu_end is not None else None,
+    }
+
+
+def run_concurrency(worker_counts, client_counts, size, repeat, workdir, content='random', seed=1, client_options=()):
+    """Vazão agregada para cada combinação de processos servidores e clientes simultâneos."""
+    os.makedirs(workdir, exist_ok=True)
+    filename = make_file(workdir, size, content, seed)
+    results = []
+    for workers in worker_counts:
+        server, server_port, server_log = start_server(workdir, workers)
+        try:
+            query_segments(('127.0.0.1', server_port), filename, None, None) # Espera o servidor
+            for clients in client_counts:
+                for run in range(repeat):
+                    row = run_concurrent(filename, size, clients, run, server, server_port, workdir, client_options)
+                    row['workers'] = workers
+                    results.append(row)
+                    logging.info(f"{workers:>2} processos {clients:>3} clientes #{run} {'OK' if row['ok'] else 'FALHA':<5} {row['seconds']:>8.3f} s "
+                                 f"{row['aggregate_mbps']:>9.2f} Mbit/s agregados  CPU cliente {row['client_cpu_s']:.2f} s, servidor {row['server_cpu_s']} s")
+        finally:
+            stop_server(server, server_log)
+    return results
+
+
+def print_concurrency(results):
+    """Medianas da vazão agregada, com o ganho sobre o menor número de clientes do mesmo servidor."""
+    groups = {}
+    for row in results:
+        groups.setdefault((row['workers'], row['clients']), []).append(row)
+    print(f"{'processos':>9} {'clientes':>8} {'ok':>5} {'tempo (s)':>10} {'agregado':>14} {'ganho':>7}")
+    reference = {}
+    for (workers, clients), rows in groups.items():
+        ok_rows = [row for row in rows if row['ok']]
+        seconds = statistics.median(row['seconds'] for row in ok_rows) if ok_rows else float('nan')
+        mbps = statistics.median(row['aggregate_mbps'] for row in ok_rows) if ok_rows else 0.0
+        base = reference.setdefault(workers, mbps)
+        gain = f"{mbps / base:.2f}x" if base else '-'
+        print(f"{workers:>9} {clients:>8} {len(ok_rows)}/{len(rows):<3} {seconds:>10.3f} {mbps:>9.2f} Mb/s {gain:>7}")
+
+
+def summarize(results):
+    """Medianas por (cenário, tamanho) das execuções bem-sucedidas."""
+    groups = {}
+    for row in results:
+        groups.setdefault((row['scenario'], row['size']), []).append(row)
+    summary = {}
+    for key, rows in groups.items():
+        ok_rows = [row for row in rows if row['ok']]
+        summary[key] = {
+            'ok': f"{len(ok_rows)}/{len(rows)}",
+            'seconds': statistics.median(row['seconds'] for row in ok_rows) if ok_rows else None,
+            'goodput_mbps': statistics.median(row['goodput_mbps'] for row in ok_rows) if ok_rows else None,
+            'retransmission_ratio': statistics.median(row['retransmission_ratio'] for row in rows),
+        }
+    return summary
+
+
+def print_summary(results, baseline=None):
+    summary = summarize(results)
+    base = summarize(baseline) if baseline else {}
+    print(f"{'cenário':<20} {'tamanho':>11} {'ok':>5} {'tempo (s)':>10} {'goodput':>12} {'retrans.':>9}" + ("  vs. linha de base" if base else ""))
+    for (scenario, size), values in summary.items():
+        line = (f"{scenario:<20} {size:>11} {values['ok']:>5} {values['seconds'] or float('nan'):>10.3f} "
+                f"{values['goodput_mbps'] or 0:>7.2f} Mb/s {values['retransmission_ratio']:>9.2%}")
+        reference = base.get((scenario, size))
+        if reference and reference['seconds'] and values['seconds']:
+            line += f"  {reference['seconds']:.3f} s -> {values['seconds']:.3f} s ({values['seconds'] / reference['seconds'] - 1:+.1%})"
+        print(line)
+
+
+def write_results(results, json_filename=None, csv_filename=None, fields=FIELDS):
+    if json_filename:
+        with open(json_filename, 'w') as f:
+            json.dump(results, f, indent=1)
+    if csv_filename:
+        with open(csv_filename, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de transferências através do proxy de defeitos de rede.")
+    parser.add_argument("--sizes", type=lambda text: [parse_size(size) for size in text.split(',')], default=[1024 ** 2, 16 * 1024 ** 2],
+                        help="Tamanhos dos arquivos, separados por vírgula (ex: 512K,16M; padrão: 1M,16M)")
+    parser.add_argument("--content", choices=['random', 'text'], default='random', help="Conteúdo dos arquivos: bytes aleatórios (padrão) ou texto compressível")
+    parser.add_argument("--repeat", type=int, default=3, help="Execuções por cenário e tamanho (padrão: 3)")
+    parser.add_argument("--scenarios", type=str, default=None, help="Arquivo JSON com a lista de cenários (padrão: SCENARIOS)")
+    parser.add_argument("--only", type=str, default=None, help="Executa só os cenários com estes nomes (separados por vírgula)")
+    parser.add_argument("--seed", type=int, default=1, help="Semente dos arquivos e do proxy (padrão: 1)")
+    parser.add_argument("--workdir", type=str, default="benchmark_work", help="Diretório dos arquivos de teste e logs (padrão: benchmark_work)")
+    parser.add_argument("--json", type=str, default=None, help="Grava os resultados em JSON")
+    parser.add_argument("--csv", type=str, default=None, help="Grava os resultados em CSV")
+    parser.add_argument("--clients", type=lambda text: [int(count) for count in text.split(',')], default=None,
+                        help="Mede a vazão agregada com estes números de clientes simultâneos (ex: 1,2,4,8), em vez dos cenários; usa o primeiro tamanho de --sizes")
+    parser.add_argument("--workers", type=lambda text: [int(count) for count in text.split(',')], default=[1, os.cpu_count() or 1],
+                        help="Com --clients, números de processos servidores (SO_REUSEPORT) a comparar (padrão: 1 e um por núcleo)")
+    parser.add_argument("--compare", type=str, default=None, help="JSON de uma execução anterior para comparar as medianas")
+
+    args = parser.parse_args()
+    if args.clients:
+        workers = list(dict.fromkeys(args.workers)) # Sem repetir (1 núcleo: 1,1)
+        results = run_concurrency(workers, args.clients, args.sizes[0], args.repeat, os.path.abspath(args.workdir), args.content, args.seed)
+        write_results(results, args.json, args.csv, CONCURRENCY_FIELDS)
+        print_concurrency(results)
+        sys.exit(0)
+
+    scenarios = SCENARIOS
+    if args.scenarios:
+        with open(args.scenarios) as f:
+            scenarios = json.load(f)
+    if args.only:
+        names = set(args.only.split(','))
+        scenarios = [scenario for scenario in scenarios if scenario['name'] in names]
+
+    results = run_benchmark(scenarios, args.sizes, args.repeat, os.path.abspath(args.workdir), args.content, args.seed)
+    write_results(results, args.json, args.csv)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_summary(results, baseline)
@@ -0,0 +1,142 @@
+"""Algoritmos de checksum dos segmentos, negociados por transferência.
+
+* sum: soma dos bytes módulo 65536 (algoritmo original, padrão para manter compatibilidade).
+* inet: soma em complemento de um de palavras de 16 bits (checksum da Internet, RFC 1071).
+* crc32 / adler32: checksums de 32 bits do zlib; detectam bytes trocados de posição.
+
+Executar este arquivo roda um micro-benchmark com a vazão (segmentos/s) de cada algoritmo.
+"""
+import sys
+import zlib
+
+try:
+    import numpy
+except ImportError: # NumPy é opcional: sem ele o cálculo em lote usa o caminho por segmento
+    numpy = None
+
+DEFAULT_ALGORITHM = 'sum'
+
+
+def calculate_checksum(data):
+    """Calcula um checksum simples (soma dos bytes modulo 65536)."""
+    return sum(data) % 65536
+
+
+def internet_checksum(data):
+    """Checksum da Internet: complemento de um da soma em complemento de um das palavras de 16 bits."""
+    if len(data) % 2:
+        data = bytes(data) + b'\0'
+    # A soma em complemento de um independe da ordem dos bytes (RFC 1071), então as palavras
+    # podem ser somadas na ordem nativa e o resultado trocado no final.
+    s = sum(memoryview(data).cast('H'))
+    while s >> 16:
+        s = (s & 0xFFFF) + (s >> 16)
+    if sys.byteorder == 'little':
+        s = ((s & 0xFF) << 8) | (s >> 8)
+    return ~s & 0xFFFF
+
+
+def crc32_checksum(data):
+    return zlib.crc32(data)
+
+
+def adler32_checksum(data):
+    return zlib.adler32(data)
+
+
+class ChecksumAlgorithm:
+    """Algoritmo de checksum e a largura (em bits) do campo que ele ocupa no cabeçalho."""
+
+    def __init__(self, name, function, bits):
+        self.name = name
+        self.function = function
+        self.bits = bits
+
+    def __repr__(self):
+        return f"ChecksumAlgorithm({self.name!r})"
+
+
+ALGORITHMS = {
+    'sum': ChecksumAlgorithm('sum', calculate_checksum, 16),
+    'inet': ChecksumAlgorithm('inet', internet_checksum, 16),
+    'crc32': ChecksumAlgorithm('crc32', crc32_checksum, 32),
+    'adler32': ChecksumAlgorithm('adler32', adler32_checksum, 32),
+}
+
+
+def get_algorithm(name):
+    """Retorna o algoritmo pelo nome; levanta ValueError se não for suportado."""
+    try:
+        return ALGORITHMS[name.lower()]
+    except KeyError:
+        raise ValueError(f"Algoritmo de checksum não suportado: {name}")
+
+
+def segment_checksums(algorithm, block, payload_size):
+    """Checksums de todos os segmentos consecutivos de payload_size bytes contidos em block.
+
+    Com NumPy disponível, 'sum' e 'inet' são calculados de uma vez para o bloco inteiro.
+    """
+    count = (len(block) + payload_size - 1) // payload_size
+    full = len(block) // payload_size
+    if numpy is not None and full and algorithm.name in ('sum', 'inet'):
+        if algorithm.name == 'sum':
+            words = numpy.frombuffer(block, dtype=numpy.uint8, count=full * payload_size)
+            sums = words.reshape(full, payload_size).sum(axis=1, dtype=numpy.uint64) % 65536
+        else:
+            sums = _internet_checksums_numpy(block, full, payload_size)
+        checksums = sums.tolist()
+        if count > full: # Último segmento incompleto
+            checksums.append(algorithm.function(block[full * payload_size:]))
+        return checksums
+
+    function = algorithm.function
+    view = memoryview(block)
+    return [function(view[i * payload_size:(i + 1) * payload_size]) for i in range(count)]
+
+
+def _internet_checksums_numpy(block, full, payload_size):
+    data = numpy.frombuffer(block, dtype=numpy.uint8, count=full * payload_size).reshape(full, payload_size)
+    if payload_size % 2:
+        data = numpy.pad(data, ((0, 0), (0, 1)))
+    words = data.view('>u2').astype(numpy.uint64)
+    s = words.sum(axis=1)
+    for _ in range(4): # Dobra os carries (no máximo 64 bits -> 16 bits)
+        s = (s & 0xFFFF) + (s >> 16)
+    return ~s & 0xFFFF
+
+
+def legacy_checksum_loop(data):
+    """Implementação original byte a byte (mantida apenas como referência no benchmark)."""
+    s = 0
+    for byte in data:
+        s += byte
+    return s % 65536
+
+
+def run_benchmark(payload_size=1400, segments=2000, repeat=3):
+    import os
+    import timeit
+
+    block = os.urandom(payload_size * segments)
+    view = memoryview(block)
+    payloads = [view[i * payload_size:(i + 1) * payload_size] for i in range(segments)]
+
+    def per_segment(function):
+        return lambda: [function(p) for p in payloads]
+
+    cases = [('sum (loop original)', per_segment(legacy_checksum_loop))]
+    for algorithm in ALGORITHMS.values():
+        cases.append((algorithm.name, per_segment(algorithm.function)))
+    for algorithm in ALGORITHMS.values():
+        cases.append((f"{algorithm.name} (lote{', numpy' if numpy is not None and algorithm.name in ('sum', 'inet') else ''})",
+                      lambda a=algorithm: segment_checksums(a, block, payload_size)))
+
+    print(f"Segmentos de {payload_size} bytes, {segments} por rodada, melhor de {repeat}")
+    for label, function in cases:
+        best = min(timeit.repeat(function, number=1, repeat=repeat))
+        print(f"  {label:<28} {segments / best:>14,.0f} segmentos/s")
+
+
+if __name__ == "__main__":
+    run_benchmark()
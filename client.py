@@ -3,8 +3,21 @@ import struct
 import time
 import random
 import argparse
+import json
 import logging
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import checksum
+import compression
+import congestion
+import fec
+import manifest
+import metrics
+import protocol
+import reassembly
+import recvpath
 
 # Configuração de Logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - CLIENT - %(levelname)s - %(message)s')
@@ -12,18 +25,27 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - CLIENT - %(levelna
 # Constantes do Protocolo (devem corresponder às do servidor)
 HEADER_FORMAT = '!I H B' # Sequence Number (unsigned int), Checksum (unsigned short), Flags (unsigned byte)
 HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
-BUFFER_SIZE = 65536  # Tamanho do buffer de recebimento (deve ser >= que o datagrama do servidor)
+DATA_PAYLOAD_SIZE = protocol.DEFAULT_PAYLOAD_SIZE # Tamanho padrão dos dados de cada segmento (todos menos o último); pode ser negociado com --payload-size
+BUFFER_SIZE = 65536  # Tamanho de cada buffer de recebimento do anel (deve ser >= que o datagrama do servidor)
 
-FLAG_LAST = 0x01 # Flag para indicar o último segmento
+FLAG_LAST = protocol.FLAG_LAST # Flag para indicar o último segmento
+FLAG_SESSION = protocol.FLAG_SESSION # O cabeçalho é seguido do ID da sessão
+FLAG_PARITY = protocol.FLAG_PARITY # Segmento de paridade (FEC)
 
-# --- Funções Auxiliares ---
-def calculate_checksum(data):
-    """Calcula um checksum simples (soma dos bytes modulo 65536)."""
-    s = 0
-    for byte in data:
-        s += byte
-    return s % 65536
+ACK_EVERY = 2 # No modo com janela, envia um ACK a cada N segmentos novos recebidos em ordem
+ACK_DELAY = 0.02 # Tempo máximo (segundos) que um ACK pendente pode esperar
+ACK_HISTORY = 16 # Segmentos recentes fora de ordem repetidos em cada ACK (tolera perda de ACKs)
+REORDER_THRESHOLD = 3 # Modo sem janela: segmentos posteriores recebidos para pedir uma lacuna por NACK
+MIN_RATE_SEGMENTS = 16 # Segmentos novos numa rodada antes de medir o ritmo de entrega
+STREAM_SUFFIX = '.stream' # Arquivo de cada fluxo no download em vários fluxos: <saída>.stream<i>
+STREAM_LAYOUT_SUFFIX = '.streams' # Divisão usada pelos fluxos, para retomá-los com os mesmos intervalos
+PROBE_WAIT = 0.5 # Espera (segundos) pelas sondas de MTU depois do último datagrama recebido
+PROBE_ATTEMPTS = 2 # Rodadas de sondagem, caso o maior tamanho não chegue (pode ter sido só uma perda)
+MANIFEST_WAIT = 1.0 # Espera (segundos) pelas páginas do manifesto depois do último datagrama recebido
+
+TRACER = metrics.Tracer() # Rastreamento amostrado de segmentos (--trace)
 
+# --- Funções Auxiliares ---
 def parse_address(addr_str):
     """Analisa 'host:port' e retorna (host, port)."""
     try:
@@ -35,9 +57,207 @@ def parse_address(addr_str):
     except ValueError as e:
         raise argparse.ArgumentTypeError(f"Formato de endereço inválido '{addr_str}'. Use HOST:PORT. Erro: {e}")
 
+class AckTracker:
+    """Gera ACKs cumulativos e seletivos para o modo com janela deslizante."""
+
+    def __init__(self, sock, server_address, first_segment=0, transfer_metrics=None):
+        self.sock = sock
+        self.server_address = server_address
+        self.metrics = transfer_metrics
+        self.session_id = None # ID da sessão no servidor, repetido em cada ACK
+        self.cumulative = first_segment # Próximo segmento esperado em ordem
+        self.recent = deque(maxlen=ACK_HISTORY) # Segmentos recebidos acima de uma lacuna
+        self.pending = 0 # Segmentos novos ainda não confirmados
+
+    def on_segment(self, seq_num, reassembler, is_new):
+        filled_gap = False
+        if is_new:
+            previous = self.cumulative
+            while self.cumulative in reassembler:
+                self.cumulative += 1
+            filled_gap = self.cumulative > previous + 1
+            if seq_num > self.cumulative:
+                self.recent.append(seq_num)
+            self.pending += 1
+        # Duplicatas, chegadas fora de ordem e segmentos que preenchem uma lacuna são confirmados
+        # imediatamente (RFC 5681): o servidor detecta perdas o quanto antes e não toma por
+        # perdido um segmento só atrasado pelo jitter. Em ordem, um ACK a cada ACK_EVERY segmentos.
+        if not is_new or seq_num > self.cumulative or filled_gap or self.pending >= ACK_EVERY:
+            self.send()
+
+    def send(self):
+        selective = [seq_num for seq_num in self.recent if seq_num > self.cumulative]
+        try:
+            self.sock.sendto(protocol.build_ack(self.cumulative, selective, self.session_id), self.server_address)
+        except socket.error as e:
+            logging.error(f"Erro ao enviar ACK {self.cumulative}: {e}")
+        self.pending = 0
+        if self.metrics is not None:
+            self.metrics.acks += 1
+
+
+class GapDetector:
+    """Pede por NACK, ainda durante o envio inicial do modo sem janela, as lacunas já para trás.
+
+    Um segmento é dado como perdido quando chega o segmento threshold posições à frente dele
+    (tolerância a reordenação e, com FEC, ao grupo de paridade). Cada lacuna é pedida uma vez;
+    o que ainda faltar no fim da rajada fica para a fase de recuperação.
+    """
+
+    def __init__(self, reassembler, threshold=REORDER_THRESHOLD):
+        self.reassembler = reassembler
+        self.threshold = threshold
+        self.scanned = reassembler.first_segment # Segmentos abaixo deste já foram verificados
+
+    def on_segment(self, seq_num):
+        """Retorna os intervalos (início, quantidade) que passaram a ser considerados perdidos."""
+        limit = seq_num - self.threshold + 1
+        if limit <= self.scanned:
+            return []
+        ranges = []
+        for missing in range(self.scanned, limit):
+            if missing not in self.reassembler:
+                if ranges and ranges[-1][0] + ranges[-1][1] == missing:
+                    ranges[-1][1] += 1
+                else:
+                    ranges.append([missing, 1])
+        self.scanned = limit
+        return ranges
+
+
+class DeliveryRate:
+    """Ritmo (segmentos/s) com que segmentos novos chegam, medido na rajada inicial e em cada rodada.
+
+    Com ele o cliente estima quanto o servidor ainda leva para reenviar o que foi pedido por
+    NACK, e não pede de novo o que ainda está na fila do servidor.
+    """
+
+    def __init__(self):
+        self.rate = None
+        self.started = None
+        self.count = 0
+
+    def start(self):
+        """Começa uma nova medida (rajada ou resposta a um NACK)."""
+        self.started = None
+        self.count = 0
+
+    def on_arrival(self, count, now):
+        if not count:
+            return
+        if self.started is None:
+            self.started = now # Os segmentos da primeira leitura marcam só o início
+            return
+        self.count += count
+        elapsed = now - self.started
+        if self.count >= MIN_RATE_SEGMENTS and elapsed > 0:
+            self.rate = self.count / elapsed
+
+    def drain_time(self, outstanding):
+        """Tempo estimado para receber outstanding segmentos (0 se o ritmo ainda não foi medido)."""
+        return outstanding / self.rate if self.rate else 0.0
+
+
+def announce_total(reassembler, accepted, segment_range=None):
+    """Registra o total de segmentos a partir do tamanho informado no OK.
+
+    Assim o fim do arquivo é conhecido desde o início, mesmo se o segmento com a flag de
+    último se perder. Servidores que não informam o tamanho são ignorados.
+    """
+    if reassembler.total_segments is not None:
+        return
+    try:
+        size = int(accepted[protocol.OPTION_SIZE])
+    except (KeyError, ValueError):
+        return
+    payload_size = reassembler.payload_size
+    end = segment_range[1] if segment_range is not None else max(1, -(-size // payload_size)) # Arquivo vazio: um segmento vazio
+    first = reassembler.first_segment
+    reassembler.set_total(end - first, min(end * payload_size, size) - first * payload_size)
+
+
+def send_nacks(udp_socket, server_address, ranges, session_id, transfer_metrics):
+    """Pede a retransmissão dos intervalos: um NACK cobre vários intervalos."""
+    for nack in protocol.build_nacks(ranges, session_id):
+        try:
+            udp_socket.sendto(nack, server_address)
+            transfer_metrics.nacks += 1
+        except socket.error as e:
+            logging.error(f"Erro ao enviar NACK: {e}")
+
+
+def log_server_error(segment, reassembler):
+    error_message = bytes(segment).decode('utf-8', errors='ignore').strip()
+    logging.error(f"Erro recebido do servidor: {error_message}")
+    if error_message.startswith('ERROR 412') and reassembler.resumed:
+        logging.error(f"O arquivo mudou no servidor desde o início do download. Apague {reassembler.part_filename} para baixá-lo de novo.")
+
+
+def split_segment(segment, flags, header_size):
+    """Separa o ID da sessão (None em segmentos sem sessão) dos dados de um segmento."""
+    if flags & FLAG_SESSION:
+        return protocol.SESSION_ID.unpack_from(segment, header_size)[0], segment[header_size + protocol.SESSION_ID.size:]
+    return None, segment[header_size:]
+
+
+def store_recovered(recovered, transfer_metrics, decompressor=None, ack_tracker=None, reassembler=None):
+    """Contabiliza os segmentos reconstruídos pela paridade (já gravados); retorna se o último estava entre eles."""
+    last = False
+    for seq_num, data, is_last in recovered:
+        transfer_metrics.segments_recovered += 1
+        transfer_metrics.segments_received += 1
+        transfer_metrics.bytes_received += len(data)
+        if decompressor is not None:
+            decompressor.advance(seq_num, data)
+        if ack_tracker is not None:
+            ack_tracker.on_segment(seq_num, reassembler, True)
+        if TRACER.enabled and TRACER.sample():
+            TRACER.debug(f"Segmento {seq_num} reconstruído pela paridade (Size: {len(data)})")
+        last = last or is_last
+    return last
+
+
+def receive_burst(receiver, ack_tracker, timeout_seconds):
+    """Recebe uma rajada de datagramas; no modo com janela, envia o ACK pendente se nada chegar em ACK_DELAY."""
+    if ack_tracker is None or not ack_tracker.pending:
+        return receiver.receive(timeout_seconds)
+    try:
+        return receiver.receive(ACK_DELAY)
+    except socket.timeout:
+        ack_tracker.send()
+    return receiver.receive(timeout_seconds)
+
+
 # --- Função Principal do Cliente ---
-def start_client(server_addr_str, filename, output_filename=None, loss_probability=0.0, timeout_seconds=10.0, max_retries=5):
-    """Inicia o cliente UDP para baixar um arquivo."""
+def start_client(server_addr_str, filename, output_filename=None, loss_probability=0.0, timeout_seconds=10.0, max_retries=5, flow=protocol.FLOW_WINDOW, checksum_name=checksum.DEFAULT_ALGORITHM, segment_range=None, payload_size=None, probe_mtu=False, compression_name=None, fec_group=None, delta=False):
+    """Inicia o cliente UDP para baixar um arquivo.
+
+    Os segmentos são gravados direto no arquivo de saída (veja reassembly.py); se o download
+    for interrompido, uma nova execução com o mesmo arquivo de saída retoma de onde parou.
+
+    flow escolhe o modo de envio do servidor: FLOW_WINDOW (janela deslizante com ACKs) ou
+    FLOW_FIXED (modo original, sem janela). checksum_name é o algoritmo de checksum negociado.
+    O GET sempre pede uma sessão, para que o OK traga o tamanho e a versão do arquivo; se um
+    servidor original o recusa, o download segue com o GET original (veja download).
+    segment_range (início, fim exclusivo) baixa só esses segmentos (um fluxo de start_streams).
+
+    payload_size pede ao servidor segmentos com esse tamanho de dados; com probe_mtu, o maior
+    tamanho (até payload_size) que o caminho entrega sem fragmentação é descoberto antes do GET.
+    Um download retomado sempre usa o tamanho com que foi iniciado.
+
+    compression_name pede a imagem comprimida do arquivo (veja compression.py), guardada em
+    <saída>.<codec> e descomprimida durante o download. Com segment_range, o intervalo da
+    imagem é gravado como está no arquivo de saída (start_streams descomprime a imagem juntada).
+
+    fec_group pede segmentos de paridade ('<K>' ou 'auto', veja fec.py), com que o cliente
+    reconstrói perdas isoladas sem pedir retransmissão.
+
+    Com delta, uma versão antiga do arquivo já presente em output_filename é comparada bloco a
+    bloco com o manifesto do servidor, e só os blocos diferentes são baixados (veja prepare_delta).
+
+    Os segmentos não geram log individual: são contados em um TransferMetrics, com uma linha de
+    progresso a cada metrics.REPORT_INTERVAL e um resumo ao final (veja metrics.py).
+    """
 
     try:
         server_host, server_port = parse_address(server_addr_str)
@@ -50,166 +270,464 @@ def start_client(server_addr_str, filename, output_filename=None, loss_probabili
         output_filename = f"downloaded_{os.path.basename(filename)}"
 
     udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    udp_socket.settimeout(timeout_seconds) # Timeout para recebimento
+    # O timeout de recebimento é aplicado pelo DatagramReceiver (veja download)
 
-    # Envia a requisição inicial
-    request_message = f"GET /{filename}\n".encode('utf-8')
     try:
-        logging.info(f"Enviando requisição para {server_address}: GET /{filename}")
+        algorithm = checksum.get_algorithm(checksum_name)
+        codec = compression.get_codec(compression_name) if compression_name else None
+    except ValueError as e:
+        logging.error(e)
+        udp_socket.close()
+        return
+
+    # Com compressão, o Reassembler recebe a imagem e o Decompressor grava o arquivo de saída
+    image_filename = output_filename
+    if codec is not None and segment_range is None:
+        image_filename = f"{output_filename}.{codec.name}"
+
+    saved_payload_size = reassembly.saved_payload_size(image_filename, filename)
+    if saved_payload_size is not None:
+        payload_size = saved_payload_size # As posições já gravadas dependem do tamanho dos segmentos
+    elif probe_mtu:
+        payload_size = probe_payload_size(server_address, timeout_seconds, payload_size or protocol.MAX_PAYLOAD_SIZE)
+    payload_size = payload_size or DATA_PAYLOAD_SIZE
+
+    if delta and saved_payload_size is None and codec is None and segment_range is None and os.path.exists(output_filename):
+        if prepare_delta(server_address, filename, output_filename, payload_size, timeout_seconds, max_retries):
+            udp_socket.close()
+            return True
+
+    try:
+        first_segment = segment_range[0] if segment_range else 0
+        reassembler = reassembly.Reassembler(image_filename, filename, payload_size, first_segment)
+    except OSError as e:
+        logging.error(f"Não foi possível criar o arquivo de saída {image_filename}: {e}")
+        udp_socket.close()
+        return
+    decompressor = None
+    receiver = recvpath.DatagramReceiver(udp_socket, slot_size=BUFFER_SIZE)
+    transfer_metrics = metrics.TransferMetrics(filename)
+    try:
+        if image_filename != output_filename:
+            decompressor = reassembly.Decompressor(reassembler, codec, output_filename)
+        success = download(udp_socket, receiver, server_address, filename, reassembler, flow, algorithm, loss_probability, timeout_seconds, max_retries, segment_range,
+                           codec, decompressor, transfer_metrics, fec_group)
+    except compression.DecompressionError as e:
+        logging.error(f"Erro ao descomprimir {reassembler.output_filename}: {e}")
+        success = False
+    except (OSError, ValueError) as e:
+        logging.error(f"Erro na transferência de {filename}: {e}")
+        success = False
+    finally:
+        if decompressor is not None:
+            decompressor.close()
+        reassembler.close() # Download incompleto: salva o estado para retomar depois
+        receiver.close()
+        udp_socket.close()
+        transfer_metrics.finish()
+        logging.info(f"Resumo do download de {filename}: {transfer_metrics.summary()}")
+        logging.info("Conexão do cliente fechada.")
+    return success
+
+
+def negotiation_accepted(accepted, reassembler, codec=None):
+    """Confere se o servidor vai usar o tamanho de segmento e a compressão pedidos (servidores antigos ignoram as opções)."""
+    try:
+        payload_size = int(accepted.get(protocol.OPTION_PAYLOAD, DATA_PAYLOAD_SIZE))
+    except ValueError:
+        payload_size = None
+    if payload_size != reassembler.payload_size:
+        logging.error(f"Servidor respondeu com segmentos de {payload_size} bytes em vez de {reassembler.payload_size}. Abortando.")
+        return False
+    codec_name = codec.name if codec is not None else None
+    if accepted.get(protocol.OPTION_COMPRESSION) != codec_name:
+        logging.error(f"Servidor respondeu com compressão {accepted.get(protocol.OPTION_COMPRESSION)} em vez de {codec_name}. Abortando.")
+        return False
+    return True
+
+
+def probe_payload_size(server_address, timeout_seconds, max_payload_size=protocol.MAX_PAYLOAD_SIZE):
+    """Sonda o caminho até o servidor e retorna o maior payload que chega sem fragmentação.
+
+    Retorna DATA_PAYLOAD_SIZE se nenhuma sonda chegar (servidor sem suporte à sondagem).
+    """
+    sizes = [size for size in protocol.PROBE_PAYLOAD_SIZES if size <= max_payload_size] or [max_payload_size]
+    best = None
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        recvpath.set_receive_buffer(sock, 4 * sum(sizes)) # Todas as sondas chegam de uma vez
+        sock.settimeout(min(PROBE_WAIT, timeout_seconds))
+        for attempt in range(PROBE_ATTEMPTS):
+            try:
+                sock.sendto(protocol.build_probe_request(sizes), server_address)
+                while best != sizes[-1]: # O maior tamanho chegou; não há o que melhorar
+                    message, sender_address = sock.recvfrom(BUFFER_SIZE)
+                    if sender_address != server_address or not message.startswith(protocol.PROBE_PREFIX):
+                        continue
+                    payload_size = protocol.parse_probe_reply(message)
+                    if payload_size is not None and (best is None or payload_size > best):
+                        best = payload_size
+            except socket.timeout:
+                pass
+            except socket.error as e:
+                logging.error(f"Erro durante a sondagem de MTU: {e}")
+                break
+            if best == sizes[-1]:
+                break
+    if best is None:
+        logging.warning(f"Nenhuma sonda de MTU recebida. Usando segmentos de {DATA_PAYLOAD_SIZE} bytes.")
+        return DATA_PAYLOAD_SIZE
+    logging.info(f"Sondagem de MTU: segmentos de {best} bytes chegam sem fragmentação.")
+    return best
+
+
+def send_request(udp_socket, server_address, filename, options, flow):
+    """Envia o GET com as opções; retorna False se o envio falhar."""
+    request_message = protocol.build_get_request(filename, options)
+    try:
+        logging.info(f"Enviando requisição para {server_address}: GET /{filename} (fluxo {flow})")
         udp_socket.sendto(request_message, server_address)
     except socket.error as e:
         logging.error(f"Erro ao enviar requisição inicial para {server_address}: {e}")
-        udp_socket.close()
-        return
+        return False
+    return True
+
+
+def download(udp_socket, receiver, server_address, filename, reassembler, flow, algorithm, loss_probability, timeout_seconds, max_retries, segment_range=None,
+             codec=None, decompressor=None, transfer_metrics=None, fec_group=None):
+    """Executa o download e a remontagem; retorna True se o arquivo foi salvo completo.
+
+    Os datagramas são lidos do socket pelo receiver (recvpath.DatagramReceiver), que fica
+    com quem o criou. Com decompressor, cada segmento novo da imagem comprimida segue para a
+    descompressão. Os contadores do download vão para transfer_metrics. Com fec_group, os segmentos de
+    paridade reconstroem as perdas antes dos NACKs.
+
+    Quando a sessão é a única opção do GET, um servidor original lê a linha de opção como parte
+    do nome e responde ERROR 404; nesse caso (ou sem nenhuma resposta) o GET é repetido uma vez
+    sem opções, e o total vem da flag de último segmento ou do NACK até o fim do arquivo.
+    """
+    if transfer_metrics is None:
+        transfer_metrics = metrics.TransferMetrics(filename)
+    reporter = metrics.Reporter()
+    calculate_checksum = algorithm.function
+    segment_header = protocol.segment_header(algorithm)
+    header_size = segment_header.size
 
-    received_segments = {} # Dicionário para armazenar {seq_num: data}
-    expected_total_segments = None # Será definido quando o último segmento chegar
-    highest_seq_num_received = -1
-    last_segment_received = False
+    # Envia a requisição inicial
+    windowed = (flow == protocol.FLOW_WINDOW)
+    options = {}
+    if reassembler.resumed:
+        # O servidor só registra a transferência; os segmentos que faltam são pedidos por NACK
+        options[protocol.OPTION_RESUME] = 'yes'
+    elif windowed:
+        options[protocol.OPTION_FLOW] = flow
+    if algorithm.name != checksum.DEFAULT_ALGORITHM:
+        options[protocol.OPTION_CHECKSUM] = algorithm.name
+    if segment_range is not None:
+        options[protocol.OPTION_RANGE] = protocol.format_range(segment_range[0], segment_range[1] - 1)
+    if reassembler.payload_size != DATA_PAYLOAD_SIZE:
+        options[protocol.OPTION_PAYLOAD] = reassembler.payload_size
+    if codec is not None:
+        options[protocol.OPTION_COMPRESSION] = codec.name
+    if fec_group is not None and not reassembler.resumed:
+        options[protocol.OPTION_FEC] = fec_group
+    if reassembler.version is not None:
+        # Os segmentos já gravados são desta versão; se o arquivo mudou, o servidor responde 412
+        options[protocol.OPTION_VERSION] = reassembler.version
+    # Sempre com sessão: só assim o servidor responde com o OK, que traz o tamanho e a versão
+    bare_fallback = not options # Sem outras opções, o GET original também serve (servidor original)
+    options[protocol.OPTION_SESSION] = 'yes'
+    if not send_request(udp_socket, server_address, filename, options, flow):
+        return False
+    rtt = congestion.RttEstimator() # Estimado pelas respostas ao GET e aos NACKs; define a espera da recuperação
+    request_sent_at = time.monotonic() # GET à espera da primeira resposta (amostra de RTT)
+    delivery = DeliveryRate()
+
+    # Com um download retomado a fase inicial é pulada e vamos direto pedir o que falta
+    last_segment_received = reassembler.resumed
+    session_id = None # ID da sessão no servidor (None: servidor sem sessões)
+    ack_tracker = AckTracker(udp_socket, server_address, reassembler.first_segment, transfer_metrics) if windowed else None
+    recovery = fec.Recovery(reassembler) if protocol.OPTION_FEC in options else None
+    gap_detector = None
+    if not windowed:
+        # Sem janela, as lacunas são pedidas por NACK assim que ficam para trás
+        threshold = REORDER_THRESHOLD
+        if recovery is not None:
+            group_size, adaptive = fec.parse_group_option(fec_group)
+            threshold += fec.MAX_AUTO_GROUP_SIZE if adaptive else group_size # Espera a paridade do grupo
+        gap_detector = GapDetector(reassembler, threshold)
 
     # Loop principal de recebimento
     logging.info("Aguardando segmentos do servidor...")
     while not last_segment_received:
+        # Sem janela, depois que os segmentos começam a chegar, um RTO sem nada marca o fim da rajada
+        wait = rtt.rto if gap_detector is not None and reassembler.received else timeout_seconds
         try:
-            segment, sender_address = udp_socket.recvfrom(BUFFER_SIZE)
+            # Datagramas chegam como memoryviews sobre o anel de buffers do receiver (sem cópia)
+            burst = receive_burst(receiver, ack_tracker, wait)
+            if request_sent_at is not None:
+                rtt.sample(time.monotonic() - request_sent_at)
+                request_sent_at = None
+            received_before = reassembler.received
+            for segment, sender_address in burst:
 
-            if sender_address != server_address:
-                logging.warning(f"Recebido pacote de endereço inesperado {sender_address}. Ignorando.")
-                continue
+                if sender_address != server_address:
+                    logging.warning(f"Recebido pacote de endereço inesperado {sender_address}. Ignorando.")
+                    continue
 
-            # Verifica se é uma mensagem de erro do servidor
-            if segment.startswith(b'ERROR '):
-                 error_message = segment.decode('utf-8', errors='ignore').strip()
-                 logging.error(f"Erro recebido do servidor: {error_message}")
-                 udp_socket.close()
-                 return # Aborta o cliente
+                # Verifica se é uma mensagem de erro do servidor
+                if segment[:6] == b'ERROR ':
+                     if bare_fallback and segment[:9] == b'ERROR 404':
+                         logging.warning("Servidor recusou o GET com opções (servidor original?). Repetindo com o GET original.")
+                         bare_fallback = False
+                         if not send_request(udp_socket, server_address, filename, {}, flow):
+                             return False
+                         request_sent_at = time.monotonic()
+                         continue
+                     log_server_error(segment, reassembler)
+                     return False # Aborta o cliente
 
-            # Processa segmento de dados
-            if len(segment) < HEADER_SIZE:
-                logging.warning(f"Recebido pacote muito curto ({len(segment)} bytes). Ignorando.")
-                continue
+                if segment[:len(protocol.OK_PREFIX)] == protocol.OK_PREFIX:
+                    bare_fallback = False
+                    accepted = protocol.parse_ok_response(bytes(segment))
+                    logging.info(f"Servidor aceitou a requisição: {accepted}")
+                    if not negotiation_accepted(accepted, reassembler, codec):
+                        return False
+                    announce_total(reassembler, accepted, segment_range)
+                    if reassembler.version is None:
+                        reassembler.version = accepted.get(protocol.OPTION_VERSION)
+                    if protocol.OPTION_SESSION in accepted:
+                        session_id = int(accepted[protocol.OPTION_SESSION])
+                        if ack_tracker is not None:
+                            ack_tracker.session_id = session_id
+                    continue
+
+                # Processa segmento de dados
+                if len(segment) < header_size:
+                    logging.warning(f"Recebido pacote muito curto ({len(segment)} bytes). Ignorando.")
+                    continue
+
+                # Desempacota o cabeçalho
+                seq_num, checksum_recv, flags = segment_header.unpack_from(segment)
+                if flags & FLAG_SESSION and len(segment) < header_size + protocol.SESSION_ID.size:
+                    logging.warning(f"Recebido pacote muito curto ({len(segment)} bytes). Ignorando.")
+                    continue
+                segment_session, data = split_segment(segment, flags, header_size)
+                if segment_session != session_id:
+                    if session_id is not None:
+                        continue # Segmento de outra sessão (de um GET anterior)
+                    session_id = segment_session # O OK se perdeu: o ID vem do próprio segmento
+                    if ack_tracker is not None:
+                        ack_tracker.session_id = session_id
+
+                # --- Simulação de Perda ---
+                if random.random() < loss_probability:
+                    transfer_metrics.simulated_losses += 1
+                    if TRACER.enabled and TRACER.sample():
+                        TRACER.debug(f"Simulando perda do segmento {seq_num}")
+                    continue # Descarta o pacote intencionalmente
+
+                # --- Verificação de Checksum ---
+                checksum_calc = calculate_checksum(data)
+                if checksum_recv != checksum_calc:
+                    transfer_metrics.checksum_failures += 1
+                    if TRACER.enabled and TRACER.sample():
+                        TRACER.debug(f"Checksum inválido para segmento {seq_num}! Recebido={checksum_recv}, Calculado={checksum_calc}. Segmento descartado.")
+                    continue # Descarta o pacote corrompido
+
+                if flags & FLAG_PARITY:
+                    # Paridade de um grupo: reconstrói o segmento que falta, se for só um
+                    if recovery is not None:
+                        try:
+                            recovered = recovery.add_parity(seq_num, data, bool(flags & FLAG_LAST))
+                        except ValueError as e:
+                            logging.warning(f"Segmento de paridade {seq_num} ignorado: {e}")
+                            continue
+                        if store_recovered(recovered, transfer_metrics, decompressor, ack_tracker, reassembler):
+                            last_segment_received = not windowed
+                        if ack_tracker is not None and reassembler.complete():
+                            ack_tracker.send()
+                            last_segment_received = True
+                    continue
+
+                # Escreve o segmento válido no arquivo se ainda não o tivermos
+                is_new = reassembler.add(seq_num, data, bool(flags & FLAG_LAST))
+                if is_new:
+                     transfer_metrics.segments_received += 1
+                     transfer_metrics.bytes_received += len(data)
+                     if decompressor is not None:
+                         decompressor.advance(seq_num, data)
+                else:
+                     transfer_metrics.duplicates += 1
+                if TRACER.enabled and TRACER.sample():
+                    TRACER.debug(f"Recebido segmento {seq_num} (Size: {len(data)}, {'novo' if is_new else 'duplicado'})")
+                if is_new and recovery is not None:
+                    if store_recovered(recovery.on_segment(seq_num), transfer_metrics, decompressor, ack_tracker, reassembler):
+                        last_segment_received = not windowed
+                if is_new and gap_detector is not None:
+                    lost_ranges = gap_detector.on_segment(seq_num)
+                    if lost_ranges:
+                        send_nacks(udp_socket, server_address, lost_ranges, session_id, transfer_metrics)
 
-            # Desempacota o cabeçalho
-            header = segment[:HEADER_SIZE]
-            data = segment[HEADER_SIZE:]
-            seq_num, checksum_recv, flags = struct.unpack(HEADER_FORMAT, header)
-
-            # --- Simulação de Perda ---
-            if random.random() < loss_probability:
-                logging.warning(f"*** SIMULANDO PERDA do segmento {seq_num} ***")
-                continue # Descarta o pacote intencionalmente
-
-            # --- Verificação de Checksum ---
-            checksum_calc = calculate_checksum(data)
-            if checksum_recv != checksum_calc:
-                logging.error(f"Checksum inválido para segmento {seq_num}! Recebido={checksum_recv}, Calculado={checksum_calc}. Segmento descartado.")
-                continue # Descarta o pacote corrompido
-
-            # Armazena o segmento válido se ainda não o tivermos
-            if seq_num not in received_segments:
-                 logging.info(f"Recebido segmento {seq_num} (Size: {len(data)}, Checksum OK)")
-                 received_segments[seq_num] = data
-                 highest_seq_num_received = max(highest_seq_num_received, seq_num)
-            else:
-                 logging.debug(f"Recebido segmento duplicado {seq_num}. Ignorando.")
 
+                # Verifica se é o último segmento
+                if flags & FLAG_LAST:
+                    logging.info(f"Recebida flag de ÚLTIMO segmento no número {seq_num}")
+                    # No modo com janela o servidor retransmite as perdas sozinho, então
+                    # continuamos recebendo até completar o arquivo.
+                    last_segment_received = not windowed
 
-            # Verifica se é o último segmento
-            if flags & FLAG_LAST:
-                logging.info(f"Recebida flag de ÚLTIMO segmento no número {seq_num}")
-                last_segment_received = True
-                expected_total_segments = seq_num + 1
+                if ack_tracker is not None:
+                    ack_tracker.on_segment(seq_num, reassembler, is_new)
+                    if reassembler.complete():
+                        ack_tracker.send() # ACK final: libera o servidor
+                        last_segment_received = True
+
+            now = time.monotonic()
+            delivery.on_arrival(reassembler.received - received_before, now)
+            if reporter.due(now):
+                log_progress(reassembler, transfer_metrics, now)
 
         except socket.timeout:
-            logging.warning("Timeout ao esperar por segmentos.")
-            if not received_segments:
+            if wait < timeout_seconds:
+                logging.info(f"Nenhum segmento em um RTO ({wait:.2f} s): fim da rajada inicial.")
+            else:
+                logging.warning("Timeout ao esperar por segmentos.")
+            if not reassembler.received and reassembler.total_segments is None:
+                 if bare_fallback:
+                     logging.warning("Nenhuma resposta ao GET com opções. Repetindo com o GET original.")
+                     bare_fallback = False
+                     if not send_request(udp_socket, server_address, filename, {}, flow):
+                         return False
+                     request_sent_at = time.monotonic()
+                     continue
                  logging.error("Nenhum segmento recebido do servidor. Abortando.")
-                 udp_socket.close()
-                 return
-            # Se já recebemos algo, o timeout pode indicar o fim da rajada inicial
-            # ou perda do último segmento. Saímos do loop para verificar o que falta.
+                 return False
+            # Se já recebemos algo (ou o OK com o tamanho), o timeout pode indicar o fim da rajada
+            # inicial ou perda do último segmento. Saímos do loop para verificar o que falta.
             break
         except Exception as e:
             logging.error(f"Erro durante o recebimento: {e}", exc_info=True)
             # Considerar abortar ou tentar continuar? Por segurança, vamos parar.
-            udp_socket.close()
-            return
+            return False
 
 
     # --- Fase de Verificação e Retransmissão ---
-    if expected_total_segments is None and highest_seq_num_received > -1:
-        # Se o último pacote (com a flag) foi perdido, mas recebemos outros
-        logging.warning("Flag de último segmento não recebida. Estimando total com base no maior recebido.")
-        # É uma heurística. Poderia ser N ou N+k se os últimos k se perderam.
-        # Vamos pedir retransmissão do que achamos ser o último para confirmar.
-        expected_total_segments = highest_seq_num_received + 1 # Suposição inicial
-
-    elif expected_total_segments is None and highest_seq_num_received == -1:
-        logging.error("Nenhum segmento válido recebido ou flag de último não chegou. Impossível continuar.")
-        udp_socket.close()
-        return
-
+    if reassembler.total_segments is None:
+        # Sem o tamanho no OK (GET original) e sem o último pacote (com a flag), pedimos também
+        # tudo a partir do maior segmento recebido; o servidor limita o pedido ao tamanho real.
+        logging.warning("Flag de último segmento não recebida. Pedindo também o final do arquivo.")
 
+    # Cada rodada pede tudo o que falta e termina assim que nada mais falta, ou depois de um
+    # RTO sem receber nada além do tempo estimado para o servidor reenviar o que ainda falta
+    # do pedido (ritmo medido em DeliveryRate), para não pedir de novo segmentos ainda na fila
+    # dele. Só rodadas sem nenhum segmento novo contam como tentativa (e dobram o RTO); as
+    # demais mostram que o servidor está respondendo.
     retry_count = 0
     while retry_count < max_retries:
-        missing_segments = []
-        if expected_total_segments is not None:
-            all_expected = set(range(expected_total_segments))
-            received_set = set(received_segments.keys())
-            missing_segments = sorted(list(all_expected - received_set))
-
-        if not missing_segments:
+        missing_ranges = reassembler.missing_ranges()
+        if not missing_ranges:
             logging.info("Todos os segmentos foram recebidos com sucesso!")
             break # Saia do loop de retentativas
 
-        logging.warning(f"Segmentos faltando: {missing_segments} (Tentativa {retry_count + 1}/{max_retries})")
+        logging.warning(f"Segmentos faltando em {len(missing_ranges)} intervalos {missing_ranges[:10]} (Tentativa {retry_count + 1}/{max_retries}, RTO {rtt.rto:.2f} s)")
 
         # Solicita retransmissão dos segmentos faltantes
-        for seq_num_miss in missing_segments:
-            retrans_req = f"RETRANS {seq_num_miss}\n".encode('utf-8')
-            try:
-                logging.info(f"Solicitando retransmissão do segmento {seq_num_miss}")
-                udp_socket.sendto(retrans_req, server_address)
-                time.sleep(0.01) # Pequena pausa entre requisições
-            except socket.error as e:
-                 logging.error(f"Erro ao enviar pedido RETRANS para seg {seq_num_miss}: {e}")
-
+        send_nacks(udp_socket, server_address, missing_ranges, session_id, transfer_metrics)
+        nack_sent_at = time.monotonic()
+        # Sem o total, o último intervalo vai até o fim do arquivo e não entra na estimativa
+        requested = sum(count for _, count in (missing_ranges if reassembler.total_segments is not None else missing_ranges[:-1]))
+        delivery.start()
+        deadline = nack_sent_at + rtt.rto + delivery.drain_time(requested)
 
         # Tenta receber os segmentos retransmitidos
-        receive_start_time = time.time()
         newly_received_count = 0
-        while time.time() - receive_start_time < timeout_seconds * 5: # Dê mais tempo para retransmissões
+        while not reassembler.complete():
+             wait = deadline - time.monotonic()
+             if wait <= 0:
+                 logging.debug("[RETRANS] Timeout esperando por segmentos retransmitidos.")
+                 break
              try:
-                 segment, sender_address = udp_socket.recvfrom(BUFFER_SIZE)
-                 if sender_address != server_address: continue
-
-                 if len(segment) < HEADER_SIZE: continue
-                 header = segment[:HEADER_SIZE]
-                 data = segment[HEADER_SIZE:]
-                 seq_num, checksum_recv, flags = struct.unpack(HEADER_FORMAT, header)
-
-                 # Verificar checksum novamente
-                 checksum_calc = calculate_checksum(data)
-                 if checksum_recv != checksum_calc:
-                     logging.error(f"[RETRANS] Checksum inválido para segmento {seq_num}. Descartado.")
-                     continue
+                 total_learned = False
+                 received_before = newly_received_count
+                 for segment, sender_address in receiver.receive(wait):
+                     if sender_address != server_address: continue
 
-                 if seq_num in missing_segments and seq_num not in received_segments:
-                     logging.info(f"[RETRANS] Recebido segmento faltante {seq_num} (Size: {len(data)}, Checksum OK)")
-                     received_segments[seq_num] = data
-                     highest_seq_num_received = max(highest_seq_num_received, seq_num)
-                     newly_received_count += 1
+                     if segment[:6] == b'ERROR ':
+                         log_server_error(segment, reassembler)
+                         return False
+                     if segment[:len(protocol.OK_PREFIX)] == protocol.OK_PREFIX:
+                         accepted = protocol.parse_ok_response(bytes(segment))
+                         if not negotiation_accepted(accepted, reassembler, codec):
+                             return False
+                         announce_total(reassembler, accepted, segment_range)
+                         if reassembler.version is None:
+                             reassembler.version = accepted.get(protocol.OPTION_VERSION)
+                         if protocol.OPTION_SESSION in accepted:
+                             session_id = int(accepted[protocol.OPTION_SESSION])
+                         continue
+                     if len(segment) < header_size: continue
+                     seq_num, checksum_recv, flags = segment_header.unpack_from(segment)
+                     if flags & FLAG_SESSION and len(segment) < header_size + protocol.SESSION_ID.size: continue
+                     segment_session, data = split_segment(segment, flags, header_size)
+                     if segment_session != session_id:
+                         if session_id is not None: continue
+                         session_id = segment_session
 
-                     # Se recebermos um segmento com flag LAST que não tínhamos antes
-                     if flags & FLAG_LAST and expected_total_segments != (seq_num + 1):
-                          logging.info(f"[RETRANS] Flag de ÚLTIMO segmento ({seq_num}) recebida/confirmada.")
-                          expected_total_segments = seq_num + 1
-                          # Precisamos recalcular os missing com base no novo total? Sim.
-                          # Melhor sair deste loop interno e refazer a verificação completa.
-                          break # Sai do loop de recebimento de retransmissões
+                     # Verificar checksum novamente
+                     checksum_calc = calculate_checksum(data)
+                     if checksum_recv != checksum_calc:
+                         transfer_metrics.checksum_failures += 1
+                         if TRACER.enabled and TRACER.sample():
+                             TRACER.debug(f"[RETRANS] Checksum inválido para segmento {seq_num}. Descartado.")
+                         continue
 
-                 # Otimização: Se recebemos todos os que pedimos nesta rodada, podemos sair mais cedo
-                 # (Requer checar se 'missing_segments' agora está vazio após adicionar este)
+                     total_known = reassembler.total_segments is not None
+                     if flags & FLAG_PARITY:
+                         if recovery is not None:
+                             try:
+                                 recovered = recovery.add_parity(seq_num, data, bool(flags & FLAG_LAST))
+                             except ValueError:
+                                 continue
+                             newly_received_count += len(recovered)
+                             if store_recovered(recovered, transfer_metrics, decompressor) and not total_known:
+                                 total_learned = True
+                         continue
+                     if reassembler.add(seq_num, data, bool(flags & FLAG_LAST)):
+                         if TRACER.enabled and TRACER.sample():
+                             TRACER.debug(f"[RETRANS] Recebido segmento faltante {seq_num} (Size: {len(data)})")
+                         newly_received_count += 1
+                         transfer_metrics.segments_received += 1
+                         transfer_metrics.bytes_received += len(data)
+                         if decompressor is not None:
+                             decompressor.advance(seq_num, data)
+
+                         # Se recebermos um segmento com flag LAST que não tínhamos antes
+                         if flags & FLAG_LAST and not total_known:
+                              logging.info(f"[RETRANS] Flag de ÚLTIMO segmento ({seq_num}) recebida/confirmada.")
+                              # Precisamos recalcular os missing com base no novo total? Sim.
+                              # Terminamos a rajada e refazemos a verificação completa.
+                              total_learned = True
+                         if recovery is not None:
+                             recovered = recovery.on_segment(seq_num)
+                             newly_received_count += len(recovered)
+                             if store_recovered(recovered, transfer_metrics, decompressor) and not total_known:
+                                 total_learned = True
+                     else:
+                         transfer_metrics.duplicates += 1
+                 now = time.monotonic()
+                 if newly_received_count > received_before:
+                     if not received_before and not retry_count:
+                         # Primeira resposta ao NACK; depois de uma rodada sem resposta, a amostra
+                         # seria ambígua (algoritmo de Karn)
+                         rtt.sample(now - nack_sent_at)
+                     delivery.on_arrival(newly_received_count - received_before, now)
+                     # O servidor ainda está reenviando: espera o restante do pedido mais um RTO
+                     remaining = max(0, requested - newly_received_count)
+                     deadline = max(deadline, now + rtt.rto + delivery.drain_time(remaining))
+                 if reporter.due(now):
+                     log_progress(reassembler, transfer_metrics, now)
+                 if total_learned:
+                     break # Sai do loop de recebimento de retransmissões
 
              except socket.timeout:
                   logging.debug("[RETRANS] Timeout esperando por segmentos retransmitidos.")
@@ -218,46 +736,298 @@ def start_client(server_addr_str, filename, output_filename=None, loss_probabili
                   logging.error(f"[RETRANS] Erro durante recebimento de retransmissão: {e}")
                   break # Sai do loop de recebimento de retransmissões
 
-        if newly_received_count == 0 and missing_segments:
+        if newly_received_count == 0:
              logging.warning("Nenhum dos segmentos retransmitidos solicitados foi recebido nesta tentativa.")
+             retry_count += 1
+             rtt.backoff()
+        else:
+             retry_count = 0
 
-        retry_count += 1
 
+    # --- Finalização do Arquivo ---
+    if reassembler.total_segments is None:
+         logging.error("Não foi possível determinar o número total de segmentos. O download poderá ser retomado.")
+         return False
 
-    # --- Montagem Final do Arquivo ---
-    if expected_total_segments is None:
-         logging.error("Não foi possível determinar o número total de segmentos. Abortando montagem.")
-         udp_socket.close()
-         return
+    if not reassembler.complete():
+        final_missing = reassembler.missing_ranges()
+        logging.error(f"Falha ao receber todos os segmentos após {max_retries} tentativas. Intervalos ainda faltando: {final_missing[:10]}. Execute novamente para retomar o download.")
+        return False
 
-    final_missing = sorted(list(set(range(expected_total_segments)) - set(received_segments.keys())))
+    logging.info(f"Todos os {reassembler.total_segments} segmentos recebidos. Finalizando o arquivo: {reassembler.output_filename}")
+    try:
+        reassembler.finish()
+        if decompressor is not None:
+            decompressor.finish()
+    except (OSError, ValueError) as e:
+        logging.error(f"Erro ao finalizar o arquivo de saída {reassembler.output_filename}: {e}")
+        return False
+    output_filename = decompressor.output_filename if decompressor is not None else reassembler.output_filename
+    logging.info(f"Arquivo {output_filename} salvo com sucesso!")
+    return True
 
-    if final_missing:
-        logging.error(f"Falha ao receber todos os segmentos após {max_retries} tentativas. Segmentos ainda faltando: {final_missing}")
-        success = False
-    else:
-        logging.info(f"Todos os {expected_total_segments} segmentos recebidos. Montando o arquivo: {output_filename}")
-        try:
-            with open(output_filename, 'wb') as f_out:
-                for i in range(expected_total_segments):
-                    if i in received_segments:
-                        f_out.write(received_segments[i])
-                    else:
-                        # Isso não deveria acontecer se final_missing estava vazio, mas é uma checagem de segurança
-                        logging.error(f"Erro crítico: Segmento {i} ausente durante a escrita final!")
-                        raise IOError(f"Segmento {i} ausente inesperadamente.")
-            logging.info(f"Arquivo {output_filename} salvo com sucesso!")
-            success = True
-        except IOError as e:
-            logging.error(f"Erro ao escrever o arquivo de saída {output_filename}: {e}")
-            success = False
-        except Exception as e:
-             logging.error(f"Erro inesperado ao montar o arquivo: {e}")
-             success = False
+def log_progress(reassembler, transfer_metrics, now):
+    total = reassembler.total_segments if reassembler.total_segments is not None else '?'
+    logging.info(f"Progresso: {reassembler.received}/{total} segmentos ({transfer_metrics.summary(now)})")
+
+
+def fetch_manifest(server_address, filename, payload_size, timeout_seconds, max_retries, block_segments=protocol.DEFAULT_BLOCK_SEGMENTS):
+    """Baixa o manifesto de blocos do arquivo; retorna (opções do OK, digests concatenados) ou None.
+
+    As páginas são pedidas em janelas de até MAX_MANIFEST_PAGES; as que se perderem são pedidas
+    de novo na rodada seguinte. max_retries rodadas seguidas sem nenhuma página nova desistem.
+    """
+    options = {protocol.OPTION_BLOCK: block_segments}
+    if payload_size != DATA_PAYLOAD_SIZE:
+        options[protocol.OPTION_PAYLOAD] = payload_size
+    accepted = None
+    total_pages = None
+    pages = {}
+    failures = 0
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        recvpath.set_receive_buffer(sock, protocol.MAX_MANIFEST_PAGES * 1500) # Uma janela de páginas chega de uma vez
+        while failures < max_retries and (total_pages is None or len(pages) < total_pages):
+            if total_pages is None:
+                window = range(0, protocol.MAX_MANIFEST_PAGES) # Sem a opção pages o servidor manda as primeiras
+                options.pop(protocol.OPTION_PAGES, None)
+            else:
+                first = next(page for page in range(total_pages) if page not in pages)
+                window = range(first, min(total_pages, first + protocol.MAX_MANIFEST_PAGES))
+                options[protocol.OPTION_PAGES] = protocol.format_range(window[0], window[-1])
+            known = len(pages)
+            sock.settimeout(timeout_seconds) # Até a primeira resposta; depois, MANIFEST_WAIT entre datagramas
+            try:
+                sock.sendto(protocol.build_manifest_request(filename, options), server_address)
+                while not all(page in pages for page in window):
+                    message, sender_address = sock.recvfrom(BUFFER_SIZE)
+                    if sender_address != server_address:
+                        continue
+                    sock.settimeout(min(MANIFEST_WAIT, timeout_seconds))
+                    if message.startswith(b'ERROR '):
+                        logging.error(f"Erro recebido do servidor: {message.decode('utf-8', errors='ignore').strip()}")
+                        return None
+                    if message.startswith(protocol.OK_PREFIX):
+                        reply = protocol.parse_ok_response(message)
+                        if accepted is not None and reply.get(protocol.OPTION_VERSION) != accepted.get(protocol.OPTION_VERSION):
+                            logging.warning(f"{filename} mudou no servidor durante a leitura do manifesto. Recomeçando.")
+                            pages.clear()
+                        accepted = reply
+                        total_pages = int(accepted[protocol.OPTION_PAGES])
+                        window = range(window.start, min(window.stop, total_pages))
+                        continue
+                    if message.startswith(protocol.MANIFEST_MAGIC) and total_pages is not None:
+                        try:
+                            page, digests = protocol.parse_manifest_page(message)
+                        except ValueError as e:
+                            logging.warning(f"{e}. Ignorando.")
+                            continue
+                        if page < total_pages:
+                            pages[page] = digests
+            except socket.timeout:
+                pass
+            except (KeyError, ValueError):
+                logging.error("Resposta inválida do servidor ao MANIFEST (o servidor suporta transferências delta?).")
+                return None
+            except socket.error as e:
+                logging.error(f"Erro ao pedir o manifesto de {filename}: {e}")
+                return None
+            if len(pages) == known:
+                failures += 1
+                logging.warning(f"Timeout esperando o manifesto de {filename} (Tentativa {failures}/{max_retries})")
+            else:
+                failures = 0
+
+    if total_pages is None or len(pages) < total_pages:
+        return None
+    digests = b''.join(pages[page] for page in range(total_pages))
+    if len(digests) != int(accepted[protocol.OPTION_BLOCKS]) * protocol.MANIFEST_DIGEST_SIZE:
+        logging.error(f"Manifesto de {filename} incompleto ({len(digests) // protocol.MANIFEST_DIGEST_SIZE} de {accepted[protocol.OPTION_BLOCKS]} blocos).")
+        return None
+    return accepted, digests
+
+
+def prepare_delta(server_address, filename, output_filename, payload_size, timeout_seconds, max_retries):
+    """Compara a cópia local em output_filename com o manifesto do servidor.
+
+    Retorna True se a cópia já é idêntica. Senão, se algum bloco confere, a cópia é adotada
+    como download interrompido (reassembly.adopt_local_copy) e o download que segue pede só os
+    segmentos dos outros blocos; sem manifesto ou sem blocos iguais, o arquivo é baixado inteiro.
+    """
+    result = fetch_manifest(server_address, filename, payload_size, timeout_seconds, max_retries)
+    if result is None:
+        logging.warning(f"Manifesto de {filename} indisponível. Baixando o arquivo inteiro.")
+        return False
+    accepted, remote = result
+    size = int(accepted[protocol.OPTION_SIZE])
+    block_segments = int(accepted[protocol.OPTION_BLOCK])
+    blocks = len(remote) // protocol.MANIFEST_DIGEST_SIZE
+
+    start = time.perf_counter()
+    try:
+        local = manifest.file_digests(output_filename, block_segments * payload_size)
+    except OSError as e:
+        logging.warning(f"Não foi possível ler a cópia local {output_filename}: {e}. Baixando o arquivo inteiro.")
+        return False
+    matching = manifest.matching_blocks(local, remote)
+    logging.info(f"Delta de {filename}: {len(matching)}/{blocks} blocos iguais à cópia local ({time.perf_counter() - start:.3f} s para resumi-la)")
+
+    if len(matching) == blocks and os.path.getsize(output_filename) == size:
+        logging.info(f"{output_filename} já está atualizado.")
+        return True
+    if not matching:
+        return False
+    total_segments = max(1, (size + payload_size - 1) // payload_size)
+    present = [(block * block_segments, min(block_segments, total_segments - block * block_segments)) for block in matching]
+    try:
+        reassembly.adopt_local_copy(output_filename, filename, payload_size, total_segments, size, present, accepted[protocol.OPTION_VERSION])
+    except OSError as e:
+        logging.warning(f"Não foi possível aproveitar a cópia local {output_filename}: {e}. Baixando o arquivo inteiro.")
+    return False
+
+
+def probe_file(server_address, filename, timeout_seconds, max_retries, payload_size=DATA_PAYLOAD_SIZE, codec=None):
+    """Pede o tamanho do arquivo ao servidor (HEAD); retorna (tamanho, total de segmentos) ou None.
+
+    Com codec, o tamanho e os segmentos são os da imagem comprimida.
+    """
+    options = {}
+    if payload_size != DATA_PAYLOAD_SIZE:
+        options[protocol.OPTION_PAYLOAD] = payload_size
+    if codec is not None:
+        options[protocol.OPTION_COMPRESSION] = codec.name
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout_seconds)
+        for attempt in range(max_retries):
+            try:
+                sock.sendto(protocol.build_head_request(filename, options), server_address)
+                while True:
+                    message, sender_address = sock.recvfrom(BUFFER_SIZE)
+                    if sender_address != server_address:
+                        continue
+                    if message.startswith(b'ERROR '):
+                        logging.error(f"Erro recebido do servidor: {message.decode('utf-8', errors='ignore').strip()}")
+                        return None
+                    if message.startswith(protocol.OK_PREFIX):
+                        accepted = protocol.parse_ok_response(message)
+                        if int(accepted.get(protocol.OPTION_PAYLOAD, DATA_PAYLOAD_SIZE)) != payload_size:
+                            logging.error(f"Servidor não aceitou segmentos de {payload_size} bytes.")
+                            return None
+                        if codec is not None and accepted.get(protocol.OPTION_COMPRESSION) != codec.name:
+                            logging.error(f"Servidor não aceitou a compressão {codec.name}.")
+                            return None
+                        return int(accepted[protocol.OPTION_SIZE]), int(accepted[protocol.OPTION_SEGMENTS])
+            except socket.timeout:
+                logging.warning(f"Timeout esperando o tamanho de {filename} (Tentativa {attempt + 1}/{max_retries})")
+            except (KeyError, ValueError):
+                logging.error("Resposta inválida do servidor ao HEAD (o servidor suporta vários fluxos?).")
+                return None
+            except socket.error as e:
+                logging.error(f"Erro ao consultar o tamanho de {filename}: {e}")
+                return None
+    return None
+
+
+def split_ranges(total_segments, streams):
+    """Divide os segmentos em streams intervalos contíguos (início, fim exclusivo) de tamanhos próximos."""
+    ranges = []
+    for i in range(streams):
+        ranges.append((total_segments * i // streams, total_segments * (i + 1) // streams))
+    return ranges
+
+
+def load_stream_layout(output_filename, filename):
+    """Divisão (payload_size, streams, compressão) de um download em vários fluxos anterior, ou None."""
+    try:
+        with open(output_filename + STREAM_LAYOUT_SUFFIX) as f:
+            layout = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if layout.get('filename') != filename:
+        return None
+    return layout.get('payload_size'), layout.get('streams'), layout.get('compression')
+
+
+def save_stream_layout(output_filename, filename, payload_size, streams, compression_name=None):
+    try:
+        with open(output_filename + STREAM_LAYOUT_SUFFIX, 'w') as f:
+            json.dump({'filename': filename, 'payload_size': payload_size, 'streams': streams, 'compression': compression_name}, f)
+    except OSError as e:
+        logging.warning(f"Não foi possível gravar a divisão dos fluxos: {e}")
+
+
+def start_streams(server_addr_str, filename, output_filename=None, streams=2, use_processes=False, loss_probability=0.0, timeout_seconds=10.0, max_retries=5, flow=protocol.FLOW_WINDOW, checksum_name=checksum.DEFAULT_ALGORITHM, payload_size=None, probe_mtu=False, compression_name=None, fec_group=None):
+    """Baixa o arquivo em vários fluxos paralelos e junta as partes no arquivo de saída.
+
+    Cada fluxo tem seu próprio socket e pede um intervalo disjunto de segmentos (opção range),
+    gravando em <saída>.stream<i>. Com use_processes cada fluxo roda em um processo, senão em
+    uma thread. Fluxos concluídos em uma execução anterior não são baixados de novo, e os
+    incompletos são retomados com a mesma divisão (salva em <saída>.streams).
+
+    Com compression_name, os fluxos dividem a imagem comprimida, que é descomprimida depois
+    de juntada. fec_group vale para cada fluxo (grupos de paridade dentro do seu intervalo).
+    """
+    try:
+        server_address = parse_address(server_addr_str)
+    except argparse.ArgumentTypeError as e:
+        logging.error(e)
+        return False
+    if not output_filename:
+        output_filename = f"downloaded_{os.path.basename(filename)}"
+
+    layout = load_stream_layout(output_filename, filename)
+    if layout is not None:
+        payload_size, streams, compression_name = layout
+        logging.info(f"Retomando download em {streams} fluxos com segmentos de {payload_size} bytes.")
+    elif probe_mtu:
+        payload_size = probe_payload_size(server_address, timeout_seconds, payload_size or protocol.MAX_PAYLOAD_SIZE)
+    payload_size = payload_size or DATA_PAYLOAD_SIZE
+    try:
+        codec = compression.get_codec(compression_name) if compression_name else None
+    except ValueError as e:
+        logging.error(e)
+        return False
+    # Os fluxos baixam a imagem comprimida, que é juntada em <saída>.<codec>
+    image_filename = f"{output_filename}.{codec.name}" if codec is not None else output_filename
+
+    info = probe_file(server_address, filename, timeout_seconds, max_retries, payload_size, codec)
+    if info is None:
+        logging.error(f"Não foi possível obter o tamanho de {filename}. Abortando.")
+        return False
+    file_size, total_segments = info
+    streams = max(1, min(streams, total_segments))
+    save_stream_layout(output_filename, filename, payload_size, streams, compression_name)
+    ranges = split_ranges(total_segments, streams)
+    stream_files = [f"{image_filename}{STREAM_SUFFIX}{i}" for i in range(streams)]
+    logging.info(f"Baixando {filename} ({file_size} bytes, {total_segments} segmentos) em {streams} fluxos")
+
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    with executor_class(max_workers=streams) as executor:
+        futures = []
+        for (first, end), stream_file in zip(ranges, stream_files):
+            expected_size = min(end * payload_size, file_size) - first * payload_size
+            if os.path.exists(stream_file) and os.path.getsize(stream_file) == expected_size:
+                logging.info(f"Fluxo {stream_file} já concluído em uma execução anterior.")
+                futures.append(None)
+                continue
+            futures.append(executor.submit(start_client, server_addr_str, filename, stream_file, loss_probability, timeout_seconds,
+                                           max_retries, flow, checksum_name, (first, end), payload_size, False, compression_name, fec_group))
+        results = [future is None or future.result() for future in futures]
+
+    if not all(results):
+        failed = [stream_file for stream_file, ok in zip(stream_files, results) if not ok]
+        logging.error(f"Fluxos incompletos: {failed}. Execute novamente para retomar.")
+        return False
+    try:
+        reassembly.stitch_files(stream_files, image_filename)
+        if codec is not None:
+            reassembly.decompress_file(image_filename, output_filename, codec)
+        os.remove(output_filename + STREAM_LAYOUT_SUFFIX)
+    except (OSError, ValueError) as e:
+        logging.error(f"Erro ao juntar os fluxos em {output_filename}: {e}")
+        return False
+    logging.info(f"Arquivo {output_filename} salvo com sucesso a partir de {streams} fluxos!")
+    return True
 
-    udp_socket.close()
-    logging.info("Conexão do cliente fechada.")
-    return success
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Cliente UDP para transferência confiável de arquivos.")
@@ -265,13 +1035,44 @@ if __name__ == "__main__":
     parser.add_argument("filename", type=str, help="Nome do arquivo a ser requisitado do servidor.")
     parser.add_argument("-o", "--output", type=str, default="downloaded_text.txt", help="Nome do arquivo local para salvar (padrão: downloaded_<filename>)")
     parser.add_argument("-l", "--loss", type=float, default=0.1, help="Probabilidade de simular perda de pacotes recebidos (0.0 a 1.0, ex: 0.1 para 10%%)")
-    parser.add_argument("-t", "--timeout", type=float, default=2.0, help="Timeout em segundos para esperar por pacotes (ex: 2.0)")
-    parser.add_argument("-r", "--retries", type=int, default=5, help="Número máximo de tentativas de retransmissão (ex: 5)")
+    parser.add_argument("-t", "--timeout", type=float, default=2.0, help="Timeout em segundos para esperar pela resposta do servidor (ex: 2.0); depois, as esperas seguem o RTO medido")
+    parser.add_argument("-r", "--retries", type=int, default=5, help="Número máximo de rodadas de retransmissão seguidas sem resposta (ex: 5)")
+    parser.add_argument("-c", "--checksum", choices=sorted(checksum.ALGORITHMS), default=checksum.DEFAULT_ALGORITHM, help="Algoritmo de checksum negociado com o servidor (padrão: sum, compatível com a versão original)")
+    parser.add_argument("-f", "--flow", choices=[protocol.FLOW_WINDOW, protocol.FLOW_FIXED], default=protocol.FLOW_WINDOW, help="Modo de envio: 'window' (janela deslizante com ACKs, padrão) ou 'fixed' (sem janela, modo original)")
+    parser.add_argument("-s", "--streams", type=int, default=1, help="Número de fluxos paralelos, cada um com seu socket e intervalo do arquivo (padrão: 1)")
+    parser.add_argument("--processes", action="store_true", help="Com --streams, executa cada fluxo em um processo separado (usa vários núcleos)")
+    parser.add_argument("--payload-size", type=int, default=None, help=f"Bytes de dados por segmento negociados com o servidor ({protocol.MIN_PAYLOAD_SIZE} a {protocol.MAX_PAYLOAD_SIZE}; padrão: {DATA_PAYLOAD_SIZE})")
+    parser.add_argument("--probe-mtu", action="store_true", help="Descobre o maior segmento que o caminho entrega sem fragmentação (limitado por --payload-size) antes do download")
+    parser.add_argument("-z", "--compression", choices=sorted(compression.CODECS), default=None, help="Pede o arquivo comprimido em blocos com este codec e o descomprime durante o download (padrão: sem compressão)")
+    parser.add_argument("--fec", type=str, default=None, metavar="K|auto", help=f"Pede um segmento de paridade a cada K segmentos ({fec.MIN_GROUP_SIZE} a {fec.MAX_GROUP_SIZE}) para reconstruir perdas sem retransmissão; 'auto' deixa o servidor ajustar K às perdas (padrão: desligado)")
+    parser.add_argument("--delta", action="store_true", help="Se o arquivo de saída já existe, baixa só os blocos que diferem da versão do servidor (manifesto de digests)")
+    parser.add_argument("--trace", type=int, default=0, metavar="N", help="Registra em nível DEBUG um a cada N segmentos recebidos (padrão: 0, desligado)")
 
     args = parser.parse_args()
+    TRACER.configure(args.trace)
 
     if not (0.0 <= args.loss <= 1.0):
         print("Erro: A probabilidade de perda deve estar entre 0.0 e 1.0.")
         exit(1)
 
-    start_client(args.server_address, args.filename, args.output, args.loss, args.timeout, args.retries)
\ No newline at end of file
+    if args.payload_size is not None and not (protocol.MIN_PAYLOAD_SIZE <= args.payload_size <= protocol.MAX_PAYLOAD_SIZE):
+        print(f"Erro: O tamanho de payload deve estar entre {protocol.MIN_PAYLOAD_SIZE} e {protocol.MAX_PAYLOAD_SIZE}.")
+        exit(1)
+
+    if args.fec is not None:
+        try:
+            fec.parse_group_option(args.fec)
+        except ValueError:
+            print(f"Erro: --fec deve ser um número entre {fec.MIN_GROUP_SIZE} e {fec.MAX_GROUP_SIZE} ou '{fec.AUTO}'.")
+            exit(1)
+
+    if args.delta and (args.compression or args.streams > 1):
+        print("Erro: --delta não pode ser combinado com --compression ou --streams.")
+        exit(1)
+
+    if args.streams > 1:
+        start_streams(args.server_address, args.filename, args.output, args.streams, args.processes, args.loss, args.timeout, args.retries, args.flow, args.checksum,
+                      args.payload_size, args.probe_mtu, args.compression, args.fec)
+    else:
+        start_client(args.server_address, args.filename, args.output, args.loss, args.timeout, args.retries, args.flow, args.checksum,
+                     payload_size=args.payload_size, probe_mtu=args.probe_mtu, compression_name=args.compression, fec_group=args.fec, delta=args.delta)
\ No newline at end of file
@@ -0,0 +1,151 @@
+"""Compressão do arquivo transferido, negociada por transferência (opção compression do GET).
+
+O servidor comprime o arquivo em blocos independentes de BLOCK_SIZE bytes. Cada bloco vira um
+quadro (cabeçalho FRAME + dados comprimidos), e a concatenação dos quadros forma a "imagem
+comprimida", que é dividida em segmentos e transmitida como se fosse o próprio arquivo:
+checksums, NACKs, intervalos e retomada funcionam sobre os segmentos da imagem. O cliente
+descomprime cada quadro assim que todos os seus segmentos chegam; um segmento perdido só
+atrasa o bloco a que pertence.
+
+* zlib: sempre disponível.
+* lzma: se o Python foi compilado com o módulo lzma.
+* zstd: se o pacote zstandard estiver instalado.
+
+Executar este arquivo mostra a taxa de compressão e a vazão de cada codec para um arquivo.
+"""
+import struct
+import zlib
+
+try:
+    import lzma
+except ImportError: # Módulo opcional da biblioteca padrão
+    lzma = None
+
+try:
+    import zstandard
+except ImportError: # zstd é opcional: sem ele só zlib (e lzma) são oferecidos
+    zstandard = None
+
+BLOCK_SIZE = 256 * 1024 # Bytes do arquivo original por bloco comprimido
+FRAME = struct.Struct('!I I') # Bytes do bloco na imagem, bytes originais (iguais: bloco guardado sem compressão)
+ZLIB_LEVEL = 6
+LZMA_PRESET = 1 # Presets maiores comprimem pouco mais em texto e são várias vezes mais lentos
+ZSTD_LEVEL = 3
+
+
+class Codec:
+    """Par de funções de compressão e descompressão de um bloco."""
+
+    def __init__(self, name, compress, decompress):
+        self.name = name
+        self.compress = compress
+        self.decompress = decompress
+
+    def __repr__(self):
+        return f"Codec({self.name!r})"
+
+
+CODECS = {
+    'zlib': Codec('zlib', lambda data: zlib.compress(data, ZLIB_LEVEL), zlib.decompress),
+}
+if lzma is not None:
+    CODECS['lzma'] = Codec('lzma', lambda data: lzma.compress(data, preset=LZMA_PRESET), lzma.decompress)
+if zstandard is not None:
+    # Os objetos do zstandard não podem ser compartilhados entre threads; um por chamada é barato
+    CODECS['zstd'] = Codec('zstd', lambda data: zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data),
+                           lambda data: zstandard.ZstdDecompressor().decompress(data))
+
+class DecompressionError(ValueError):
+    """A imagem recebida não pôde ser descomprimida (quadro corrompido ou incompleto)."""
+
+
+_DECODE_ERRORS = (zlib.error,) + ((lzma.LZMAError,) if lzma is not None else ()) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+
+def get_codec(name):
+    """Retorna o codec pelo nome; levanta ValueError se não for suportado (ou não estiver instalado)."""
+    try:
+        return CODECS[name.lower()]
+    except KeyError:
+        raise ValueError(f"Compressão não suportada: {name}")
+
+
+def compress_blocks(codec, data, block_size=BLOCK_SIZE):
+    """Monta a imagem comprimida de data: um quadro por bloco de block_size bytes."""
+    view = memoryview(data)
+    frames = []
+    for start in range(0, len(view), block_size):
+        block = view[start:start + block_size]
+        compressed = codec.compress(block)
+        if len(compressed) >= len(block):
+            compressed = block # Bloco incompressível: vai como está
+        frames.append(FRAME.pack(len(compressed), len(block)))
+        frames.append(compressed)
+    return b''.join(frames)
+
+
+class BlockDecoder:
+    """Descomprime a imagem recebida em ordem, quadro a quadro, à medida que ela é entregue."""
+
+    def __init__(self, codec):
+        self.codec = codec
+        self.pending = bytearray() # Bytes da imagem de um quadro ainda incompleto
+        self.consumed = 0 # Bytes da imagem já decodificados
+        self.produced = 0 # Bytes originais já entregues
+
+    def feed(self, data):
+        """Acrescenta bytes da imagem e retorna a lista de blocos originais completados.
+
+        Levanta DecompressionError se um quadro estiver corrompido.
+        """
+        self.pending += data
+        blocks = []
+        offset = 0
+        while len(self.pending) - offset >= FRAME.size:
+            length, raw_length = FRAME.unpack_from(self.pending, offset)
+            end = offset + FRAME.size + length
+            if len(self.pending) < end:
+                break
+            payload = bytes(self.pending[offset + FRAME.size:end])
+            if length != raw_length:
+                try:
+                    payload = self.codec.decompress(payload)
+                except _DECODE_ERRORS as e:
+                    raise DecompressionError(f"Bloco comprimido inválido na posição {self.consumed + offset}: {e}")
+            if len(payload) != raw_length:
+                raise DecompressionError(f"Bloco na posição {self.consumed + offset} tem {len(payload)} bytes em vez de {raw_length}")
+            blocks.append(payload)
+            self.produced += raw_length
+            offset = end
+        del self.pending[:offset]
+        self.consumed += offset
+        return blocks
+
+    def finished(self):
+        """Verdadeiro se nenhum quadro ficou pela metade."""
+        return not self.pending
+
+
+def run_benchmark(filename, repeat=3):
+    import time
+
+    with open(filename, 'rb') as f:
+        data = f.read()
+    print(f"{filename}: {len(data)} bytes em blocos de {BLOCK_SIZE // 1024} KiB, melhor de {repeat}")
+    for codec in CODECS.values():
+        best_compress = best_decompress = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            image = compress_blocks(codec, data)
+            best_compress = min(best_compress, time.perf_counter() - start)
+            start = time.perf_counter()
+            BlockDecoder(codec).feed(image)
+            best_decompress = min(best_decompress, time.perf_counter() - start)
+        megabytes = len(data) / 2**20
+        print(f"  {codec.name:<6} {len(image):>12} bytes ({len(image) / max(1, len(data)):.1%})"
+              f"  compressão {megabytes / best_compress:>8.1f} MB/s  descompressão {megabytes / best_decompress:>8.1f} MB/s")
+
+
+if __name__ == "__main__":
+    import sys
+    run_benchmark(sys.argv[1] if len(sys.argv) > 1 else 'text.txt')
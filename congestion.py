@@ -0,0 +1,107 @@
+"""Controle de congestionamento e pacing usados pelo modo com janela deslizante."""
+
+INITIAL_CWND = 10.0 # Janela inicial (em segmentos)
+MIN_CWND = 2.0
+MAX_CWND = 8192.0
+INITIAL_RTO = 1.0 # Timeout de retransmissão antes da primeira amostra de RTT (segundos)
+MIN_RTO = 0.2
+MAX_RTO = 8.0
+INITIAL_RTT_GUESS = 0.05 # RTT presumido para o pacing antes da primeira amostra
+PACING_GAIN_SLOW_START = 2.0 # Na partida lenta o ritmo acompanha a janela que dobra a cada RTT
+PACING_GAIN = 1.25
+PACING_BURST = 16 # Capacidade do balde de tokens (segmentos enviados em rajada)
+
+
+class RttEstimator:
+    """Estimativa de RTT e RTO no estilo Jacobson/Karels (RFC 6298)."""
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.min_rtt = None # Menor amostra: o RTT do caminho sem filas nem jitter
+        self.rto = INITIAL_RTO
+
+    def sample(self, rtt):
+        self.min_rtt = rtt if self.min_rtt is None else min(self.min_rtt, rtt)
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(MAX_RTO, max(MIN_RTO, self.srtt + 4 * self.rttvar))
+
+    def backoff(self):
+        """Dobra o RTO após um timeout (backoff exponencial)."""
+        self.rto = min(MAX_RTO, self.rto * 2)
+
+
+class CongestionWindow:
+    """Janela de congestionamento AIMD com partida lenta."""
+
+    def __init__(self):
+        self.cwnd = INITIAL_CWND
+        self.ssthresh = float('inf')
+
+    def in_slow_start(self):
+        return self.cwnd < self.ssthresh
+
+    def on_ack(self, newly_acked):
+        if self.in_slow_start():
+            self.cwnd += newly_acked # Partida lenta: +1 segmento por segmento confirmado
+        else:
+            self.cwnd += newly_acked / self.cwnd # Aumento aditivo: ~+1 segmento por RTT
+        self.cwnd = min(self.cwnd, MAX_CWND)
+
+    def on_loss(self):
+        """Diminuição multiplicativa ao detectar perda."""
+        self.ssthresh = max(self.cwnd / 2, MIN_CWND)
+        self.cwnd = self.ssthresh
+
+    def on_timeout(self):
+        """Timeout de retransmissão: volta para a partida lenta."""
+        self.ssthresh = max(self.cwnd / 2, MIN_CWND)
+        self.cwnd = 1.0
+
+
+class TokenBucket:
+    """Balde de tokens para espaçar os envios (1 token = 1 segmento)."""
+
+    def __init__(self, rate, capacity=PACING_BURST, now=0.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.last_refill = now
+
+    def refill(self, now):
+        elapsed = now - self.last_refill
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.last_refill = now
+
+    def try_consume(self, now):
+        self.refill(now)
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+    def consume_up_to(self, now, count):
+        """Consome até count tokens inteiros disponíveis; retorna quantos foram consumidos."""
+        self.refill(now)
+        taken = min(count, int(self.tokens))
+        self.tokens -= taken
+        return taken
+
+    def time_until_token(self, now):
+        self.refill(now)
+        if self.tokens >= 1.0:
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+
+def pacing_rate(window, rtt):
+    """Ritmo de envio (segmentos/s) para espalhar a janela ao longo de um RTT."""
+    srtt = rtt.srtt if rtt.srtt else INITIAL_RTT_GUESS
+    gain = PACING_GAIN_SLOW_START if window.in_slow_start() else PACING_GAIN
+    return max(1.0, gain * window.cwnd / max(srtt, 1e-4))
@@ -0,0 +1,141 @@
+"""Correção de erros antecipada (FEC) com paridade XOR por grupo de segmentos.
+
+O servidor envia, depois de cada grupo de K segmentos consecutivos, um segmento de paridade
+com o XOR dos dados do grupo (os segmentos menores são completados com zeros). Se um único
+segmento do grupo se perder, o cliente o reconstrói com a paridade e os outros K - 1, sem
+esperar a volta de um NACK; com duas ou mais perdas no grupo, a paridade fica guardada até
+que as retransmissões deixem só uma faltando.
+
+O XOR é feito sobre inteiros de Python (int.from_bytes), que opera sobre o buffer inteiro
+em C, sem laço por byte.
+
+O tamanho dos grupos é pedido pelo cliente (opção fec) ou, com 'auto', ajustado pelo
+servidor conforme as perdas que a paridade não cobriu: cada grupo seguido de
+retransmissões reduz o próximo à metade; cada grupo sem retransmissões o aumenta em um.
+"""
+import protocol
+
+DEFAULT_GROUP_SIZE = 16 # Também o tamanho inicial no modo auto
+MIN_GROUP_SIZE = 2
+MAX_GROUP_SIZE = 255
+MAX_AUTO_GROUP_SIZE = 64 # Redundância mínima de ~1,6% no modo auto
+AUTO = 'auto'
+
+
+def parse_group_option(value):
+    """Interpreta a opção fec; retorna (tamanho do grupo, adaptativo). Levanta ValueError se inválida."""
+    if value == AUTO:
+        return DEFAULT_GROUP_SIZE, True
+    try:
+        group_size = int(value)
+    except ValueError:
+        raise ValueError(f"Grupo de FEC inválido: {value}")
+    if not MIN_GROUP_SIZE <= group_size <= MAX_GROUP_SIZE:
+        raise ValueError(f"Grupo de FEC fora dos limites ({MIN_GROUP_SIZE} a {MAX_GROUP_SIZE}, ou '{AUTO}'): {value}")
+    return group_size, False
+
+
+def build_parity(payloads):
+    """Dados do segmento de paridade de um grupo: PARITY_INFO seguido do XOR dos payloads."""
+    parity = 0
+    lengths = 0
+    size = 0
+    for payload in payloads:
+        parity ^= int.from_bytes(payload, 'little') # Little-endian: os bytes que faltam nos menores contam como zeros
+        lengths ^= len(payload)
+        size = max(size, len(payload))
+    return protocol.PARITY_INFO.pack(len(payloads), lengths) + parity.to_bytes(size, 'little')
+
+
+def parse_parity(data):
+    """Separa (quantidade de segmentos, XOR dos tamanhos, XOR dos dados); levanta ValueError se malformado."""
+    if len(data) < protocol.PARITY_INFO.size:
+        raise ValueError(f"Segmento de paridade muito curto ({len(data)} bytes)")
+    count, lengths = protocol.PARITY_INFO.unpack_from(data)
+    if not 0 < count <= MAX_GROUP_SIZE:
+        raise ValueError(f"Grupo de paridade com {count} segmentos")
+    return count, lengths, data[protocol.PARITY_INFO.size:]
+
+
+class GroupSizer:
+    """Tamanho dos grupos de paridade de uma transferência no servidor."""
+
+    def __init__(self, group_size, adaptive=False):
+        self.group_size = group_size
+        self.adaptive = adaptive
+        self.retransmissions = 0 # Retransmissões vistas ao fechar o grupo anterior
+
+    def next_group(self, retransmissions):
+        """Tamanho do próximo grupo, dado o total de retransmissões da transferência até agora."""
+        if self.adaptive:
+            if retransmissions > self.retransmissions:
+                self.group_size = max(MIN_GROUP_SIZE, self.group_size // 2)
+            else:
+                self.group_size = min(MAX_AUTO_GROUP_SIZE, self.group_size + 1)
+            self.retransmissions = retransmissions
+        return self.group_size
+
+
+class Recovery:
+    """Reconstrói no cliente os segmentos perdidos a partir da paridade recebida.
+
+    Os segmentos do grupo são lidos de volta do Reassembler; o reconstruído é gravado nele
+    como se tivesse chegado do servidor.
+    """
+
+    def __init__(self, reassembler):
+        self.reassembler = reassembler
+        self.groups = {} # Primeiro segmento -> (quantidade, XOR dos tamanhos, grupo final, paridade) com 2+ faltando
+        self.waiting = {} # Segmento faltante -> primeiro segmento do seu grupo guardado
+
+    def _missing(self, first, count):
+        return [seq_num for seq_num in range(first, first + count) if seq_num not in self.reassembler]
+
+    def add_parity(self, first, data, final):
+        """Registra a paridade do grupo que começa em first; retorna os segmentos reconstruídos.
+
+        Cada item é (número de sequência, dados, é o último segmento). final indica que o
+        grupo termina no último segmento (a paridade veio com FLAG_LAST). Levanta ValueError
+        se a paridade for malformada.
+        """
+        count, lengths, parity = parse_parity(data)
+        if first in self.groups:
+            return []
+        missing = self._missing(first, count)
+        if len(missing) == 1:
+            return self._rebuild(first, count, lengths, final, parity, missing[0])
+        if missing:
+            self.groups[first] = (count, lengths, final, bytes(parity))
+            for seq_num in missing:
+                self.waiting[seq_num] = first
+        return []
+
+    def on_segment(self, seq_num):
+        """Chamado a cada segmento novo; retorna os segmentos que ele permitiu reconstruir."""
+        first = self.waiting.pop(seq_num, None)
+        if first is None:
+            return []
+        count, lengths, final, parity = self.groups[first]
+        missing = self._missing(first, count)
+        if len(missing) > 1:
+            return []
+        del self.groups[first]
+        if not missing:
+            return []
+        self.waiting.pop(missing[0], None)
+        return self._rebuild(first, count, lengths, final, parity, missing[0])
+
+    def _rebuild(self, first, count, lengths, final, parity, seq_num):
+        value = int.from_bytes(parity, 'little')
+        for other in range(first, first + count):
+            if other != seq_num:
+                data = self.reassembler.read(other)
+                value ^= int.from_bytes(data, 'little')
+                lengths ^= len(data)
+        if lengths > len(parity) or value.bit_length() > 8 * len(parity):
+            return [] # Paridade inconsistente com os segmentos recebidos
+        data = value.to_bytes(len(parity), 'little')[:lengths]
+        is_last = final and seq_num == first + count - 1
+        if not self.reassembler.add(seq_num, data, is_last):
+            return []
+        return [(seq_num, data, is_last)]
@@ -0,0 +1,243 @@
+"""Cache de arquivos do servidor: mapeamentos mmap com checksums por segmento.
+
+Um GET valida a entrada do arquivo com um único stat (tamanho e mtime); retransmissões e GETs
+repetidos usam o mapeamento e os checksums já calculados, sem reabrir nem reler o arquivo.
+As entradas são descartadas em ordem LRU quando o cache passa de max_bytes ou max_files.
+
+Cada transferência pode negociar seu tamanho de segmento: o mesmo mapeamento é compartilhado
+entre as divisões do arquivo em tamanhos diferentes (veja CachedFile.with_payload_size).
+A imagem comprimida de cada codec (veja compression.py) é montada no primeiro pedido, fora do
+loop de eventos do servidor (CachedFile.compress pode rodar em outra thread), e guardada junto
+da entrada com FileCache.add_image, contando no limite de bytes do cache. Os digests do manifesto
+de blocos (veja manifest.py) seguem o mesmo caminho (CachedFile.compute_manifest em outra thread,
+add_manifest no loop) e são invalidados junto com a entrada, ou seja, valem para uma só versão.
+
+Arquivos servidos devem ser substituídos (escrita em outro arquivo + rename) e não truncados
+no lugar: acessar um trecho truncado de um mmap encerra o processo com SIGBUS.
+"""
+import array
+import collections
+import logging
+import mmap
+import os
+import time
+
+import checksum
+import compression
+import manifest
+
+CHECKSUM_BLOCK = 256 # Segmentos cujos checksums são calculados de uma vez (em lote)
+
+
+class CachedFile:
+    """Arquivo mapeado em memória, dividido em segmentos de payload_size bytes.
+
+    Com data, o "arquivo" é a imagem comprimida do source (codec) em vez do conteúdo em disco.
+    """
+
+    def __init__(self, filename, payload_size, source=None, data=None, codec=None):
+        self.filename = filename
+        self.payload_size = payload_size
+        self.codec = codec
+        if data is not None:
+            self.size = len(data)
+            self.original_size = source.size
+            self.mtime_ns = source.mtime_ns
+            self.data = data
+            self.view = memoryview(data)
+            self.layouts = {}
+            self.images = source.images
+            self.manifests = {}
+        elif source is None:
+            with open(filename, 'rb') as f:
+                st = os.fstat(f.fileno())
+                self.size = st.st_size
+                self.mtime_ns = st.st_mtime_ns
+                # mmap não aceita arquivos vazios; o mapeamento continua válido após fechar o arquivo
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+            self.view = memoryview(self.data)
+            self.original_size = self.size
+            self.layouts = {} # payload_size -> CachedFile que compartilha este mapeamento
+            self.images = {} # nome do codec -> CachedFile da imagem comprimida
+            self.manifests = {} # tamanho do bloco em bytes -> digests concatenados dos blocos
+        else:
+            self.size = source.size
+            self.original_size = source.original_size
+            self.mtime_ns = source.mtime_ns
+            self.data = source.data
+            self.view = source.view
+            self.layouts = source.layouts
+            self.images = source.images
+            self.manifests = source.manifests
+        self.layouts[payload_size] = self
+        # Arquivo vazio ainda gera um único segmento (vazio) com a flag de último
+        self.total_segments = max(1, (self.size + payload_size - 1) // payload_size)
+        self.checksums = {} # nome do algoritmo -> (array de checksums, bytearray de blocos calculados)
+
+    def with_payload_size(self, payload_size):
+        """O mesmo arquivo dividido em segmentos de payload_size bytes (sem novo mapeamento)."""
+        layout = self.layouts.get(payload_size)
+        if layout is None:
+            layout = CachedFile(self.filename, payload_size, source=self)
+        return layout
+
+    def compressed(self, codec):
+        """Imagem comprimida do arquivo com codec, se já foi montada (veja add_image); senão None."""
+        image = self.images.get(codec.name)
+        if image is None:
+            return None
+        return image.with_payload_size(self.payload_size)
+
+    def compress(self, codec):
+        """Comprime o arquivo com codec e retorna a imagem; só lê o mapeamento, então pode rodar em outra thread."""
+        start = time.perf_counter()
+        data = compression.compress_blocks(codec, self.view)
+        logging.info(f"Arquivo {self.filename} comprimido com {codec.name}: {self.size} -> {len(data)} bytes em {time.perf_counter() - start:.3f} s")
+        return data
+
+    def add_image(self, codec, data):
+        """Guarda a imagem comprimida feita por compress e a retorna dividida em segmentos de payload_size."""
+        image = self.images.get(codec.name)
+        if image is None:
+            image = self.images[codec.name] = CachedFile(self.filename, self.payload_size, source=self, data=data, codec=codec.name)
+        return image.with_payload_size(self.payload_size)
+
+    @property
+    def version(self):
+        """Identifica o conteúdo do arquivo de origem (mtime e tamanho), para retomadas e deltas."""
+        return f"{self.mtime_ns}-{self.original_size}"
+
+    def manifest(self, block_segments):
+        """Digests dos blocos de block_segments segmentos, se já foram calculados (veja add_manifest); senão None."""
+        return self.manifests.get(block_segments * self.payload_size)
+
+    def compute_manifest(self, block_segments):
+        """Calcula os digests dos blocos; só lê o mapeamento, então pode rodar em outra thread."""
+        block_size = block_segments * self.payload_size
+        start = time.perf_counter()
+        digests = manifest.block_digests(self.view, block_size)
+        logging.info(f"Manifesto de {self.filename} com blocos de {block_size} bytes: {(self.size + block_size - 1) // block_size} blocos"
+                     f" em {time.perf_counter() - start:.3f} s")
+        return digests
+
+    def add_manifest(self, block_segments, digests):
+        """Guarda os digests calculados por compute_manifest e os retorna."""
+        return self.manifests.setdefault(block_segments * self.payload_size, digests)
+
+    def memory(self):
+        """Bytes ocupados pelo mapeamento e pelas imagens comprimidas."""
+        return self.original_size + sum(image.size for image in self.images.values())
+
+    def segment(self, seq_num):
+        """Payload do segmento como memoryview sobre o mapeamento (sem cópia)."""
+        start = seq_num * self.payload_size
+        return self.view[start:start + self.payload_size]
+
+    def block(self, seq_num, count):
+        """Payload de count segmentos consecutivos a partir de seq_num."""
+        start = seq_num * self.payload_size
+        return self.view[start:start + count * self.payload_size]
+
+    def checksum(self, algorithm, seq_num):
+        """Checksum do segmento, calculado em lote por bloco na primeira vez e memorizado."""
+        entry = self.checksums.get(algorithm.name)
+        if entry is None:
+            values = array.array('L', bytes(array.array('L').itemsize * self.total_segments))
+            computed = bytearray((self.total_segments + CHECKSUM_BLOCK - 1) // CHECKSUM_BLOCK)
+            entry = self.checksums[algorithm.name] = (values, computed)
+        values, computed = entry
+        block_index = seq_num // CHECKSUM_BLOCK
+        if not computed[block_index]:
+            first = block_index * CHECKSUM_BLOCK
+            count = min(CHECKSUM_BLOCK, self.total_segments - first)
+            block = self.block(first, count)
+            values[first:first + count] = array.array('L', checksum.segment_checksums(algorithm, block, self.payload_size) or [algorithm.function(b'')])
+            computed[block_index] = 1
+        return values[seq_num]
+
+    def is_fresh(self, st):
+        return st.st_size == self.size and st.st_mtime_ns == self.mtime_ns
+
+
+class FileCache:
+    """Cache LRU de CachedFile limitado por bytes mapeados e por quantidade de arquivos."""
+
+    def __init__(self, payload_size, max_bytes=256 * 1024 * 1024, max_files=64):
+        self.payload_size = payload_size
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.entries = collections.OrderedDict() # filename -> CachedFile, do menos para o mais recente
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def get(self, filename, payload_size=None, codec=None):
+        """Retorna o arquivo em cache, (re)abrindo-o se não estiver em cache ou se mudou no disco.
+
+        Com payload_size, o arquivo vem dividido em segmentos desse tamanho em vez do padrão do
+        cache; com codec, vem a imagem comprimida do arquivo, ou None se ela ainda não foi
+        montada (veja add_image). Levanta FileNotFoundError/OSError como open().
+        """
+        st = os.stat(filename)
+        entry = self.entries.get(filename)
+        if entry is not None and not entry.is_fresh(st):
+            self.invalidations += 1
+            self.remove(filename)
+            entry = None
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(filename)
+        else:
+            self.misses += 1
+            entry = CachedFile(filename, self.payload_size)
+            self.entries[filename] = entry
+            self.bytes += entry.memory()
+
+        layout = entry.with_payload_size(payload_size or self.payload_size)
+        if codec is not None:
+            layout = layout.compressed(codec)
+        self.evict()
+        return layout
+
+    def add_image(self, cached_file, codec, data):
+        """Guarda a imagem comprimida de cached_file (veja CachedFile.compress) e a retorna.
+
+        Se a entrada saiu do cache enquanto a imagem era montada, a imagem fica só com ela.
+        """
+        entry = self.entries.get(cached_file.filename)
+        if entry is None or entry.layouts is not cached_file.layouts:
+            return cached_file.add_image(codec, data)
+        before = entry.memory()
+        image = cached_file.add_image(codec, data)
+        self.bytes += entry.memory() - before
+        self.evict()
+        return image
+
+    def remove(self, filename):
+        # O mapeamento não é fechado aqui: transferências em andamento podem ainda usá-lo, e
+        # ele é liberado quando a última referência deixa de existir.
+        entry = self.entries.pop(filename, None)
+        if entry is not None:
+            self.bytes -= entry.memory()
+
+    def evict(self):
+        while self.entries and (self.bytes > self.max_bytes or len(self.entries) > self.max_files):
+            if len(self.entries) == 1:
+                break # Mantém ao menos o arquivo recém-aberto, mesmo que maior que o limite
+            filename = next(iter(self.entries))
+            self.remove(filename)
+            self.evictions += 1
+            logging.debug(f"Arquivo {filename} removido do cache (LRU)")
+
+    def stats(self):
+        """Contadores para ajuste dos limites do cache."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'evictions': self.evictions,
+            'files': len(self.entries),
+            'bytes': self.bytes,
+        }
@@ -0,0 +1,259 @@
+"""Proxy UDP local que simula uma rede com defeitos entre o cliente e o servidor.
+
+O cliente fala com o proxy como se fosse o servidor; cada cliente ganha um socket próprio
+do lado do servidor, então o servidor continua vendo um endereço por cliente (e por fluxo).
+Em cada sentido, os datagramas passam por um Link que pode:
+
+* atrasar (latência fixa mais jitter uniforme);
+* perder ao acaso (--loss) ou em rajadas (modelo de Gilbert-Elliott: --burst-rate é a
+  chance de entrar no estado ruim a cada datagrama e --burst-length o tamanho médio da rajada);
+* reordenar (um datagrama recebe um atraso extra e chega depois dos seguintes);
+* duplicar e corromper (um bit trocado em uma posição aleatória);
+* limitar a banda (--rate, em Mbit/s) com uma fila de tamanho limitado (descarte no fim da fila).
+
+Com --seed, as decisões aleatórias são reproduzíveis. Exemplo, entre o cliente e um servidor
+na porta 9999:
+
+    python impairment.py --listen 127.0.0.1:9000 --server 127.0.0.1:9999 --delay 20 --jitter 5 --loss 0.01
+    python client.py 127.0.0.1:9000 text.txt -l 0
+"""
+import argparse
+import heapq
+import itertools
+import json
+import logging
+import random
+import selectors
+import signal
+import socket
+import time
+
+import recvpath
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - PROXY - %(levelname)s - %(message)s')
+
+BUFFER_SIZE = 65536
+MAX_MESSAGES_PER_TICK = 256 # Datagramas lidos de um socket antes de voltar a entregar os que venceram
+SESSION_IDLE = 60.0 # Segundos sem tráfego até o socket de um cliente ser fechado
+DEFAULT_QUEUE_BYTES = 256 * 1024 # Fila do limitador de banda (bytes)
+DEFAULT_REORDER_DELAY = 0.01 # Atraso extra (segundos) de um datagrama reordenado
+
+
+class Link:
+    """Defeitos de um sentido do proxy e os contadores do que foi feito com os datagramas."""
+
+    def __init__(self, rng, delay=0.0, jitter=0.0, loss=0.0, burst_rate=0.0, burst_length=1.0, reorder=0.0,
+                 reorder_delay=DEFAULT_REORDER_DELAY, duplicate=0.0, corrupt=0.0, rate=None, queue_bytes=DEFAULT_QUEUE_BYTES):
+        self.rng = rng
+        self.delay = delay
+        self.jitter = jitter
+        self.loss = loss
+        self.burst_rate = burst_rate
+        self.burst_exit = 1.0 / max(1.0, burst_length) # Chance de sair do estado ruim a cada datagrama
+        self.reorder = reorder
+        self.reorder_delay = reorder_delay
+        self.duplicate = duplicate
+        self.corrupt = corrupt
+        self.rate = rate # Bytes por segundo (None: sem limite)
+        self.queue_bytes = queue_bytes
+        self.bad_state = False
+        self.link_free_at = 0.0 # Quando o limitador termina de "transmitir" a fila atual
+        self.stats = dict.fromkeys(('received', 'bytes_received', 'delivered', 'bytes_delivered', 'lost_random', 'lost_burst',
+                                    'dropped_queue', 'duplicated', 'corrupted', 'reordered'), 0)
+
+    def process(self, now, data):
+        """Aplica os defeitos a um datagrama; retorna a lista de (horário de entrega, dados)."""
+        stats = self.stats
+        stats['received'] += 1
+        stats['bytes_received'] += len(data)
+        rng = self.rng
+
+        if self.burst_rate:
+            self.bad_state = rng.random() >= self.burst_exit if self.bad_state else rng.random() < self.burst_rate
+            if self.bad_state:
+                stats['lost_burst'] += 1
+                return []
+        if self.loss and rng.random() < self.loss:
+            stats['lost_random'] += 1
+            return []
+
+        departure = now
+        if self.rate:
+            start = max(now, self.link_free_at)
+            if (start - now) * self.rate + len(data) > self.queue_bytes:
+                stats['dropped_queue'] += 1
+                return []
+            self.link_free_at = departure = start + len(data) / self.rate
+
+        copies = 2 if self.duplicate and rng.random() < self.duplicate else 1
+        if copies == 2:
+            stats['duplicated'] += 1
+        deliveries = []
+        for _ in range(copies):
+            payload = data
+            if self.corrupt and payload and rng.random() < self.corrupt:
+                corrupted = bytearray(payload)
+                corrupted[rng.randrange(len(corrupted))] ^= 1 << rng.randrange(8)
+                payload = bytes(corrupted)
+                stats['corrupted'] += 1
+            at = departure + self.delay + (rng.uniform(0.0, self.jitter) if self.jitter else 0.0)
+            if self.reorder and rng.random() < self.reorder:
+                at += self.reorder_delay
+                stats['reordered'] += 1
+            deliveries.append((at, payload))
+        return deliveries
+
+
+class ImpairmentProxy:
+    """Encaminha datagramas entre clientes e o servidor passando por um Link em cada sentido."""
+
+    def __init__(self, listen_sock, server_address, downstream, upstream):
+        self.listen_sock = listen_sock
+        self.listen_sock.setblocking(False)
+        recvpath.set_receive_buffer(listen_sock, recvpath.RCVBUF_SIZE)
+        self.server_address = server_address
+        self.downstream = downstream # Servidor -> cliente
+        self.upstream = upstream # Cliente -> servidor
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(listen_sock, selectors.EVENT_READ, None)
+        self.sessions = {} # client_address -> [socket do lado do servidor, último tráfego]
+        self.pending = [] # heap de (horário de entrega, contador, socket, dados, destino, Link)
+        self.counter = itertools.count()
+        self.next_sweep = time.monotonic() + SESSION_IDLE
+
+    def session_socket(self, client_address, now):
+        session = self.sessions.get(client_address)
+        if session is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind(('', 0))
+            sock.setblocking(False)
+            recvpath.set_receive_buffer(sock, recvpath.RCVBUF_SIZE) # Recebe as rajadas do servidor
+            self.selector.register(sock, selectors.EVENT_READ, client_address)
+            session = self.sessions[client_address] = [sock, now]
+            logging.info(f"Nova sessão {client_address} -> {self.server_address} (porta local {sock.getsockname()[1]})")
+        session[1] = now
+        return session[0]
+
+    def serve_forever(self):
+        logging.info(f"Encaminhando {self.listen_sock.getsockname()} -> {self.server_address}")
+        while True:
+            timeout = max(0.0, self.pending[0][0] - time.monotonic()) if self.pending else 1.0
+            for key, _ in self.selector.select(timeout):
+                self.drain(key.fileobj, key.data)
+            now = time.monotonic()
+            self.deliver_due(now)
+            if now >= self.next_sweep:
+                self.expire_sessions(now)
+
+    def drain(self, sock, client_address):
+        """Lê os datagramas pendentes de um socket e agenda suas entregas."""
+        for _ in range(MAX_MESSAGES_PER_TICK):
+            try:
+                data, source = sock.recvfrom(BUFFER_SIZE)
+            except (BlockingIOError, InterruptedError):
+                return
+            except ConnectionError:
+                continue # ICMP port unreachable de um destino que já foi embora
+            now = time.monotonic()
+            if client_address is None: # Do cliente para o servidor
+                link, out_sock, destination = self.upstream, self.session_socket(source, now), self.server_address
+            else:
+                link, out_sock, destination = self.downstream, self.listen_sock, client_address
+                self.sessions[client_address][1] = now
+            for at, payload in link.process(now, data):
+                heapq.heappush(self.pending, (at, next(self.counter), out_sock, payload, destination, link))
+
+    def deliver_due(self, now):
+        while self.pending and self.pending[0][0] <= now:
+            _, _, sock, payload, destination, link = heapq.heappop(self.pending)
+            try:
+                sock.sendto(payload, destination)
+            except OSError as e: # Buffer cheio ou socket de sessão já fechado: conta como perda da rede
+                logging.debug(f"Falha ao entregar datagrama para {destination}: {e}")
+                continue
+            link.stats['delivered'] += 1
+            link.stats['bytes_delivered'] += len(payload)
+
+    def expire_sessions(self, now):
+        self.next_sweep = now + SESSION_IDLE
+        for client_address, (sock, last_seen) in list(self.sessions.items()):
+            if now - last_seen > SESSION_IDLE:
+                self.selector.unregister(sock)
+                sock.close()
+                del self.sessions[client_address]
+
+    def stats(self):
+        return {'downstream': dict(self.downstream.stats), 'upstream': dict(self.upstream.stats), 'sessions': len(self.sessions)}
+
+    def close(self):
+        for sock, _ in self.sessions.values():
+            sock.close()
+        self.selector.close()
+
+
+def parse_address(addr_str):
+    host, _, port = addr_str.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def add_link_arguments(parser):
+    """Opções dos defeitos (também usadas pelo benchmark para montar a linha de comando)."""
+    parser.add_argument("--delay", type=float, default=0.0, help="Latência em cada sentido (ms)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Variação aleatória somada à latência (ms, uniforme)")
+    parser.add_argument("--loss", type=float, default=0.0, help="Probabilidade de perda independente por datagrama")
+    parser.add_argument("--burst-rate", type=float, default=0.0, help="Probabilidade de iniciar uma rajada de perdas a cada datagrama")
+    parser.add_argument("--burst-length", type=float, default=1.0, help="Tamanho médio de uma rajada de perdas (datagramas)")
+    parser.add_argument("--reorder", type=float, default=0.0, help="Probabilidade de um datagrama ser reordenado")
+    parser.add_argument("--reorder-delay", type=float, default=DEFAULT_REORDER_DELAY * 1000, help="Atraso extra de um datagrama reordenado (ms)")
+    parser.add_argument("--duplicate", type=float, default=0.0, help="Probabilidade de um datagrama ser duplicado")
+    parser.add_argument("--corrupt", type=float, default=0.0, help="Probabilidade de um bit de um datagrama ser trocado")
+    parser.add_argument("--rate", type=float, default=None, help="Limite de banda (Mbit/s) em cada sentido")
+    parser.add_argument("--queue-kb", type=int, default=DEFAULT_QUEUE_BYTES // 1024, help="Fila do limitador de banda (KB)")
+
+
+def link_from_args(args, rng):
+    return Link(rng, args.delay / 1000, args.jitter / 1000, args.loss, args.burst_rate, args.burst_length, args.reorder,
+                args.reorder_delay / 1000, args.duplicate, args.corrupt, args.rate * 125000 if args.rate else None, args.queue_kb * 1024)
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def start_proxy(listen_address, server_address, downstream_args, upstream_args=None, seed=None, stats_file=None):
+    """Executa o proxy até SIGINT/SIGTERM; ao sair, registra (e grava em stats_file) os contadores."""
+    rng = random.Random(seed)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(listen_address)
+    proxy = ImpairmentProxy(sock, server_address, link_from_args(downstream_args, rng), link_from_args(upstream_args or downstream_args, rng))
+    # A primeira linha da saída informa a porta (útil com a porta 0, escolhida pelo sistema)
+    print(f"listening {sock.getsockname()[0]}:{sock.getsockname()[1]}", flush=True)
+    signal.signal(signal.SIGTERM, _interrupt) # O benchmark encerra o proxy com SIGTERM
+    try:
+        proxy.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stats = proxy.stats()
+        logging.info(f"Estatísticas do proxy: {stats}")
+        if stats_file:
+            with open(stats_file, 'w') as f:
+                json.dump(stats, f)
+        proxy.close()
+        sock.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Proxy UDP que simula atraso, perdas, reordenação, duplicação, corrupção e limite de banda.")
+    parser.add_argument("--listen", type=parse_address, default=('127.0.0.1', 9000), help="Endereço onde os clientes se conectam (padrão: 127.0.0.1:9000; porta 0 escolhe uma livre)")
+    parser.add_argument("--server", type=parse_address, default=('127.0.0.1', 9999), help="Endereço do servidor (padrão: 127.0.0.1:9999)")
+    parser.add_argument("--direction", choices=['both', 'down', 'up'], default='both', help="Sentido em que os defeitos são aplicados: 'down' (servidor -> cliente), 'up' ou 'both' (padrão)")
+    parser.add_argument("--seed", type=int, default=None, help="Semente das decisões aleatórias (torna a execução reproduzível)")
+    parser.add_argument("--stats-file", type=str, default=None, help="Grava os contadores de cada sentido em JSON ao encerrar")
+    add_link_arguments(parser)
+
+    args = parser.parse_args()
+    clean = parser.parse_args([]) # Sentido sem defeitos
+    downstream = args if args.direction in ('both', 'down') else clean
+    upstream = args if args.direction in ('both', 'up') else clean
+    start_proxy(args.listen, args.server, downstream, upstream, args.seed, args.stats_file)
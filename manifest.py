@@ -0,0 +1,58 @@
+"""Manifesto de blocos para transferências delta.
+
+O arquivo é dividido em blocos de block_segments segmentos, e cada bloco é resumido por um
+BLAKE2b de 128 bits. O servidor calcula os digests uma vez por arquivo e tamanho de bloco e os
+guarda no cache de arquivos, que os descarta junto com a entrada quando o mtime ou o tamanho
+do arquivo mudam (veja filecache.CachedFile.manifest).
+
+O cliente calcula os digests da sua cópia local, dividindo arquivos grandes entre os
+processos de um pool (cada processo lê o seu trecho com pread; só os digests voltam), e
+pede ao servidor apenas os segmentos dos blocos diferentes. Assim, sincronizar um arquivo
+grande pouco alterado custa banda proporcional à mudança, não ao tamanho do arquivo.
+"""
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import protocol
+
+PARALLEL_THRESHOLD = 64 * 1024 * 1024 # Cópias locais menores são resumidas no próprio processo
+CHUNK_BLOCKS = 256 # Blocos por tarefa do pool de processos
+
+
+def digest(data):
+    return hashlib.blake2b(data, digest_size=protocol.MANIFEST_DIGEST_SIZE).digest()
+
+
+def block_digests(view, block_size):
+    """Digests concatenados dos blocos de block_size bytes de um buffer (o último pode ser menor)."""
+    return b''.join(digest(view[offset:offset + block_size]) for offset in range(0, len(view), block_size))
+
+
+def _file_digests(filename, block_size, first_block, count):
+    with open(filename, 'rb') as f:
+        fd = f.fileno()
+        return b''.join(digest(os.pread(fd, block_size, (first_block + i) * block_size)) for i in range(count))
+
+
+def file_digests(filename, block_size, workers=None):
+    """Digests concatenados dos blocos de um arquivo local.
+
+    A partir de PARALLEL_THRESHOLD bytes, os blocos são divididos em tarefas de CHUNK_BLOCKS
+    para um pool de workers processos (padrão: um por núcleo).
+    """
+    size = os.path.getsize(filename)
+    blocks = (size + block_size - 1) // block_size
+    if size < PARALLEL_THRESHOLD or workers == 1:
+        return _file_digests(filename, block_size, 0, blocks)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_file_digests, filename, block_size, first, min(CHUNK_BLOCKS, blocks - first))
+                   for first in range(0, blocks, CHUNK_BLOCKS)]
+        return b''.join(future.result() for future in futures)
+
+
+def matching_blocks(local, remote):
+    """Índices dos blocos com o mesmo digest nos dois manifestos."""
+    size = protocol.MANIFEST_DIGEST_SIZE
+    return [index for index in range(min(len(local), len(remote)) // size)
+            if local[index * size:(index + 1) * size] == remote[index * size:(index + 1) * size]]
@@ -0,0 +1,311 @@
+"""Métricas por transferência com custo baixo por pacote, no lugar dos logs por segmento.
+
+Cada transferência tem um TransferMetrics: no caminho de cada pacote só há incrementos de
+atributos (e um bisect no histograma de RTT, uma vez por amostra). Os números viram texto
+apenas nas linhas periódicas de resumo, no fim da transferência e nas consultas de estado.
+
+Rastreamento: com Tracer.configure(n), um a cada n eventos de pacote vira uma linha de
+debug; desligado (padrão), o custo é um teste de atributo.
+
+O servidor expõe os totais em JSON ou no formato de texto do Prometheus, respondendo a
+"STATS [json|prometheus]" vindo de loopback e, com --metrics-file, gravando o arquivo
+periodicamente. Executar este arquivo consulta um servidor:
+
+    python metrics.py 127.0.0.1:9999 [--prometheus]
+"""
+import bisect
+import json
+import logging
+import socket
+import time
+
+STATS_PREFIX = b'STATS'
+FORMAT_JSON = 'json'
+FORMAT_PROMETHEUS = 'prometheus'
+REPORT_INTERVAL = 5.0 # Segundos entre linhas de resumo periódicas
+TRACE_LOGGER = 'trace' # Logger das linhas do rastreamento amostrado (--trace)
+RTT_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0) # Segundos
+
+COUNTER_HELP = {
+    'segments_sent': "Datagramas de dados enviados (inclui retransmissões).",
+    'segments_retransmitted': "Datagramas de dados retransmitidos.",
+    'bytes_sent': "Bytes de dados enviados (inclui retransmissões).",
+    'parity_sent': "Segmentos de paridade (FEC) enviados.",
+    'segments_received': "Segmentos novos gravados.",
+    'bytes_received': "Bytes novos gravados (goodput).",
+    'segments_recovered': "Segmentos reconstruídos a partir da paridade (FEC; incluídos nos gravados).",
+    'duplicates': "Segmentos duplicados recebidos.",
+    'checksum_failures': "Segmentos descartados por checksum inválido.",
+    'simulated_losses': "Segmentos descartados pela simulação de perda.",
+    'acks': "ACKs do modo com janela.",
+    'nacks': "Pedidos de retransmissão (NACK ou RETRANS).",
+    'timeouts': "Timeouts de retransmissão.",
+    'spurious_losses': "Reduções da janela desfeitas porque os segmentos dados como perdidos chegaram (reordenação).",
+}
+COUNTERS = tuple(COUNTER_HELP)
+
+
+class Histogram:
+    """Histograma de limites fixos (buckets cumulativos no estilo do Prometheus)."""
+
+    __slots__ = ('bounds', 'counts', 'count', 'sum')
+
+    def __init__(self, bounds=RTT_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) # O último bucket é +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q):
+        """Limite superior do bucket que contém o quantil q (None sem amostras)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'mean': round(self.sum / self.count, 6) if self.count else None,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+            'buckets': dict(zip([str(bound) for bound in self.bounds] + ['+Inf'], self.counts)),
+        }
+
+
+class TransferMetrics:
+    """Contadores de uma transferência no servidor ou de um download no cliente."""
+
+    __slots__ = COUNTERS + ('label', 'rtt', 'started', 'ended')
+
+    def __init__(self, label=''):
+        for name in COUNTERS:
+            setattr(self, name, 0)
+        self.label = label
+        self.rtt = Histogram()
+        self.started = time.monotonic()
+        self.ended = None
+
+    def finish(self, now=None):
+        if self.ended is None:
+            self.ended = now if now is not None else time.monotonic()
+
+    def elapsed(self, now=None):
+        end = self.ended if self.ended is not None else (now if now is not None else time.monotonic())
+        return max(end - self.started, 1e-9)
+
+    def merge(self, other):
+        for name in COUNTERS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.rtt.merge(other.rtt)
+
+    def rates(self, now=None):
+        """(pacotes/s, Mbit/s): do lado que recebeu dados, goodput; senão, vazão de envio."""
+        elapsed = self.elapsed(now)
+        if self.segments_received:
+            return self.segments_received / elapsed, self.bytes_received * 8 / elapsed / 1e6
+        return self.segments_sent / elapsed, self.bytes_sent * 8 / elapsed / 1e6
+
+    def summary(self, now=None):
+        pps, mbps = self.rates(now)
+        parts = [f"{self.elapsed(now):.2f} s", f"{pps:,.0f} pacotes/s", f"{mbps:.2f} Mbit/s"]
+        if self.segments_sent:
+            parts.append(f"{self.segments_sent} enviados ({self.segments_retransmitted} retransmissões)")
+        if self.segments_received:
+            parts.append(f"{self.segments_received} recebidos")
+        for name, label in (('parity_sent', 'paridades enviadas'), ('segments_recovered', 'reconstruídos pela paridade'),
+                            ('duplicates', 'duplicados'), ('checksum_failures', 'checksums inválidos'),
+                            ('simulated_losses', 'perdas simuladas'), ('nacks', 'NACKs'), ('timeouts', 'timeouts'),
+                            ('spurious_losses', 'perdas espúrias')):
+            value = getattr(self, name)
+            if value:
+                parts.append(f"{value} {label}")
+        if self.rtt.count:
+            parts.append(f"RTT médio {self.rtt.sum / self.rtt.count * 1000:.1f} ms")
+        return ", ".join(parts)
+
+    def as_dict(self, now=None):
+        pps, mbps = self.rates(now)
+        stats = {name: getattr(self, name) for name in COUNTERS}
+        stats.update(label=self.label, seconds=round(self.elapsed(now), 6), pps=round(pps, 1), mbps=round(mbps, 3), rtt=self.rtt.as_dict())
+        return stats
+
+
+class ServerMetrics:
+    """Totais do servidor: transferências encerradas somadas às ativas no momento da consulta."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.retired = TransferMetrics('encerradas')
+        self.messages = {} # Tipo da mensagem recebida -> quantidade
+        self.transfers_started = 0
+        self.transfers_completed = 0
+        self.transfers_aborted = 0
+        self.last_report = None # (horário, totais) da última linha periódica
+
+    def count_message(self, kind):
+        self.messages[kind] = self.messages.get(kind, 0) + 1
+
+    def retire(self, transfer_metrics):
+        """Soma aos totais uma transferência que deixou de existir."""
+        self.retired.merge(transfer_metrics)
+
+    def totals(self, active):
+        totals = TransferMetrics('total')
+        totals.started = self.started
+        totals.merge(self.retired)
+        for transfer_metrics in active:
+            totals.merge(transfer_metrics)
+        return totals
+
+    def report_line(self, active, sending, now):
+        """Linha de resumo com as taxas desde a linha anterior, ou None se nada mudou."""
+        totals = self.totals(active)
+        previous_time, previous = self.last_report or (self.started, TransferMetrics())
+        self.last_report = (now, totals)
+        sent = totals.segments_sent - previous.segments_sent
+        if not sent and not sending:
+            return None
+        interval = max(now - previous_time, 1e-9)
+        return (f"{sending} transferências enviando, {sent / interval:,.0f} pacotes/s, "
+                f"{(totals.bytes_sent - previous.bytes_sent) * 8 / interval / 1e6:.2f} Mbit/s, "
+                f"{totals.segments_retransmitted - previous.segments_retransmitted} retransmissões, "
+                f"{totals.acks - previous.acks} ACKs, {totals.nacks - previous.nacks} NACKs no intervalo")
+
+    def snapshot(self, active, extra=None):
+        """Estado completo em um dicionário serializável em JSON."""
+        now = time.monotonic()
+        stats = {
+            'uptime': round(now - self.started, 3),
+            'transfers': {'started': self.transfers_started, 'completed': self.transfers_completed,
+                          'aborted': self.transfers_aborted, 'active': len(active)},
+            'messages': dict(self.messages),
+            'totals': self.totals(active.values()).as_dict(now),
+            'active': {str(client): transfer_metrics.as_dict(now) for client, transfer_metrics in active.items()},
+        }
+        if extra:
+            stats.update(extra)
+        return stats
+
+    def prometheus(self, active, extra=None):
+        """Exposição no formato de texto do Prometheus (só totais, sem rótulos por cliente)."""
+        totals = self.totals(active.values())
+        lines = []
+
+        def metric(name, kind, value, help_text, labels=''):
+            if help_text is not None:
+                lines.append(f"# HELP udpfile_{name} {help_text}")
+                lines.append(f"# TYPE udpfile_{name} {kind}")
+            lines.append(f"udpfile_{name}{labels} {value}")
+
+        metric('uptime_seconds', 'gauge', round(time.monotonic() - self.started, 3), "Tempo desde o início do servidor.")
+        metric('active_transfers', 'gauge', len(active), "Transferências registradas.")
+        metric('transfers_started_total', 'counter', self.transfers_started, "Transferências iniciadas.")
+        metric('transfers_completed_total', 'counter', self.transfers_completed, "Envios iniciais concluídos.")
+        metric('transfers_aborted_total', 'counter', self.transfers_aborted, "Transferências abortadas por falta de ACKs.")
+        for name in COUNTERS:
+            metric(f"{name}_total", 'counter', getattr(totals, name), COUNTER_HELP[name])
+        for i, (kind, count) in enumerate(sorted(self.messages.items())):
+            metric('messages_total', 'counter', count, "Mensagens recebidas por tipo." if i == 0 else None, f'{{kind="{kind}"}}')
+        cumulative = 0
+        lines.append("# HELP udpfile_rtt_seconds Amostras de RTT das transferências com janela.")
+        lines.append("# TYPE udpfile_rtt_seconds histogram")
+        for bound, count in zip([str(bound) for bound in totals.rtt.bounds] + ['+Inf'], totals.rtt.counts):
+            cumulative += count
+            lines.append(f'udpfile_rtt_seconds_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"udpfile_rtt_seconds_sum {totals.rtt.sum}")
+        lines.append(f"udpfile_rtt_seconds_count {totals.rtt.count}")
+        for name, value in (extra or {}).items():
+            metric(name, 'gauge', value, f"Estatística {name.replace('_', ' ', 1)} do servidor.")
+        return "\n".join(lines) + "\n"
+
+
+class Tracer:
+    """Rastreamento amostrado: um a cada every eventos vira uma linha de debug.
+
+    As linhas vão para um logger próprio (TRACE_LOGGER), que só ele passa para DEBUG; o nível
+    do logger raiz não muda, e os logging.debug sem amostragem continuam desligados.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.every = 0
+        self.count = 0
+        self.logger = logging.getLogger(TRACE_LOGGER)
+
+    def configure(self, every):
+        """Liga o rastreamento (every > 0) e o nível DEBUG do logger de rastreamento."""
+        self.every = every
+        self.enabled = every > 0
+        self.logger.setLevel(logging.DEBUG if self.enabled else logging.NOTSET)
+
+    def sample(self):
+        """Chamado só com enabled; verdadeiro para um a cada every eventos."""
+        self.count += 1
+        return self.count % self.every == 0
+
+    def debug(self, message):
+        """Registra um evento amostrado (depois de sample())."""
+        self.logger.debug(message)
+
+
+class Reporter:
+    """Marca quando é hora de uma linha de resumo periódica."""
+
+    def __init__(self, interval=REPORT_INTERVAL):
+        self.interval = interval
+        self.next_report = time.monotonic() + interval
+
+    def due(self, now):
+        if now < self.next_report:
+            return False
+        self.next_report = now + self.interval
+        return True
+
+
+def build_stats_request(fmt=FORMAT_JSON):
+    return STATS_PREFIX + b" " + fmt.encode('utf-8') + b"\n"
+
+
+def parse_stats_request(message_str):
+    fields = message_str.split()
+    return fields[1].lower() if len(fields) > 1 else FORMAT_JSON
+
+
+def query_server(server_address, fmt=FORMAT_JSON, timeout_seconds=2.0):
+    """Consulta as métricas de um servidor (a partir de loopback); retorna o texto da resposta."""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout_seconds)
+        sock.sendto(build_stats_request(fmt), server_address)
+        return sock.recv(65536).decode('utf-8')
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Consulta as métricas de um servidor em execução.")
+    parser.add_argument("server_address", type=str, help="Endereço do servidor no formato HOST:PORT")
+    parser.add_argument("--prometheus", action="store_true", help="Formato de texto do Prometheus em vez de JSON")
+    args = parser.parse_args()
+    host, port = args.server_address.rsplit(':', 1)
+    reply = query_server((host, int(port)), FORMAT_PROMETHEUS if args.prometheus else FORMAT_JSON)
+    if not args.prometheus and reply.startswith('{'):
+        reply = json.dumps(json.loads(reply), indent=2, ensure_ascii=False)
+    print(reply)
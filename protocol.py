@@ -0,0 +1,399 @@
+"""Mensagens de controle compartilhadas entre cliente e servidor.
+
+Requisição GET estendida (negociação por transferência):
+
+    GET /<arquivo>
+    <Opção>: <valor>
+    ...
+
+Um GET sem linhas de opção mantém o comportamento original (modo sem janela). Para um GET
+com opções, o servidor responde com um datagrama "OK 200" listando as opções aceitas antes
+de começar a enviar os segmentos.
+
+Com a opção range, só os segmentos do intervalo são enviados, com os números de sequência
+do arquivo inteiro; o último segmento do intervalo leva a flag de último. Um "HEAD /<arquivo>"
+responde apenas com o OK contendo o tamanho do arquivo, para o cliente dividir o download.
+
+A opção payload negocia o tamanho dos dados de cada segmento (padrão DEFAULT_PAYLOAD_SIZE).
+Para escolher o maior tamanho que o caminho entrega sem fragmentação, o cliente pode antes
+enviar "PROBE <tamanho> ..."; o servidor responde com um datagrama de sonda de cada tamanho,
+com a flag DF (não fragmentar) ligada, e o cliente usa o maior que chegou.
+
+Com a opção compression, o servidor transmite a imagem comprimida do arquivo (veja
+compression.py): size, segments e range passam a se referir à imagem, e o OK informa também
+o tamanho original (original-size).
+
+Com a opção session, o servidor abre uma sessão e informa o ID dela no OK. Os segmentos da
+sessão levam a flag FLAG_SESSION e o ID logo após o cabeçalho, e o cliente repete o ID nos
+ACKs e NACKs: o servidor encontra a transferência pelo ID, não pelo endereço do cliente, então
+um mesmo endereço pode ter vários downloads e uma mudança de porta (NAT) não os confunde. Sem
+a opção, a transferência é identificada pelo endereço, como na versão original.
+
+Com a opção fec ('<K>' ou 'auto'), após cada grupo de segmentos o servidor envia um segmento
+de paridade (FLAG_PARITY) com o XOR dos dados do grupo; o número de sequência é o primeiro
+segmento do grupo e os dados começam com PARITY_INFO (quantidade de segmentos e XOR dos
+tamanhos). Cada grupo se descreve sozinho, então o servidor pode mudar o tamanho dos grupos
+durante a transferência (veja fec.py). A paridade só acompanha o envio inicial; as
+retransmissões pedidas por NACK vão sem ela.
+
+O OK informa também a versão do arquivo (version: mtime e tamanho). Um GET retomado pode
+repeti-la: se o arquivo mudou no servidor, a resposta é "ERROR 412", em vez de completar a
+cópia parcial com segmentos da versão nova.
+
+Para transferências delta, "MANIFEST /<arquivo>" pede os digests dos blocos do arquivo (cada
+bloco com block segmentos). A resposta é um OK com o tamanho, a versão e o total de blocos e
+de páginas, seguido das páginas pedidas (opção pages, até MAX_MANIFEST_PAGES por pedido),
+cada uma em um datagrama binário (MANIFEST_MAGIC). O cliente compara com os digests da sua
+cópia local e pede por NACK, como em um download retomado, só os segmentos dos blocos que
+diferem (veja manifest.py).
+
+Pedidos de retransmissão em lote (NACK) são binários; veja build_nacks.
+"""
+import struct
+
+# Opções da negociação
+OPTION_FLOW = 'flow'
+OPTION_CHECKSUM = 'checksum' # Nome do algoritmo (veja checksum.ALGORITHMS); padrão 'sum'
+OPTION_RESUME = 'resume' # 'yes': download retomado; o servidor não envia o arquivo, só atende NACKs
+OPTION_RANGE = 'range' # '<primeiro>-<último>' (segmentos, inclusive); sem o último, até o fim do arquivo
+OPTION_SIZE = 'size' # Na resposta OK: tamanho do arquivo em bytes
+OPTION_SEGMENTS = 'segments' # Na resposta OK: total de segmentos do arquivo
+OPTION_PAYLOAD = 'payload' # Bytes de dados por segmento (todos menos o último)
+OPTION_COMPRESSION = 'compression' # Nome do codec (veja compression.CODECS); sem a opção, o arquivo vai sem compressão
+OPTION_ORIGINAL_SIZE = 'original-size' # Na resposta OK com compressão: tamanho do arquivo descomprimido
+OPTION_SESSION = 'session' # No GET: 'yes' pede uma sessão; na resposta OK: o ID da sessão
+OPTION_FEC = 'fec' # Segmentos de dados por grupo de paridade, ou 'auto' (veja fec.py)
+OPTION_VERSION = 'version' # Na resposta OK: versão do arquivo; no GET retomado: a versão esperada
+OPTION_BLOCK = 'block' # MANIFEST: segmentos por bloco
+OPTION_BLOCKS = 'blocks' # Na resposta OK do MANIFEST: total de blocos
+OPTION_PAGES = 'pages' # MANIFEST: '<primeira>-<última>' páginas pedidas; na resposta OK: total de páginas
+FLOW_WINDOW = 'window' # Janela deslizante com ACKs e controle de congestionamento (AIMD)
+FLOW_FIXED = 'fixed' # Envio sem janela, com intervalo fixo entre segmentos (modo original)
+
+# Cabeçalho dos segmentos conforme a largura do checksum negociado:
+# Sequence Number (unsigned int), Checksum (unsigned short ou unsigned int), Flags (unsigned byte)
+HEADER_FORMATS = {16: '!I H B', 32: '!I I B'}
+_SEGMENT_HEADERS = {bits: struct.Struct(fmt) for bits, fmt in HEADER_FORMATS.items()}
+SESSION_ID = struct.Struct('!I') # ID da sessão, logo após o cabeçalho dos segmentos com FLAG_SESSION
+_SESSION_HEADERS = {bits: struct.Struct(fmt + ' I') for bits, fmt in HEADER_FORMATS.items()}
+
+FLAG_LAST = 0x01 # Último segmento
+FLAG_SESSION = 0x02 # O cabeçalho é seguido do ID da sessão
+FLAG_PARITY = 0x04 # Segmento de paridade (FEC) do grupo que começa no número de sequência
+
+PARITY_INFO = struct.Struct('!H H') # No início dos dados da paridade: segmentos no grupo, XOR dos seus tamanhos
+
+# A paridade tem PARITY_INFO além dos dados, então os limites de tamanho a incluem
+MAX_SEGMENT_HEADER_SIZE = max(header.size for header in _SESSION_HEADERS.values()) + PARITY_INFO.size
+
+DEFAULT_PAYLOAD_SIZE = 1400 # Evita fragmentação IP em redes Ethernet padrão (MTU 1500)
+MIN_PAYLOAD_SIZE = 512
+MAX_PAYLOAD_SIZE = 65507 - MAX_SEGMENT_HEADER_SIZE # Maior datagrama UDP sobre IPv4
+# Tamanhos testados na sondagem: Ethernet (MTU 1500), jumbo frames (MTU 9000) e datagramas
+# grandes para loopback e bridges de contêiner (MTU 65536)
+PROBE_PAYLOAD_SIZES = (1400, 1500 - 28 - MAX_SEGMENT_HEADER_SIZE, 9000 - 28 - MAX_SEGMENT_HEADER_SIZE, 16384, 32768, MAX_PAYLOAD_SIZE)
+
+ACK_PREFIX = 'ACK '
+ACK_SESSION_MARK = 'S' # Prefixo do ID da sessão em um ACK: "ACK S<id> <cumulativo> ..."
+OK_PREFIX = b'OK '
+PROBE_PREFIX = b'PROBE '
+
+# NACK binário: cabeçalho seguido de intervalos (início, quantidade) ou de um bitmap
+NACK_MAGIC = b'NACK'
+NACK_HEADER = struct.Struct('!4s B I I') # Magic, tipo, base, quantidade (intervalos ou bits)
+NACK_RANGE = struct.Struct('!I I') # Primeiro segmento faltante, quantidade de segmentos
+NACK_KIND_RANGES = 1
+NACK_KIND_BITMAP = 2 # Bit i (MSB primeiro) indica que o segmento base + i está faltando
+NACK_KIND_SESSION = 0x80 # Combinado ao tipo: o cabeçalho é seguido do ID da sessão
+MAX_NACK_PAYLOAD = 1400 - NACK_HEADER.size - SESSION_ID.size # Mantém cada NACK em um único datagrama sem fragmentação
+MAX_NACK_RANGES = MAX_NACK_PAYLOAD // NACK_RANGE.size
+
+# Manifesto de blocos: páginas com os digests de blocos consecutivos
+MANIFEST_PREFIX = b'MANIFEST /'
+MANIFEST_MAGIC = b'MFST'
+MANIFEST_PAGE = struct.Struct('!4s I H') # Magic, índice da página, quantidade de digests
+MANIFEST_DIGEST_SIZE = 16 # BLAKE2b de 128 bits
+MANIFEST_PAGE_DIGESTS = (1400 - MANIFEST_PAGE.size) // MANIFEST_DIGEST_SIZE # A página i traz os blocos a partir de i * MANIFEST_PAGE_DIGESTS
+MAX_MANIFEST_PAGES = 64 # Páginas enviadas por pedido
+DEFAULT_BLOCK_SEGMENTS = 64
+MAX_BLOCK_SEGMENTS = 1 << 16
+
+
+def segment_header(algorithm):
+    """struct.Struct do cabeçalho de segmento para o algoritmo de checksum dado."""
+    return _SEGMENT_HEADERS[algorithm.bits]
+
+
+class SessionSegmentHeader:
+    """Cabeçalho de segmento com o ID da sessão.
+
+    Tem a mesma interface de struct.Struct usada pelo sendpath (size, pack e pack_into com
+    número de sequência, checksum e flags); o ID e a flag FLAG_SESSION são acrescentados.
+    """
+
+    __slots__ = ('header', 'session_id', 'size')
+
+    def __init__(self, algorithm, session_id):
+        self.header = _SESSION_HEADERS[algorithm.bits]
+        self.session_id = session_id
+        self.size = self.header.size
+
+    def pack(self, seq_num, checksum_value, flags):
+        return self.header.pack(seq_num, checksum_value, flags | FLAG_SESSION, self.session_id)
+
+    def pack_into(self, buffer, offset, seq_num, checksum_value, flags):
+        self.header.pack_into(buffer, offset, seq_num, checksum_value, flags | FLAG_SESSION, self.session_id)
+
+
+def build_get_request(filename, options=None):
+    """Monta a requisição GET, incluindo as linhas de opção se houver."""
+    lines = [f"GET /{filename}"]
+    for key, value in (options or {}).items():
+        lines.append(f"{key}: {value}")
+    return ("\n".join(lines) + "\n").encode('utf-8')
+
+
+def build_head_request(filename, options=None):
+    """Pede só o tamanho do arquivo (resposta OK com size e segments)."""
+    return b"HEAD" + build_get_request(filename, options)[3:]
+
+
+def build_manifest_request(filename, options=None):
+    """Pede o manifesto de blocos do arquivo (resposta OK seguida das páginas)."""
+    return b"MANIFEST" + build_get_request(filename, options)[3:]
+
+
+def parse_block_segments(value):
+    """Valida a quantidade de segmentos por bloco do manifesto; levanta ValueError se inválida."""
+    block_segments = int(value)
+    if not 1 <= block_segments <= MAX_BLOCK_SEGMENTS:
+        raise ValueError(f"Tamanho de bloco fora dos limites (1 a {MAX_BLOCK_SEGMENTS} segmentos): {value}")
+    return block_segments
+
+
+def manifest_pages(blocks):
+    """Páginas do manifesto de um arquivo com blocks blocos (um arquivo vazio tem uma página vazia)."""
+    return max(1, (blocks + MANIFEST_PAGE_DIGESTS - 1) // MANIFEST_PAGE_DIGESTS)
+
+
+def build_manifest_page(page, digests):
+    """Datagrama com a página page dos digests concatenados de todos os blocos."""
+    start = page * MANIFEST_PAGE_DIGESTS * MANIFEST_DIGEST_SIZE
+    chunk = digests[start:start + MANIFEST_PAGE_DIGESTS * MANIFEST_DIGEST_SIZE]
+    return MANIFEST_PAGE.pack(MANIFEST_MAGIC, page, len(chunk) // MANIFEST_DIGEST_SIZE) + chunk
+
+
+def parse_manifest_page(message):
+    """Retorna (índice da página, digests); levanta ValueError se malformada."""
+    if len(message) < MANIFEST_PAGE.size:
+        raise ValueError(f"Página de manifesto muito curta ({len(message)} bytes)")
+    magic, page, count = MANIFEST_PAGE.unpack_from(message)
+    digests = message[MANIFEST_PAGE.size:]
+    if magic != MANIFEST_MAGIC or len(digests) != count * MANIFEST_DIGEST_SIZE or count > MANIFEST_PAGE_DIGESTS:
+        raise ValueError("Página de manifesto malformada")
+    return page, digests
+
+
+def parse_payload_size(value):
+    """Valida o tamanho de payload pedido; levanta ValueError se fora dos limites."""
+    payload_size = int(value)
+    if not MIN_PAYLOAD_SIZE <= payload_size <= MAX_PAYLOAD_SIZE:
+        raise ValueError(f"Tamanho de payload fora dos limites ({MIN_PAYLOAD_SIZE} a {MAX_PAYLOAD_SIZE}): {payload_size}")
+    return payload_size
+
+
+def build_probe_request(payload_sizes):
+    return PROBE_PREFIX + " ".join(str(size) for size in payload_sizes).encode('utf-8') + b"\n"
+
+
+def parse_probe_request(message_str):
+    """Tamanhos pedidos em um PROBE (os inválidos são ignorados)."""
+    sizes = []
+    for field in message_str.split()[1:len(PROBE_PAYLOAD_SIZES) + 1]:
+        try:
+            sizes.append(parse_payload_size(field))
+        except ValueError:
+            continue
+    return sizes
+
+
+def build_probe_reply(payload_size):
+    """Datagrama de sonda do mesmo tamanho de um segmento com payload_size bytes de dados."""
+    text = PROBE_PREFIX + f"{payload_size}\n".encode('utf-8')
+    return text.ljust(payload_size + MAX_SEGMENT_HEADER_SIZE, b'\0')
+
+
+def parse_probe_reply(message):
+    """Retorna o tamanho de payload confirmado por uma sonda, ou None se ela chegou truncada."""
+    line = bytes(message[:32]).split(b'\n', 1)[0]
+    try:
+        payload_size = int(line[len(PROBE_PREFIX):])
+    except ValueError:
+        return None
+    return payload_size if len(message) == payload_size + MAX_SEGMENT_HEADER_SIZE else None
+
+
+def format_range(first, last):
+    return f"{first}-{last}"
+
+
+def parse_range(value, total_segments):
+    """Converte '<primeiro>-<último>' em (início, fim exclusivo) limitado ao arquivo.
+
+    Levanta ValueError se o intervalo for malformado ou não tiver nenhum segmento do arquivo.
+    """
+    first_str, sep, last_str = value.partition('-')
+    if not sep:
+        raise ValueError(f"Intervalo inválido: {value}")
+    first = int(first_str)
+    end = int(last_str) + 1 if last_str.strip() else total_segments
+    end = min(end, total_segments)
+    if first < 0 or first >= end:
+        raise ValueError(f"Intervalo fora do arquivo: {value}")
+    return first, end
+
+
+def parse_get_request(request_str):
+    """Separa o nome do arquivo das opções em uma requisição GET (sem o prefixo 'GET /').
+
+    Retorna (filename, options) com as chaves das opções em minúsculas.
+    """
+    lines = request_str.split('\n')
+    filename = lines[0].strip()
+    options = {}
+    for line in lines[1:]:
+        key, sep, value = line.partition(':')
+        if sep:
+            options[key.strip().lower()] = value.strip()
+    return filename, options
+
+
+def build_ok_response(options):
+    """Monta a resposta do servidor a um GET com opções."""
+    lines = ["OK 200"]
+    for key, value in options.items():
+        lines.append(f"{key}: {value}")
+    return ("\n".join(lines) + "\n").encode('utf-8')
+
+
+def parse_ok_response(message):
+    """Extrai as opções aceitas de uma resposta OK."""
+    _, options = parse_get_request(message.decode('utf-8', errors='ignore'))
+    return options
+
+
+def build_ack(cumulative, selective=(), session_id=None):
+    """ACK [S<sessão>] <cumulativo> [seq ...]
+
+    O valor cumulativo é o próximo segmento esperado em ordem (todos os anteriores foram
+    recebidos). Os números seguintes são segmentos recebidos acima de uma lacuna.
+    """
+    parts = [] if session_id is None else [f"{ACK_SESSION_MARK}{session_id}"]
+    parts.append(str(cumulative))
+    parts.extend(str(seq_num) for seq_num in selective)
+    return f"{ACK_PREFIX}{' '.join(parts)}\n".encode('utf-8')
+
+
+def parse_ack(message_str):
+    """Retorna (sessão ou None, cumulative, [seq ...]) de uma mensagem ACK; levanta ValueError se inválida."""
+    fields = message_str.split()[1:]
+    session_id = None
+    if fields and fields[0].startswith(ACK_SESSION_MARK):
+        session_id = int(fields.pop(0)[len(ACK_SESSION_MARK):])
+    if not fields:
+        raise ValueError("ACK sem número de sequência")
+    numbers = [int(field) for field in fields]
+    return session_id, numbers[0], numbers[1:]
+
+
+def missing_ranges(sorted_seq_nums):
+    """Agrupa números de sequência ordenados em intervalos [(início, quantidade), ...]."""
+    ranges = []
+    for seq_num in sorted_seq_nums:
+        if ranges and ranges[-1][0] + ranges[-1][1] == seq_num:
+            ranges[-1][1] += 1
+        else:
+            ranges.append([seq_num, 1])
+    return [tuple(r) for r in ranges]
+
+
+def _nack_header(kind, base, count, session_id):
+    if session_id is None:
+        return NACK_HEADER.pack(NACK_MAGIC, kind, base, count)
+    return NACK_HEADER.pack(NACK_MAGIC, kind | NACK_KIND_SESSION, base, count) + SESSION_ID.pack(session_id)
+
+
+def _encode_ranges(chunk, session_id=None):
+    header = _nack_header(NACK_KIND_RANGES, 0, len(chunk), session_id)
+    return header + b''.join(NACK_RANGE.pack(start, count) for start, count in chunk)
+
+
+def _encode_bitmap(chunk, session_id=None):
+    base = chunk[0][0]
+    nbits = chunk[-1][0] + chunk[-1][1] - base
+    bits = 0
+    for start, count in chunk:
+        bits |= ((1 << count) - 1) << (nbits - (start - base) - count)
+    nbytes = (nbits + 7) // 8
+    bitmap = (bits << (nbytes * 8 - nbits)).to_bytes(nbytes, 'big')
+    return _nack_header(NACK_KIND_BITMAP, base, nbits, session_id) + bitmap
+
+
+def build_nacks(ranges, session_id=None):
+    """Codifica os intervalos faltantes em datagramas NACK (da sessão session_id, se informada).
+
+    Cada datagrama leva até MAX_NACK_RANGES intervalos; quando os intervalos estão próximos
+    uns dos outros, um bitmap cobrindo o mesmo trecho é menor e é usado no lugar.
+    """
+    datagrams = []
+    for i in range(0, len(ranges), MAX_NACK_RANGES):
+        chunk = ranges[i:i + MAX_NACK_RANGES]
+        span = chunk[-1][0] + chunk[-1][1] - chunk[0][0]
+        bitmap_size = (span + 7) // 8
+        if bitmap_size < len(chunk) * NACK_RANGE.size:
+            datagrams.append(_encode_bitmap(chunk, session_id))
+        else:
+            datagrams.append(_encode_ranges(chunk, session_id))
+    return datagrams
+
+
+def parse_nack(message):
+    """Decodifica um datagrama NACK em (sessão ou None, intervalos); levanta ValueError se malformado."""
+    if len(message) < NACK_HEADER.size:
+        raise ValueError("NACK truncado")
+    magic, kind, base, count = NACK_HEADER.unpack_from(message)
+    if magic != NACK_MAGIC:
+        raise ValueError("NACK com magic inválido")
+    body = memoryview(message)[NACK_HEADER.size:]
+    session_id = None
+    if kind & NACK_KIND_SESSION:
+        if len(body) < SESSION_ID.size:
+            raise ValueError("NACK com sessão truncada")
+        session_id, = SESSION_ID.unpack_from(body)
+        body = body[SESSION_ID.size:]
+        kind &= ~NACK_KIND_SESSION
+    return session_id, _decode_nack_body(kind, base, count, body)
+
+
+def _decode_nack_body(kind, base, count, body):
+    if kind == NACK_KIND_RANGES:
+        if len(body) < count * NACK_RANGE.size:
+            raise ValueError("NACK com intervalos truncados")
+        return [NACK_RANGE.unpack_from(body, i * NACK_RANGE.size) for i in range(count)]
+
+    if kind == NACK_KIND_BITMAP:
+        nbytes = (count + 7) // 8
+        if len(body) < nbytes:
+            raise ValueError("NACK com bitmap truncado")
+        bits = int.from_bytes(body[:nbytes], 'big') >> (nbytes * 8 - count)
+        ranges = []
+        # Percorre as sequências de bits 1 do mais significativo (segmento base) para o menos
+        while bits:
+            top = bits.bit_length()
+            run_start = count - top
+            run_end = count - (~bits & ((1 << top) - 1)).bit_length()
+            ranges.append((base + run_start, run_end - run_start))
+            bits &= (1 << (count - run_end)) - 1
+        return ranges
+
+    raise ValueError(f"Tipo de NACK desconhecido: {kind}")
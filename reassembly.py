@@ -0,0 +1,387 @@
+"""Remontagem do arquivo no cliente direto em disco, com retomada de downloads interrompidos.
+
+Cada segmento verificado é escrito na sua posição final de um arquivo "<saída>.part", e um
+bitmap (1 bit por segmento) registra o que já foi recebido. O uso de memória independe do
+tamanho do arquivo. O bitmap é salvo periodicamente em "<saída>.part.state", para que um
+download interrompido possa ser retomado pedindo só os segmentos que faltam. Ao completar,
+o arquivo .part é renomeado para o nome final e o arquivo de estado é removido.
+
+No download em vários fluxos cada fluxo tem o seu Reassembler, que guarda só o intervalo de
+segmentos a partir de first_segment (o segmento first_segment fica no início do arquivo).
+
+Com --delta, uma cópia antiga do arquivo já presente no destino é adotada como download
+interrompido (adopt_local_copy): ela vira o arquivo .part, e o bitmap marca os blocos cujo
+digest coincide com o manifesto do servidor, de modo que só os demais são pedidos. A versão
+do arquivo remoto (mtime e tamanho) fica no arquivo de estado e acompanha o GET de retomada;
+se o arquivo mudou no servidor, ele responde 412 em vez de misturar duas versões.
+
+Com compressão, o Reassembler guarda a imagem comprimida (em "<saída>.<codec>") e um
+Decompressor, estágio seguinte do pipeline, descomprime os blocos em ordem à medida que a
+imagem se completa, gravando o arquivo original em "<saída>.part".
+"""
+import json
+import logging
+import os
+import re
+import shutil
+
+import compression
+
+PART_SUFFIX = '.part'
+STATE_SUFFIX = '.part.state'
+CHECKPOINT_EVERY = 1024 # Segmentos novos entre gravações do arquivo de estado
+OPEN_TAIL = 0xFFFFFFFF # Quantidade usada para pedir "até o fim do arquivo" quando o total é desconhecido
+
+_INCOMPLETE_BYTES = re.compile(rb'[^\xff]+') # Bytes do bitmap com pelo menos um segmento faltando
+
+
+def saved_payload_size(output_filename, remote_filename):
+    """Tamanho de segmento de um download interrompido de remote_filename em output_filename, ou None."""
+    state_filename = output_filename + STATE_SUFFIX
+    if not (os.path.exists(state_filename) and os.path.exists(output_filename + PART_SUFFIX)):
+        return None
+    try:
+        with open(state_filename, 'rb') as f:
+            header = json.loads(f.readline())
+    except (OSError, ValueError):
+        return None
+    if header.get('filename') != remote_filename or header.get('version') is None:
+        return None # Sem versão o estado será descartado (veja Reassembler.load_state)
+    return header.get('payload_size')
+
+
+def _write_state(state_filename, header, bitmap):
+    tmp_filename = state_filename + '.tmp'
+    with open(tmp_filename, 'wb') as f:
+        f.write(json.dumps(header).encode('utf-8') + b'\n')
+        f.write(bitmap)
+    os.replace(tmp_filename, state_filename)
+
+
+def adopt_local_copy(output_filename, remote_filename, payload_size, total_segments, final_size, present_ranges, version):
+    """Transforma a cópia local em output_filename num download interrompido de remote_filename.
+
+    present_ranges são os intervalos (início, quantidade) de segmentos cujo conteúdo local já
+    confere com o do servidor. A cópia é renomeada para o arquivo .part e ajustada ao tamanho
+    final; o Reassembler criado em seguida a retoma pedindo só os segmentos que faltam.
+    """
+    bitmap = bytearray((total_segments + 7) // 8)
+    for start, count in present_ranges:
+        for seq_num in range(start, start + count):
+            bitmap[seq_num >> 3] |= 0x80 >> (seq_num & 7)
+    part_filename = output_filename + PART_SUFFIX
+    os.replace(output_filename, part_filename)
+    os.truncate(part_filename, final_size)
+    header = {
+        'filename': remote_filename,
+        'payload_size': payload_size,
+        'first_segment': 0,
+        'total_segments': total_segments,
+        'final_size': final_size,
+        'version': version,
+    }
+    _write_state(output_filename + STATE_SUFFIX, header, bitmap)
+
+
+class Reassembler:
+    """Escreve segmentos fora de ordem no arquivo de saída e acompanha o que falta."""
+
+    def __init__(self, output_filename, remote_filename, payload_size, first_segment=0):
+        self.output_filename = output_filename
+        self.part_filename = output_filename + PART_SUFFIX
+        self.state_filename = output_filename + STATE_SUFFIX
+        self.remote_filename = remote_filename
+        self.payload_size = payload_size
+        self.first_segment = first_segment # Números de sequência são do arquivo remoto inteiro
+        self.bitmap = bytearray()
+        self.received = 0
+        self.highest = -1 # Posição relativa a first_segment, como o bitmap
+        self.total_segments = None # Segmentos deste Reassembler (a partir de first_segment)
+        self.final_size = None
+        self.version = None # Versão do arquivo remoto (OPTION_VERSION) de que os segmentos vieram
+        self.since_checkpoint = 0
+        self.closed = False
+
+        if self.load_state():
+            logging.info(f"Retomando download de {remote_filename}: {self.received} segmentos já recebidos em {self.part_filename}")
+            self.fd = os.open(self.part_filename, os.O_RDWR)
+        else:
+            self.fd = os.open(self.part_filename, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+
+    @property
+    def resumed(self):
+        return self.received > 0
+
+    def load_state(self):
+        """Carrega o bitmap de um download anterior do mesmo arquivo, se existir."""
+        if not (os.path.exists(self.state_filename) and os.path.exists(self.part_filename)):
+            return False
+        try:
+            with open(self.state_filename, 'rb') as f:
+                header = json.loads(f.readline())
+                bitmap = bytearray(f.read())
+        except (OSError, ValueError) as e:
+            logging.warning(f"Arquivo de estado {self.state_filename} ilegível ({e}). Reiniciando o download.")
+            return False
+        if (header.get('filename') != self.remote_filename or header.get('payload_size') != self.payload_size
+                or header.get('first_segment', 0) != self.first_segment):
+            logging.warning(f"Arquivo de estado {self.state_filename} é de outro download. Reiniciando o download.")
+            return False
+        if header.get('version') is None:
+            # Sem a versão não há como o servidor recusar (412) segmentos de um arquivo que mudou
+            logging.warning(f"Arquivo de estado {self.state_filename} não registra a versão do arquivo remoto. Reiniciando o download.")
+            return False
+
+        self.bitmap = bitmap
+        self.total_segments = header.get('total_segments')
+        self.final_size = header.get('final_size')
+        self.version = header.get('version')
+        self.received = int.from_bytes(bitmap, 'big').bit_count()
+        self.highest = self._highest_received()
+        return True
+
+    def _highest_received(self):
+        for index in range(len(self.bitmap) - 1, -1, -1):
+            byte = self.bitmap[index]
+            if byte:
+                return index * 8 + 7 - (byte & -byte).bit_length() + 1
+        return -1
+
+    def __contains__(self, seq_num):
+        seq_num -= self.first_segment
+        if seq_num < 0:
+            return False
+        index = seq_num >> 3
+        return index < len(self.bitmap) and bool(self.bitmap[index] & (0x80 >> (seq_num & 7)))
+
+    def __len__(self):
+        return self.received
+
+    def set_total(self, total_segments, final_size=None):
+        """Registra o total de segmentos (e o tamanho final, se conhecido) e pré-aloca o arquivo."""
+        self.total_segments = total_segments
+        if final_size is not None:
+            self.final_size = final_size
+        needed = (total_segments + 7) // 8
+        if len(self.bitmap) < needed:
+            self.bitmap.extend(bytes(needed - len(self.bitmap)))
+        size = self.final_size if self.final_size is not None else total_segments * self.payload_size
+        try:
+            if hasattr(os, 'posix_fallocate') and size > 0:
+                os.posix_fallocate(self.fd, 0, size)
+            elif os.fstat(self.fd).st_size < size:
+                os.ftruncate(self.fd, size)
+        except OSError as e:
+            logging.warning(f"Não foi possível pré-alocar {size} bytes para {self.part_filename}: {e}")
+
+    def add(self, seq_num, data, is_last=False):
+        """Escreve um segmento na sua posição; retorna False se já tinha sido recebido (ou está fora do intervalo)."""
+        if seq_num in self:
+            return False
+        seq_num -= self.first_segment
+        if seq_num < 0 or (self.total_segments is not None and seq_num >= self.total_segments):
+            return False
+        if len(data) > self.payload_size:
+            return False # Segmento de outro tamanho: gravá-lo sobrescreveria o vizinho
+        if is_last:
+            self.set_total(seq_num + 1, seq_num * self.payload_size + len(data))
+
+        index = seq_num >> 3
+        if index >= len(self.bitmap):
+            self.bitmap.extend(bytes(index + 1 - len(self.bitmap)))
+        self._write_at(seq_num * self.payload_size, data)
+        self.bitmap[index] |= 0x80 >> (seq_num & 7)
+        self.received += 1
+        self.highest = max(self.highest, seq_num)
+
+        self.since_checkpoint += 1
+        if self.since_checkpoint >= CHECKPOINT_EVERY:
+            self.checkpoint()
+        return True
+
+    def read(self, seq_num):
+        """Lê de volta um segmento já gravado."""
+        offset = (seq_num - self.first_segment) * self.payload_size
+        size = self.payload_size
+        if self.final_size is not None:
+            size = min(size, self.final_size - offset)
+        return os.pread(self.fd, size, offset)
+
+    def _write_at(self, offset, data):
+        if hasattr(os, 'pwrite'):
+            os.pwrite(self.fd, data, offset)
+        else:
+            os.lseek(self.fd, offset, os.SEEK_SET)
+            os.write(self.fd, data)
+
+    def complete(self):
+        return self.total_segments is not None and self.received >= self.total_segments
+
+    def missing_ranges(self):
+        """Intervalos (início, quantidade) ainda não recebidos, com os números de sequência remotos.
+
+        Só os bytes do bitmap diferentes de 0xFF são examinados bit a bit. Se o total de
+        segmentos ainda é desconhecido, o último intervalo vai até o fim do arquivo (OPEN_TAIL).
+        """
+        limit = self.total_segments if self.total_segments is not None else self.highest + 1
+        ranges = []
+        for match in _INCOMPLETE_BYTES.finditer(self.bitmap, 0, (limit + 7) // 8):
+            for index in range(match.start(), match.end()):
+                byte = self.bitmap[index]
+                for bit in range(8):
+                    seq_num = index * 8 + bit
+                    if seq_num >= limit:
+                        break
+                    if not byte & (0x80 >> bit):
+                        if ranges and ranges[-1][0] + ranges[-1][1] == seq_num:
+                            ranges[-1][1] += 1
+                        else:
+                            ranges.append([seq_num, 1])
+        # Bytes do bitmap ainda não alocados (segmentos nunca vistos) abaixo do limite
+        tail_start = len(self.bitmap) * 8
+        if tail_start < limit:
+            if ranges and ranges[-1][0] + ranges[-1][1] == tail_start:
+                ranges[-1][1] += limit - tail_start
+            else:
+                ranges.append([tail_start, limit - tail_start])
+        base = self.first_segment
+        if self.total_segments is None:
+            start = self.highest + 1
+            if ranges and ranges[-1][0] + ranges[-1][1] == start:
+                ranges[-1][1] = OPEN_TAIL - base - ranges[-1][0]
+            else:
+                ranges.append([start, OPEN_TAIL - base - start])
+        return [(start + base, count) for start, count in ranges]
+
+    def checkpoint(self):
+        """Grava o bitmap para permitir retomar o download (depois de gravar os dados)."""
+        self.since_checkpoint = 0
+        header = {
+            'filename': self.remote_filename,
+            'payload_size': self.payload_size,
+            'first_segment': self.first_segment,
+            'total_segments': self.total_segments,
+            'final_size': self.final_size,
+            'version': self.version,
+        }
+        try:
+            os.fsync(self.fd) # Os bits do bitmap só podem ser gravados depois dos dados
+            _write_state(self.state_filename, header, self.bitmap)
+        except OSError as e:
+            logging.warning(f"Não foi possível gravar o estado do download em {self.state_filename}: {e}")
+
+    def finish(self):
+        """Ajusta o tamanho final, fecha o arquivo e o move para o nome de saída."""
+        if self.final_size is not None:
+            os.ftruncate(self.fd, self.final_size)
+        os.close(self.fd)
+        self.closed = True
+        os.replace(self.part_filename, self.output_filename)
+        if os.path.exists(self.state_filename):
+            os.remove(self.state_filename)
+
+    def close(self):
+        """Encerra um download incompleto, salvando o estado para uma retomada futura."""
+        if self.closed:
+            return
+        if self.received:
+            self.checkpoint()
+        os.close(self.fd)
+        self.closed = True
+
+
+def stitch_files(part_filenames, output_filename):
+    """Concatena, em ordem, os arquivos dos fluxos no arquivo de saída e os remove."""
+    tmp_filename = output_filename + PART_SUFFIX
+    with open(tmp_filename, 'wb') as out:
+        for part_filename in part_filenames:
+            with open(part_filename, 'rb') as part:
+                _copy_file(part, out)
+    os.replace(tmp_filename, output_filename)
+    for part_filename in part_filenames:
+        os.remove(part_filename)
+
+
+def _copy_file(src, dst):
+    """Copia src para dst no kernel (copy_file_range) quando possível."""
+    if hasattr(os, 'copy_file_range'):
+        start = dst.tell()
+        try:
+            while os.copy_file_range(src.fileno(), dst.fileno(), 1 << 30):
+                pass
+            return
+        except OSError:
+            # Sistema de arquivos sem suporte: recomeça a cópia pelo espaço do usuário
+            src.seek(0)
+            dst.seek(start)
+            dst.truncate()
+    shutil.copyfileobj(src, dst, 1 << 20)
+
+
+class Decompressor:
+    """Descomprime, em ordem, a imagem que um Reassembler recebe e grava o arquivo original.
+
+    advance() deve ser chamado a cada segmento novo; os segmentos que chegaram fora de ordem
+    são lidos de volta do Reassembler quando a lacuna anterior é preenchida. Ao retomar um
+    download, o trecho já recebido é descomprimido de novo.
+    """
+
+    def __init__(self, reassembler, codec, output_filename):
+        self.reassembler = reassembler
+        self.decoder = compression.BlockDecoder(codec)
+        self.output_filename = output_filename
+        self.part_filename = output_filename + PART_SUFFIX
+        self.next_segment = reassembler.first_segment # Próximo segmento da imagem a descomprimir
+        self.fd = os.open(self.part_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        self.closed = False
+        self.advance()
+
+    def advance(self, seq_num=None, data=None):
+        """Entrega ao decodificador o segmento recém-chegado e os seguintes já recebidos."""
+        if seq_num == self.next_segment:
+            self._feed(data)
+            self.next_segment += 1
+        while self.next_segment in self.reassembler:
+            self._feed(self.reassembler.read(self.next_segment))
+            self.next_segment += 1
+
+    def _feed(self, data):
+        for block in self.decoder.feed(data):
+            os.write(self.fd, block)
+
+    def finish(self):
+        """Confere que a imagem inteira foi descomprimida e move o arquivo para o nome de saída.
+
+        Chamado depois de Reassembler.finish(); a imagem comprimida é removida. Levanta
+        DecompressionError se a imagem terminar no meio de um bloco.
+        """
+        if not self.decoder.finished():
+            raise compression.DecompressionError(f"Imagem comprimida terminou no meio de um bloco ({len(self.decoder.pending)} bytes pendentes)")
+        os.close(self.fd)
+        self.closed = True
+        os.replace(self.part_filename, self.output_filename)
+        if os.path.exists(self.reassembler.output_filename):
+            os.remove(self.reassembler.output_filename)
+        logging.info(f"Descomprimidos {self.decoder.consumed} bytes em {self.decoder.produced} bytes ({self.output_filename})")
+
+    def close(self):
+        if not self.closed:
+            os.close(self.fd)
+            self.closed = True
+
+
+def decompress_file(image_filename, output_filename, codec, chunk_size=1 << 20):
+    """Descomprime uma imagem completa já gravada (download em vários fluxos) e a remove."""
+    decoder = compression.BlockDecoder(codec)
+    tmp_filename = output_filename + PART_SUFFIX
+    with open(image_filename, 'rb') as image, open(tmp_filename, 'wb') as out:
+        while True:
+            chunk = image.read(chunk_size)
+            if not chunk:
+                break
+            for block in decoder.feed(chunk):
+                out.write(block)
+    if not decoder.finished():
+        raise compression.DecompressionError(f"Imagem comprimida {image_filename} terminou no meio de um bloco")
+    os.replace(tmp_filename, output_filename)
+    os.remove(image_filename)
@@ -0,0 +1,76 @@
+"""Recebimento de datagramas sem alocação: recvfrom_into sobre um anel de buffers pré-alocados.
+
+recvfrom(BUFFER_SIZE) alocava um bytes novo de 64 KiB por datagrama, e separar cabeçalho e
+dados com fatias copiava tudo de novo. Aqui cada datagrama é lido direto em uma posição de
+um buffer pré-alocado e entregue como memoryview: o cabeçalho é decodificado com
+struct.Struct.unpack_from e os dados seguem sem cópia até o pwrite da remontagem.
+
+A espera é feita com select e, quando chega um datagrama, o socket é esvaziado em rajada
+(até o tamanho do anel) antes de voltar ao loop do cliente. O SO_RCVBUF é aumentado para
+que o kernel absorva as rajadas do servidor enquanto o cliente grava em disco.
+"""
+import logging
+import selectors
+import socket
+
+RING_SLOTS = 64 # Datagramas lidos por rajada (posições do anel)
+SLOT_SIZE = 65536 # Comporta o maior datagrama UDP
+RCVBUF_SIZE = 8 * 1024 * 1024 # Buffer de recebimento pedido ao kernel (limitado por net.core.rmem_max)
+
+
+def set_receive_buffer(sock, size):
+    """Aumenta o SO_RCVBUF do socket e retorna o tamanho concedido pelo kernel."""
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+    except OSError as e:
+        logging.warning(f"Não foi possível ajustar SO_RCVBUF para {size} bytes: {e}")
+    granted = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+    # O Linux reserva o dobro do pedido (metade para controle); menos que o pedido indica o limite do sistema
+    if granted < size:
+        logging.info(f"SO_RCVBUF limitado a {granted} bytes pelo sistema (pedido: {size}). Em Linux, aumente net.core.rmem_max para receber rajadas maiores sem perdas.")
+    return granted
+
+
+class DatagramReceiver:
+    """Lê rajadas de datagramas de um socket para um anel de buffers reutilizados.
+
+    Os memoryviews devolvidos por receive() apontam para o anel e só são válidos até a
+    próxima chamada; quem precisar guardar os dados deve copiá-los.
+    """
+
+    def __init__(self, sock, slots=RING_SLOTS, slot_size=SLOT_SIZE, rcvbuf=RCVBUF_SIZE):
+        self.sock = sock
+        self.sock.setblocking(False) # Esvaziar a fila exige leituras que não bloqueiam
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ)
+        self.ring = bytearray(slots * slot_size)
+        ring_view = memoryview(self.ring)
+        self.slots = [ring_view[i * slot_size:(i + 1) * slot_size] for i in range(slots)]
+        self.rcvbuf = set_receive_buffer(sock, rcvbuf)
+        self.datagrams = 0
+        self.bursts = 0
+
+    def receive(self, timeout):
+        """Espera até timeout segundos por um datagrama e lê também os que já estão na fila.
+
+        Retorna uma lista de (memoryview, endereço); levanta socket.timeout se nada chegar.
+        """
+        burst = []
+        recv_into = self.sock.recvfrom_into
+        while len(burst) < len(self.slots):
+            slot = self.slots[len(burst)]
+            try:
+                nbytes, address = recv_into(slot)
+            except (BlockingIOError, InterruptedError):
+                if burst:
+                    break # Fila vazia: entrega a rajada
+                if not self.selector.select(timeout):
+                    raise socket.timeout("timed out")
+                continue
+            burst.append((slot[:nbytes], address))
+        self.datagrams += len(burst)
+        self.bursts += 1
+        return burst
+
+    def close(self):
+        self.selector.close()
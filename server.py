@@ -3,6 +3,26 @@ import os
 import struct
 import time
 import logging
+import argparse
+import array
+import collections
+import heapq
+import ipaddress
+import itertools
+import json
+import multiprocessing
+import selectors
+from concurrent.futures import ThreadPoolExecutor
+
+import checksum
+import compression
+import congestion
+import fec
+import filecache
+import metrics
+import protocol
+import sendpath
+import sessions
 
 # Configuração de Logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - SERVER - %(levelname)s - %(message)s')
@@ -10,149 +30,1237 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - SERVER - %(levelna
 # Constantes do Protocolo
 HEADER_FORMAT = '!I H B' # Sequence Number (unsigned int), Checksum (unsigned short), Flags (unsigned byte)
 HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
-DATA_PAYLOAD_SIZE = 1400 # Tamanho dos dados (em bytes) que serão incluídos em cada segmento UDP enviado.
+DATA_PAYLOAD_SIZE = protocol.DEFAULT_PAYLOAD_SIZE # Tamanho dos dados (em bytes) que serão incluídos em cada segmento UDP enviado.
 # Escolhido para evitar fragmentação IP em redes Ethernet padrão (MTU 1500 bytes, subtraindo os tamanhos típicos dos cabeçalhos IP e UDP).
+# O cliente pode negociar outro tamanho por transferência (opção payload do GET).
 BUFFER_SIZE = HEADER_SIZE + DATA_PAYLOAD_SIZE + 512 # Tamanho do buffer de recebimento (com folga)
 
-FLAG_LAST = 0x01 # Flag para indicar o último segmento
-def calculate_checksum(data):
-    """Calcula um checksum simples (soma dos bytes modulo 65536)."""
-    s = 0
-    for byte in data:
-        s += byte
-    return s % 65536
-
-def send_segment(sock, addr, seq_num, data, is_last=False):
-    """Monta e envia um segmento de dados."""
-    checksum = calculate_checksum(data)
-    flags = FLAG_LAST if is_last else 0
-    header = struct.pack(HEADER_FORMAT, seq_num, checksum, flags)
-    segment = header + data
+FLAG_LAST = protocol.FLAG_LAST # Flag para indicar o último segmento
+FLAG_PARITY = protocol.FLAG_PARITY # Segmento de paridade (FEC)
+
+SEGMENT_INTERVAL = 0.001 # Intervalo entre segmentos de uma mesma transferência (1 milissegundo)
+MAX_MESSAGES_PER_TICK = 64 # Máximo de datagramas processados antes de voltar a enviar segmentos
+DUPTHRESH = 3 # Segmentos posteriores confirmados para considerar um segmento perdido (modo com janela)
+REORDER_WINDOW = 0.25 # Fração do menor RTT que um segmento pode atrasar além do RTT antes de ser dado como perdido
+MAX_REORDER_STEPS = 8 # Máximo de vezes que a janela de reordenação cresce após perdas espúrias (limitada ao SRTT)
+MAX_TIMEOUTS = 8 # Timeouts seguidos sem nenhum ACK antes de abandonar uma transferência com janela
+RESEND_BURST = 64 # Segmentos reenviados por ciclo do loop ao atender um NACK
+RESEND_RATE = 32 * 1024 * 1024 # Bytes/s dos reenvios de uma sessão sem transferência com janela em andamento
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024 # Limite de bytes mapeados no cache de arquivos
+DEFAULT_CACHE_FILES = 64 # Limite de arquivos no cache
+BACKGROUND_THREADS = 2 # Threads para a compressão de arquivos, fora do loop de eventos
+MAX_STATS_REPLY = 65507 # Maior datagrama UDP; respostas STATS maiores omitem o detalhe por cliente
+
+LEGACY_CHECKSUM = checksum.get_algorithm(checksum.DEFAULT_ALGORITHM)
+TRACER = metrics.Tracer() # Rastreamento amostrado de pacotes (--trace)
+
+def send_cached_segments(sender, addr, cached_file, seq_num, count=1, algorithm=LEGACY_CHECKSUM, raise_on_block=False, end_segment=None,
+                         transfer_metrics=None, retransmission=False, header=None):
+    """Envia count segmentos consecutivos de um arquivo em cache; retorna quantos foram enviados.
+
+    Os payloads são memoryviews sobre o mapeamento e os checksums vêm do cache. Com GSO o
+    lote inteiro sai em um único sendmsg (veja sendpath). Com raise_on_block, BlockingIOError
+    (buffer de envio cheio em socket não bloqueante) é propagado quando nenhum segmento pôde
+    ser enviado, para que o chamador possa tentar novamente. O segmento anterior a end_segment
+    (padrão: fim do arquivo) leva a flag de último. Os envios são somados a transfer_metrics,
+    se informado, uma vez por lote. header substitui o cabeçalho original (segmentos de uma
+    sessão levam o ID dela).
+    """
+    end = seq_num + count
+    payloads = [cached_file.segment(s) for s in range(seq_num, end)]
+    checksums = [cached_file.checksum(algorithm, s) for s in range(seq_num, end)]
+    last_flags = FLAG_LAST if end == (end_segment or cached_file.total_segments) else 0
     try:
-        sock.sendto(segment, addr)
+        sent = sender.send_segments(addr, header or protocol.segment_header(algorithm), seq_num, payloads, checksums, last_flags)
+    except BlockingIOError:
+        if raise_on_block:
+            raise
+        logging.error(f"Buffer de envio cheio ao enviar segmento {seq_num} para {addr}")
+        return count # Segmentos não enviados ficam para a recuperação de perdas
     except socket.error as e:
         logging.error(f"Erro ao enviar segmento {seq_num} para {addr}: {e}")
+        return count
+    if transfer_metrics is not None:
+        transfer_metrics.segments_sent += sent
+        transfer_metrics.bytes_sent += sum(map(len, payloads[:sent]))
+        if retransmission:
+            transfer_metrics.segments_retransmitted += sent
+    if TRACER.enabled and TRACER.sample():
+        TRACER.debug(f"{'Reenviados' if retransmission else 'Enviados'} {sent} segmentos a partir de {seq_num} para {addr}")
+    return sent
+
 
+def send_parity_segment(sender, session, cached_file, first, count, last=False, transfer_metrics=None):
+    """Envia o segmento de paridade (FEC) dos count segmentos a partir de first; retorna se foi enviado.
 
-def handle_retransmission(sock, addr, filename, seq_num_to_resend):
-    """Reenvia um segmento específico a pedido do cliente."""
+    Uma paridade que não pôde ser enviada não é repetida: as perdas do grupo ficam para a
+    recuperação normal (NACK ou retransmissão do modo com janela).
+    """
+    parity = fec.build_parity([cached_file.segment(s) for s in range(first, first + count)])
+    flags = FLAG_PARITY | (FLAG_LAST if last else 0)
     try:
-        with open(filename, 'rb') as f:
-            f.seek(seq_num_to_resend * DATA_PAYLOAD_SIZE)
-            data = f.read(DATA_PAYLOAD_SIZE)
-            if data:
-                 # Precisamos saber se este segmento *era* o último originalmente
-                 file_size = os.path.getsize(filename)
-                 total_segments = (file_size + DATA_PAYLOAD_SIZE - 1) // DATA_PAYLOAD_SIZE
-                 is_last = (seq_num_to_resend == total_segments - 1)
-
-                 logging.info(f"Reenviando segmento {seq_num_to_resend} para {addr}")
-                 send_segment(sock, addr, seq_num_to_resend, data, is_last)
-            else:
-                logging.warning(f"Pedido de retransmissão para segmento {seq_num_to_resend} além do fim do arquivo {filename}")
+        sender.send_segments(session.client_address, session.header, first, [parity], [session.algorithm.function(parity)], flags)
+    except socket.error as e:
+        logging.debug(f"Paridade do grupo {first} não enviada para {session.client_address}: {e}")
+        return False
+    if transfer_metrics is not None:
+        transfer_metrics.parity_sent += 1
+        transfer_metrics.bytes_sent += len(parity)
+    if TRACER.enabled and TRACER.sample():
+        TRACER.debug(f"Enviada paridade de {count} segmentos a partir de {first} para {session.client_address}")
+    return True
+
 
-    except FileNotFoundError:
-        logging.error(f"Arquivo {filename} não encontrado para retransmissão.")
-    except IOError as e:
-        logging.error(f"Erro de I/O ao ler {filename} para retransmissão: {e}")
+def handle_retransmission(sender, session, seq_num_to_resend):
+    """Reenvia um segmento específico a pedido do cliente da sessão."""
+    cached_file = session.cached_file
+    first, end = session.segment_range or (0, cached_file.total_segments)
+    if not first <= seq_num_to_resend < end:
+        logging.warning(f"Pedido de retransmissão para segmento {seq_num_to_resend} fora do intervalo pedido do arquivo {cached_file.filename}")
+        return
+    try:
+        send_cached_segments(sender, session.client_address, cached_file, seq_num_to_resend, 1, session.algorithm, end_segment=end,
+                             transfer_metrics=session.metrics, retransmission=True, header=session.header)
     except Exception as e:
         logging.error(f"Erro inesperado ao retransmitir segmento {seq_num_to_resend}: {e}")
 
 
-def start_server(host='0.0.0.0', port=9999):
-    """Inicializa e executa o servidor UDP."""
-    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    try:
-        udp_socket.bind((host, port))
-        logging.info(f"Servidor UDP escutando em {host}:{port}")
-    except socket.error as e:
-        logging.error(f"Falha ao fazer bind na porta {port}: {e}")
-        return
+class Transfer:
+    """Estado de uma transferência GET em andamento no servidor (modo sem janela).
 
-    active_transfers = {} # Para rastrear qual arquivo cada cliente está baixando (simplificado)
+    Envia um segmento a cada SEGMENT_INTERVAL, sem esperar confirmações; as perdas são
+    recuperadas pelos pedidos RETRANS do cliente. O intervalo de segmentos da sessão (início,
+    fim exclusivo) restringe o envio a uma parte do arquivo (download em vários fluxos). Os
+    contadores vão para as métricas da sessão, compartilhadas com os reenvios.
+
+    Com fec_sizer (veja fec.py), a paridade de cada grupo sai logo após o último segmento dele.
+    """
+
+    def __init__(self, session, fec_sizer=None):
+        self.session = session
+        self.cached_file = session.cached_file
+        self.filename = self.cached_file.filename
+        self.file_size = self.cached_file.size
+        self.algorithm = session.algorithm
+        self.total_segments = self.cached_file.total_segments
+        self.first_segment, self.end_segment = session.segment_range or (0, self.total_segments)
+        self.next_seq = self.first_segment
+        self.metrics = session.metrics
+        self.fec = fec_sizer
+        self.group_start = self.first_segment # Primeiro segmento do grupo de paridade atual
+        self.group_end = min(self.first_segment + fec_sizer.group_size, self.end_segment) if fec_sizer else None
+        self.schedule_id = None # Identifica a entrada válida desta transferência no heap do servidor
+        self.cancelled = False
+        self.aborted = False
+
+    @property
+    def client_address(self):
+        return self.session.client_address # Acompanha a sessão se o cliente mudar de endereço
+
+    def finished(self):
+        return self.next_seq >= self.end_segment
+
+    def send(self, sender, seq_num, count=1, retransmission=False):
+        return send_cached_segments(sender, self.session.client_address, self.cached_file, seq_num, count, self.algorithm,
+                                    raise_on_block=True, end_segment=self.end_segment,
+                                    transfer_metrics=self.metrics, retransmission=retransmission, header=self.session.header)
+
+    def send_due_parity(self, sender):
+        """Envia a paridade dos grupos cujos segmentos já foram todos enviados."""
+        while self.group_start < self.end_segment and self.next_seq >= self.group_end:
+            self.send_parity(sender, self.group_start, self.group_end - self.group_start)
+            self.group_start = self.group_end
+            self.group_end = min(self.group_start + self.fec.next_group(self.metrics.segments_retransmitted), self.end_segment)
+
+    def send_parity(self, sender, first, count):
+        return send_parity_segment(sender, self.session, self.cached_file, first, count, first + count == self.end_segment, self.metrics)
+
+    def on_timer(self, sender, now):
+        """Envia o que estiver devido e retorna o horário do próximo envio (None se nenhum)."""
+        self.send(sender, self.next_seq)
+        self.next_seq += 1
+        if self.fec is not None:
+            self.send_due_parity(sender)
+        if self.finished():
+            return None
+        # pausa entre segmentos da mesma transferência, equivalente ao antigo time.sleep(0.001)
+        return now + SEGMENT_INTERVAL
+
+    def summary(self):
+        return f"enviados {self.next_seq - self.first_segment} segmentos"
+
+    def close(self):
+        self.cached_file = None # O mapeamento pertence ao cache
+
+
+class ResendJob:
+    """Retransmissões pedidas por NACK, agendadas como uma transferência.
+
+    Cada sessão tem no máximo um ResendJob pendente: os intervalos de NACKs seguintes são
+    juntados aos que ainda aguardam reenvio, sem repetir segmentos já na fila. Os segmentos
+    vêm do cache de arquivos, em lotes de até RESEND_BURST por ciclo do loop, para não bloquear
+    as demais transferências, e são espaçados pelo balde de tokens da transferência com janela
+    da sessão (se ainda estiver em andamento) ou por um próprio, a RESEND_RATE. Segmentos
+    consecutivos saem juntos em um único envio quando há GSO.
+    """
+
+    def __init__(self, session, ranges):
+        self.session = session
+        self.cached_file = session.cached_file
+        self.filename = self.cached_file.filename
+        self.algorithm = session.algorithm
+        self.metrics = session.metrics
+        self.first_segment, self.end_segment = session.segment_range or (0, self.cached_file.total_segments)
+        self.ranges = collections.deque() # Intervalos (início, quantidade) disjuntos, em ordem crescente
+        self.add(ranges)
+        rate = RESEND_RATE / (session.header.size + self.cached_file.payload_size)
+        self.pacer = congestion.TokenBucket(rate, RESEND_BURST, now=time.monotonic())
+        self.resent = 0
+        self.schedule_id = None
+        self.cancelled = False
+        self.aborted = False
+
+    @property
+    def client_address(self):
+        return self.session.client_address
+
+    def finished(self):
+        return not self.ranges
+
+    def add(self, ranges):
+        """Junta intervalos pedidos aos pendentes; retorna quantos segmentos novos entraram na fila.
+
+        Os intervalos são limitados ao intervalo pedido no GET (ou ao arquivo).
+        """
+        pending = sum(count for _, count in self.ranges)
+        merged = []
+        for start, count in sorted(list(self.ranges) + list(ranges)):
+            end = min(start + count, self.end_segment)
+            start = max(start, self.first_segment)
+            if start >= end:
+                continue
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self.ranges = collections.deque((start, end - start) for start, end in merged)
+        return sum(count for _, count in self.ranges) - pending
+
+    def on_timer(self, sender, now):
+        transfer = self.session.transfer
+        pacer = transfer.pacer if isinstance(transfer, WindowedTransfer) else self.pacer
+        if not pacer.try_consume(now):
+            return now + pacer.time_until_token(now)
+        start, count = self.ranges[0]
+        batch = 1 + pacer.consume_up_to(now, min(count, RESEND_BURST) - 1)
+        step = sender.max_batch(self.session.header.size + self.cached_file.payload_size)
+        i = 0
+        while i < batch:
+            wanted = min(step, batch - i)
+            try:
+                sent = send_cached_segments(sender, self.session.client_address, self.cached_file, start + i, wanted, self.algorithm,
+                                            raise_on_block=True, end_segment=self.end_segment,
+                                            transfer_metrics=self.metrics, retransmission=True, header=self.session.header)
+            except BlockingIOError:
+                sent = 0
+            i += sent
+            self.resent += sent
+            if sent < wanted:
+                pacer.tokens += batch - i # Devolve os tokens dos segmentos não enviados
+                self.ranges[0] = (start + i, count - i) # Continua deste segmento no próximo ciclo
+                raise BlockingIOError
+
+        if batch == count:
+            self.ranges.popleft()
+        else:
+            self.ranges[0] = (start + batch, count - batch)
+        return None if self.finished() else now # Cede a vez às outras transferências
+
+    def summary(self):
+        return f"reenviados {self.resent} segmentos"
+
+    def close(self):
+        self.cached_file = None
+
+
+# Estados de cada segmento no placar do modo com janela
+SEG_NOT_SENT = 0
+SEG_IN_FLIGHT = 1
+SEG_LOST = 2
+SEG_ACKED = 3
 
-    while True:
-        try:
-            logging.info("Aguardando requisições...")
-            message, client_address = udp_socket.recvfrom(BUFFER_SIZE)
-            message_str = message.decode('utf-8', errors='ignore').strip()
-            logging.info(f"Recebido de {client_address}: {message_str[:100]}") # Log truncado
 
-            if message_str.startswith('GET /'):
-                filename_req = message_str[5:]
-                logging.info(f"Cliente {client_address} requisitou o arquivo: {filename_req}")
+class WindowedTransfer(Transfer):
+    """Transferência com janela deslizante, ACKs seletivos e controle de congestionamento AIMD.
 
-                # Armazena o arquivo que este cliente está tentando baixar
-                active_transfers[client_address] = filename_req
+    Um segmento é dado como perdido quando DUPTHRESH segmentos posteriores já foram
+    confirmados e ele foi enviado há mais de um RTT mais a janela de reordenação
+    (REORDER_WINDOW do menor RTT, como no RACK da RFC 8985), ou no timeout de retransmissão,
+    e é reenviado pelo próprio servidor. Assim o jitter, que só reordena os segmentos, não
+    dispara retransmissões nem reduz a janela: um segmento que só cumpre a contagem volta a ser
+    verificado quando a janela de reordenação dele expira (reorder_deadline). Se todos os
+    segmentos dados como perdidos são confirmados antes de serem reenviados, a perda foi
+    espúria: a redução da janela é desfeita (como no Eifel, RFC 3522) e a janela de
+    reordenação cresce mais um REORDER_WINDOW do menor RTT. Uma retransmissão
+    perdida é detectada da mesma forma, comparando a ordem de envio. O envio é limitado pela
+    janela de congestionamento e espaçado por um balde de tokens.
 
+    Com FEC, os segmentos de um grupo só são dados como perdidos depois que a paridade dele
+    teve a chance de chegar (DUPTHRESH envios posteriores a ela confirmados), para que o
+    cliente os reconstrua antes de o servidor retransmiti-los; o timeout continua valendo.
+    """
+
+    def __init__(self, session, fec_sizer=None):
+        super().__init__(session, fec_sizer)
+        self.base = self.first_segment # Placar indexado a partir do primeiro segmento do intervalo
+        self.state = bytearray(self.end_segment - self.base) # Placar: um estado SEG_* por segmento
+        self.snd_una = self.first_segment # Menor segmento ainda não confirmado
+        self.highest_acked = self.first_segment - 1
+        self.loss_scan = self.first_segment # Segmentos abaixo deste já foram verificados quanto a perda
+        self.inflight = 0
+        self.retransmit_queue = collections.deque()
+        self.retransmissions = 0
+        self.tx_counter = 0 # Número de envios feitos (ordem de transmissão)
+        self.tx_index = array.array('Q', [0]) * (self.end_segment - self.base) # Ordem do último envio de cada segmento
+        self.sent_at = array.array('d', [0.0]) * (self.end_segment - self.base) # Horário do último envio de cada segmento
+        self.highest_acked_tx = 0
+        self.retransmitted_inflight = collections.deque() # (tx_index, seq_num) das retransmissões em voo
+        self.window = congestion.CongestionWindow()
+        self.rtt = congestion.RttEstimator()
+        self.pacer = congestion.TokenBucket(congestion.pacing_rate(self.window, self.rtt), now=time.monotonic())
+        self.recovery_point = -1 # Só reduz a janela uma vez por janela de dados perdida
+        self.undo = None # (cwnd, ssthresh) de antes da última redução, enquanto ela pode ser espúria
+        self.undo_pending = 0 # Segmentos dados como perdidos desde a redução e ainda não confirmados
+        self.reorder_steps = 1 # Múltiplo de REORDER_WINDOW em uso (cresce a cada perda espúria)
+        self.rto_deadline = None
+        self.reorder_deadline = None # Quando a janela de reordenação do próximo candidato a perda expira
+        self.rack_seq = None # Segmento confirmado de envio mais recente (RACK)
+        self.rack_rtt = None # RTT desse segmento: acompanha a fila do caminho sem a inércia do SRTT
+        self.timeouts = 0
+        self.rtt_seq = None # Segmento sendo cronometrado para amostra de RTT
+        self.rtt_sent_at = 0.0
+        self.parity_inflight = collections.deque() # (tx_index, fim do grupo) das paridades enviadas
+        self.loss_limit = self.first_segment if fec_sizer else self.end_segment # Perdas só são detectadas abaixo deste
+
+    def finished(self):
+        return self.aborted or self.snd_una >= self.end_segment
+
+    def next_to_send(self):
+        while self.retransmit_queue:
+            seq_num = self.retransmit_queue[0]
+            if self.state[seq_num - self.base] == SEG_LOST:
+                return seq_num
+            self.retransmit_queue.popleft() # Confirmado enquanto aguardava retransmissão
+        if self.next_seq < self.end_segment:
+            return self.next_seq
+        return None
+
+    def deadline(self):
+        """Próximo horário em que a transferência precisa acordar sem ACKs (RTO ou janela de reordenação)."""
+        if self.reorder_deadline is None:
+            return self.rto_deadline
+        if self.rto_deadline is None:
+            return self.reorder_deadline
+        return min(self.rto_deadline, self.reorder_deadline)
+
+    def on_timer(self, sender, now):
+        if self.rto_deadline is not None and now >= self.rto_deadline:
+            self.on_retransmission_timeout(now)
+            if self.finished():
+                return None
+        if self.reorder_deadline is not None and now >= self.reorder_deadline:
+            self.reorder_deadline = None
+            self.detect_losses(now)
+
+        max_batch = sender.max_batch(self.session.header.size + self.cached_file.payload_size)
+        while self.inflight < int(self.window.cwnd):
+            seq_num = self.next_to_send()
+            if seq_num is None:
+                break
+            if not self.pacer.try_consume(now):
+                wake = now + self.pacer.time_until_token(now)
+                deadline = self.deadline()
+                return wake if deadline is None else min(wake, deadline)
+
+            if self.state[seq_num - self.base] == SEG_LOST:
+                self.send(sender, seq_num, retransmission=True)
+                self.record_send(seq_num, now)
+                continue
+
+            # Dados novos: os segmentos consecutivos que a janela e o pacing permitem saem juntos
+            count = min(int(self.window.cwnd) - self.inflight, self.end_segment - seq_num, max_batch)
+            count = 1 + self.pacer.consume_up_to(now, count - 1)
+            sent = self.send(sender, seq_num, count)
+            for i in range(sent):
+                self.record_send(seq_num + i, now)
+            if self.fec is not None:
+                self.send_due_parity(sender)
+            if sent < count:
+                self.pacer.tokens += count - sent # Devolve os tokens dos segmentos não enviados
+                raise BlockingIOError
+
+        # Janela cheia ou nada a enviar: aguarda ACKs (que reagendam a transferência), o RTO ou
+        # o fim da janela de reordenação
+        return self.deadline()
+
+    def record_send(self, seq_num, now):
+        """Atualiza o placar após o envio (ou reenvio) de um segmento."""
+        self.tx_counter += 1
+        self.tx_index[seq_num - self.base] = self.tx_counter
+        self.sent_at[seq_num - self.base] = now
+        if self.state[seq_num - self.base] == SEG_LOST:
+            self.undo = None # Reenviado: um ACK não distingue mais o original da retransmissão
+            self.retransmit_queue.popleft()
+            self.retransmitted_inflight.append((self.tx_counter, seq_num))
+            self.retransmissions += 1
+        else:
+            self.next_seq += 1
+            if self.rtt_seq is None:
+                self.rtt_seq = seq_num
+                self.rtt_sent_at = now
+        self.state[seq_num - self.base] = SEG_IN_FLIGHT
+        self.inflight += 1
+        if self.rto_deadline is None:
+            self.rto_deadline = now + self.rtt.rto
+
+    def send_parity(self, sender, first, count):
+        # A paridade entra na ordem de transmissão (mas não na janela), mesmo se não saiu
+        super().send_parity(sender, first, count)
+        self.tx_counter += 1
+        self.parity_inflight.append((self.tx_counter, first + count))
+
+    def mark_acked(self, seq_num):
+        state = self.state[seq_num - self.base]
+        if state == SEG_ACKED:
+            return 0
+        if state == SEG_IN_FLIGHT:
+            self.inflight -= 1
+        elif state == SEG_LOST and self.undo is not None:
+            self.undo_pending -= 1
+            if not self.undo_pending:
+                self.undo_loss()
+        self.state[seq_num - self.base] = SEG_ACKED
+        if self.tx_index[seq_num - self.base] > self.highest_acked_tx:
+            self.highest_acked_tx = self.tx_index[seq_num - self.base]
+            self.rack_seq = seq_num
+        return 1
+
+    def on_ack(self, cumulative, selective, now):
+        """Processa um ACK do cliente e atualiza janela, RTT e detecção de perdas."""
+        cumulative = min(cumulative, self.end_segment)
+        newly_acked = 0
+        for seq_num in range(self.snd_una, cumulative):
+            newly_acked += self.mark_acked(seq_num)
+        self.highest_acked = max(self.highest_acked, cumulative - 1)
+        for seq_num in selective:
+            if self.first_segment <= seq_num < self.end_segment:
+                newly_acked += self.mark_acked(seq_num)
+                self.highest_acked = max(self.highest_acked, seq_num)
+        while self.snd_una < self.end_segment and self.state[self.snd_una - self.base] == SEG_ACKED:
+            self.snd_una += 1
+
+        if self.rtt_seq is not None and self.state[self.rtt_seq - self.base] == SEG_ACKED:
+            self.rtt.sample(now - self.rtt_sent_at)
+            self.metrics.rtt.observe(now - self.rtt_sent_at)
+            self.rtt_seq = None
+
+        if self.rack_seq is not None:
+            rack_rtt = now - self.sent_at[self.rack_seq - self.base]
+            # Abaixo do menor RTT, o ACK só pode ser do envio original de um segmento retransmitido
+            if self.rtt.min_rtt is None or rack_rtt >= self.rtt.min_rtt:
+                self.rack_rtt = rack_rtt
+            self.rack_seq = None
+
+        if newly_acked:
+            self.window.on_ack(newly_acked)
+            self.timeouts = 0
+            self.rto_deadline = now + self.rtt.rto if self.inflight > 0 else None
+
+        self.detect_losses(now)
+        self.pacer.rate = congestion.pacing_rate(self.window, self.rtt)
+
+    def reorder_timeout(self):
+        """Tempo desde o envio após o qual um segmento já ultrapassado por outros é dado como perdido."""
+        rtt = self.rack_rtt if self.rack_rtt is not None else self.rtt.srtt
+        if rtt is None:
+            return 0.0 # Nenhum ACK ainda: só a contagem de DUPTHRESH
+        reorder_window = self.reorder_steps * REORDER_WINDOW * (self.rtt.min_rtt if self.rtt.min_rtt is not None else rtt)
+        if self.rtt.srtt is not None:
+            reorder_window = min(reorder_window, self.rtt.srtt)
+        return rtt + reorder_window
+
+    def undo_loss(self):
+        """Desfaz a redução da janela de uma perda espúria (os originais chegaram, só atrasados)."""
+        self.window.cwnd, self.window.ssthresh = self.undo
+        self.undo = None
+        self.recovery_point = -1
+        self.reorder_steps = min(self.reorder_steps + 1, MAX_REORDER_STEPS)
+        self.metrics.spurious_losses += 1
+        logging.debug(f"Perda espúria para {self.client_address}: cwnd restaurada para {self.window.cwnd:.1f}, janela de reordenação x{self.reorder_steps}")
+
+    def detect_losses(self, now):
+        """Marca como perdidos os segmentos com DUPTHRESH ou mais segmentos posteriores confirmados
+        e enviados há mais de reorder_timeout(); os demais candidatos armam reorder_deadline.
+
+        Com poucos segmentos em voo o limiar é reduzido (retransmissão antecipada, RFC 5827),
+        senão uma janela pequena só se recuperaria por timeout.
+        """
+        threshold = min(DUPTHRESH, max(1, self.inflight))
+        expired = now - self.reorder_timeout() # Segmentos enviados até aqui já tiveram tempo de chegar
+        self.reorder_deadline = None
+        # Retransmissões: perdidas se envios feitos depois delas já foram confirmados
+        while self.retransmitted_inflight and self.retransmitted_inflight[0][0] + threshold <= self.highest_acked_tx:
+            tx, seq_num = self.retransmitted_inflight[0]
+            if self.state[seq_num - self.base] == SEG_IN_FLIGHT and self.tx_index[seq_num - self.base] == tx:
+                if self.sent_at[seq_num - self.base] > expired:
+                    self.reorder_deadline = self.sent_at[seq_num - self.base] + self.reorder_timeout()
+                    break # A fila está na ordem de envio: as seguintes são ainda mais recentes
+                self.undo = None # Uma retransmissão perdida confirma a perda
+                self.state[seq_num - self.base] = SEG_LOST
+                self.inflight -= 1
+                self.retransmit_queue.append(seq_num)
+            self.retransmitted_inflight.popleft()
+
+        while self.parity_inflight and self.parity_inflight[0][0] + threshold <= self.highest_acked_tx:
+            self.loss_limit = self.parity_inflight.popleft()[1]
+        limit = min(self.highest_acked - threshold + 1, self.loss_limit)
+        start = max(self.snd_una, self.loss_scan)
+        if start >= limit:
+            return
+        first_lost = None
+        for seq_num in range(start, limit):
+            if self.state[seq_num - self.base] == SEG_IN_FLIGHT:
+                if self.sent_at[seq_num - self.base] > expired:
+                    # Ainda dentro da janela de reordenação; os seguintes foram enviados depois
+                    deadline = self.sent_at[seq_num - self.base] + self.reorder_timeout()
+                    self.reorder_deadline = deadline if self.reorder_deadline is None else min(self.reorder_deadline, deadline)
+                    limit = seq_num
+                    break
+                self.state[seq_num - self.base] = SEG_LOST
+                self.inflight -= 1
+                self.retransmit_queue.append(seq_num)
+                self.undo_pending += 1
+                if first_lost is None:
+                    first_lost = seq_num
+                if seq_num == self.rtt_seq:
+                    self.rtt_seq = None # Algoritmo de Karn: não cronometra segmentos retransmitidos
+        self.loss_scan = limit
+
+        if first_lost is not None and first_lost >= self.recovery_point:
+            self.undo = (self.window.cwnd, self.window.ssthresh)
+            self.undo_pending = sum(1 for seq_num in self.retransmit_queue if self.state[seq_num - self.base] == SEG_LOST)
+            self.window.on_loss()
+            self.recovery_point = self.next_seq
+            logging.debug(f"Perda detectada para {self.client_address} a partir do segmento {first_lost}; cwnd={self.window.cwnd:.1f}")
+
+    def on_retransmission_timeout(self, now):
+        self.timeouts += 1
+        self.metrics.timeouts += 1
+        if self.timeouts > MAX_TIMEOUTS:
+            logging.warning(f"Cliente {self.client_address} não confirma segmentos de {self.filename} após {MAX_TIMEOUTS} timeouts. Abortando transferência.")
+            self.aborted = True
+            return
+
+        lost = [seq_num for seq_num in range(self.snd_una, self.next_seq) if self.state[seq_num - self.base] == SEG_IN_FLIGHT]
+        for seq_num in lost:
+            self.state[seq_num - self.base] = SEG_LOST
+        # Os segmentos do timeout vão para a frente da fila, que fica ordenada do menor para o maior
+        self.retransmit_queue = collections.deque(sorted(set(self.retransmit_queue).union(lost)))
+        self.retransmitted_inflight.clear()
+        if self.fec is not None:
+            self.parity_inflight.clear()
+            self.loss_limit = self.group_start # As paridades já enviadas tiveram sua chance
+        self.inflight = 0
+        self.rtt_seq = None
+        self.window.on_timeout()
+        self.rtt.backoff()
+        self.recovery_point = self.next_seq
+        self.rto_deadline = None
+        self.reorder_deadline = None
+        self.undo = None
+        self.pacer.rate = congestion.pacing_rate(self.window, self.rtt)
+        logging.debug(f"Timeout de retransmissão para {self.client_address} ({len(lost)} segmentos em voo); rto={self.rtt.rto:.2f}s")
+
+    def summary(self):
+        return f"{self.end_segment - self.first_segment} segmentos confirmados, {self.retransmissions} retransmitidos, cwnd final {self.window.cwnd:.1f}"
+
+
+class BackgroundWork:
+    """Trabalho de CPU (compressão de arquivos, manifestos de blocos) feito em threads, fora do loop de eventos.
+
+    zlib, lzma e zstd liberam o GIL enquanto comprimem, assim como o BLAKE2b a cada bloco do
+    manifesto, então o loop continua atendendo as transferências. Cada trabalho é identificado
+    por uma chave e feito uma só vez, mesmo que vários pedidos esperem por ele; ao terminar, a thread acorda o loop por um socketpair
+    registrado no seletor, e as continuações dos pedidos rodam no próprio loop (run_callbacks).
+    """
+
+    def __init__(self, selector, threads=BACKGROUND_THREADS):
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.wakeup_receiver, self.wakeup_sender = socket.socketpair()
+        self.wakeup_receiver.setblocking(False)
+        self.wakeup_sender.setblocking(False)
+        selector.register(self.wakeup_receiver, selectors.EVENT_READ, self)
+        self.pending = {} # chave -> (Future, continuações)
+        self.done = collections.deque() # Chaves concluídas; deque é seguro entre threads
+
+    def submit(self, key, function, callback):
+        """Executa function() em uma thread (uma vez por chave) e depois callback(resultado, erro) no loop."""
+        entry = self.pending.get(key)
+        if entry is None:
+            entry = self.pending[key] = (self.executor.submit(function), [])
+            entry[0].add_done_callback(lambda future: self._finished(key))
+        entry[1].append(callback)
+
+    def _finished(self, key):
+        self.done.append(key)
+        try:
+            self.wakeup_sender.send(b'\0')
+        except BlockingIOError:
+            pass # O loop já tem um despertar pendente
+
+    def run_callbacks(self):
+        try:
+            while self.wakeup_receiver.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        while self.done:
+            future, callbacks = self.pending.pop(self.done.popleft())
+            error = future.exception()
+            result = future.result() if error is None else None
+            for callback in callbacks:
                 try:
-                    if not os.path.exists(filename_req):
-                        raise FileNotFoundError("Arquivo não encontrado no servidor.")
-
-                    file_size = os.path.getsize(filename_req)
-                    if file_size == 0:
-                         logging.warning(f"Arquivo {filename_req} está vazio. Enviando um único segmento vazio.")
-                         send_segment(udp_socket, client_address, 0, b'', is_last=True)
-                         continue # Fim para este arquivo vazio
-
-                    logging.info(f"Iniciando transmissão de {filename_req} ({file_size} bytes) para {client_address}")
-                    seq_num = 0
-                    with open(filename_req, 'rb') as f:
-                        while True:
-                            data = f.read(DATA_PAYLOAD_SIZE)
-                            if not data:
-                                break 
-
-                            is_last_segment = (f.tell() == file_size)
-                            send_segment(udp_socket, client_address, seq_num, data, is_last_segment)
-                            seq_num += 1
-                            time.sleep(0.001) # pausa (1 milissegundo) opcionalmente adicionada para evitar sobrecarregar redes mais lentas ou sistemas com processamento limitado, dando tempo para o processamento e evitando potencial perda de pacotes devido à velocidade excessiva de envio.
-
-                    logging.info(f"Transmissão de {filename_req} para {client_address} concluída (enviados {seq_num} segmentos).")
-
-                except FileNotFoundError:
-                    error_msg = "ERROR 404 File Not Found\n".encode('utf-8')
-                    udp_socket.sendto(error_msg, client_address)
-                    logging.error(f"Arquivo {filename_req} não encontrado. Enviado erro para {client_address}")
-                    if client_address in active_transfers:
-                        del active_transfers[client_address] # Limpa estado
-                except IOError as e:
-                     error_msg = f"ERROR 500 Server IO Error: {e}\n".encode('utf-8')
-                     udp_socket.sendto(error_msg, client_address)
-                     logging.error(f"Erro de I/O ao ler {filename_req}: {e}")
-                     if client_address in active_transfers:
-                        del active_transfers[client_address] # Limpa estado
+                    callback(result, error)
                 except Exception as e:
-                    error_msg = f"ERROR 500 Internal Server Error\n".encode('utf-8')
-                    udp_socket.sendto(error_msg, client_address)
-                    logging.error(f"Erro inesperado durante transmissão para {client_address}: {e}")
-                    if client_address in active_transfers:
-                        del active_transfers[client_address] # Limpa estado
-
-
-            elif message_str.startswith('RETRANS '):
-                 if client_address not in active_transfers:
-                     logging.warning(f"Recebido RETRANS de {client_address}, mas não há transferência ativa registrada.")
-                     continue # Ignora se não sabemos qual arquivo
-
-                 current_filename = active_transfers[client_address]
-                 try:
-                     seq_num_to_resend = int(message_str.split()[1])
-                     logging.info(f"Cliente {client_address} solicitou retransmissão do segmento {seq_num_to_resend} para o arquivo {current_filename}")
-                     handle_retransmission(udp_socket, client_address, current_filename, seq_num_to_resend)
-                 except (ValueError, IndexError):
-                     logging.warning(f"Formato inválido de RETRANS recebido de {client_address}: {message_str}")
-                 except Exception as e:
-                     logging.error(f"Erro ao processar RETRANS de {client_address}: {e}")
+                    logging.error(f"Erro ao continuar um pedido após trabalho em segundo plano: {e}", exc_info=True)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.wakeup_receiver.close()
+        self.wakeup_sender.close()
+
+
+class UDPFileServer:
+    """Servidor orientado a eventos que intercala várias transferências em um único socket.
+
+    Cada GET abre uma sessão (veja sessions.py) e vira uma Transfer agendada em um heap pelo
+    horário do próximo envio. O loop principal só bloqueia no select até o próximo envio
+    devido, então pedidos GET e RETRANS de outros clientes são atendidos enquanto as
+    transferências estão em andamento.
+
+    Cada sessão tem um TransferMetrics; a cada metrics.REPORT_INTERVAL o loop expira as
+    sessões inativas, registra uma linha de resumo e, com metrics_file, grava os totais
+    (Prometheus se o nome terminar em .prom, JSON caso contrário).
+
+    A compressão de um arquivo é feita em BackgroundWork; os pedidos que dependem dela são
+    repetidos quando a imagem fica pronta.
+    """
+
+    def __init__(self, sock, cache_bytes=DEFAULT_CACHE_BYTES, cache_files=DEFAULT_CACHE_FILES, metrics_file=None,
+                 max_sessions=sessions.DEFAULT_MAX_SESSIONS, idle_timeout=sessions.DEFAULT_IDLE_TIMEOUT):
+        self.sock = sock
+        self.cache = filecache.FileCache(DATA_PAYLOAD_SIZE, cache_bytes, cache_files)
+        self.sender = sendpath.SegmentSender(sock)
+        if self.sender.gso:
+            logging.info("UDP GSO disponível: segmentos consecutivos serão enviados em lote.")
+        self.sock.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ)
+        self.background = BackgroundWork(self.selector)
+        self.sessions = sessions.SessionTable(max_sessions, idle_timeout)
+        self.schedule = [] # heap de (next_send_time, contador, Transfer)
+        self.schedule_counter = itertools.count()
+        self.metrics = metrics.ServerMetrics()
+        self.reporter = metrics.Reporter()
+        self.metrics_file = metrics_file
+
+    def serve_forever(self):
+        logging.info("Aguardando requisições...")
+        while True:
+            try:
+                for key, _ in self.selector.select(self.select_timeout()):
+                    if key.data is self.background:
+                        self.background.run_callbacks()
+                    else:
+                        self.drain_socket()
+                self.service_transfers()
+                now = time.monotonic()
+                if self.reporter.due(now):
+                    self.expire_sessions(now)
+                    self.report(now)
+            except Exception as e:
+                logging.error(f"Erro fatal no loop principal do servidor: {e}", exc_info=True)
+
+    def report(self, now):
+        """Linha de resumo periódica (só quando houve envios) e gravação do arquivo de métricas."""
+        sending = sum(1 for session in self.sessions if session.transfer is not None)
+        line = self.metrics.report_line([session.metrics for session in self.sessions], sending, now)
+        if line is not None:
+            logging.info(f"Resumo: {line}; {len(self.sessions)} sessões abertas")
+        if self.metrics_file:
+            self.write_metrics_file()
 
+    def session_metrics(self):
+        return {session.label(): session.metrics for session in self.sessions}
+
+    def write_metrics_file(self):
+        if self.metrics_file.endswith('.prom'):
+            content = self.metrics.prometheus(self.session_metrics(), self.flat_stats())
+        else:
+            content = json.dumps(self.metrics.snapshot(self.session_metrics(), self.extra_stats()), indent=2)
+        temp_filename = self.metrics_file + '.tmp'
+        try:
+            with open(temp_filename, 'w') as f:
+                f.write(content)
+            os.replace(temp_filename, self.metrics_file) # Leitores nunca veem um arquivo pela metade
+        except OSError as e:
+            logging.error(f"Erro ao gravar métricas em {self.metrics_file}: {e}")
+
+    def extra_stats(self):
+        return {'cache': self.cache.stats(), 'sender': self.sender.stats(), 'sessions': self.sessions.stats()}
+
+    def flat_stats(self):
+        return {f"{group}_{name}": int(value) for group, stats in self.extra_stats().items() for name, value in stats.items()}
+
+    def select_timeout(self):
+        """Tempo até o próximo envio devido ou a próxima linha de resumo, o que vier primeiro."""
+        while self.schedule and (self.schedule[0][2].cancelled or self.schedule[0][1] != self.schedule[0][2].schedule_id):
+            heapq.heappop(self.schedule)
+        wake = self.reporter.next_report
+        if self.schedule:
+            wake = min(wake, self.schedule[0][0])
+        return max(0.0, wake - time.monotonic())
+
+    def drain_socket(self):
+        """Processa os datagramas pendentes no socket, limitado para não atrasar os envios."""
+        for _ in range(MAX_MESSAGES_PER_TICK):
+            try:
+                message, client_address = self.sock.recvfrom(BUFFER_SIZE)
+            except (BlockingIOError, InterruptedError):
+                return
+            except ConnectionError as e:
+                # ICMP port unreachable de um cliente que já foi embora
+                logging.debug(f"Erro de conexão ao receber: {e}")
+                continue
+            self.handle_message(message, client_address)
+
+    def handle_message(self, message, client_address):
+        if message.startswith(protocol.NACK_MAGIC):
+            self.metrics.count_message('NACK')
+            self.handle_nack(message, client_address)
+            return
+
+        message_str = message.decode('utf-8', errors='ignore').strip()
+        if TRACER.enabled and TRACER.sample():
+            TRACER.debug(f"Recebido de {client_address}: {message_str[:100]}") # Log truncado
+
+        if message_str.startswith(protocol.ACK_PREFIX):
+            self.metrics.count_message('ACK')
+            self.handle_ack(message_str, client_address)
+        elif message_str.startswith('GET /'):
+            self.metrics.count_message('GET')
+            self.handle_get(message_str[5:], client_address)
+        elif message_str.startswith('HEAD /'):
+            self.metrics.count_message('HEAD')
+            self.handle_head(message_str[6:], client_address)
+        elif message.startswith(protocol.MANIFEST_PREFIX):
+            self.metrics.count_message('MANIFEST')
+            self.handle_manifest(message_str[len(protocol.MANIFEST_PREFIX):], client_address)
+        elif message.startswith(protocol.PROBE_PREFIX):
+            self.metrics.count_message('PROBE')
+            self.handle_probe(message_str, client_address)
+        elif message_str.startswith('RETRANS '):
+            self.metrics.count_message('RETRANS')
+            self.handle_retrans(message_str, client_address)
+        elif message.startswith(metrics.STATS_PREFIX):
+            self.metrics.count_message('STATS')
+            self.handle_stats(message_str, client_address)
+        else:
+            self.metrics.count_message('unknown')
+            logging.warning(f"Mensagem desconhecida recebida de {client_address}: {message_str[:100]}")
+
+    def handle_get(self, request_str, client_address):
+        filename_req, options = protocol.parse_get_request(request_str)
+        logging.info(f"Cliente {client_address} requisitou o arquivo: {filename_req}")
+
+        legacy = options.get(protocol.OPTION_SESSION) != 'yes'
+        if legacy:
+            # Sem sessão, um novo GET do mesmo cliente substitui a transferência anterior
+            previous = self.sessions.find(client_address)
+            if previous is not None and previous.legacy:
+                self.close_session(previous)
+        try:
+            algorithm = checksum.get_algorithm(options.get(protocol.OPTION_CHECKSUM, checksum.DEFAULT_ALGORITHM))
+            payload_size = protocol.parse_payload_size(options.get(protocol.OPTION_PAYLOAD, DATA_PAYLOAD_SIZE))
+            codec = compression.get_codec(options[protocol.OPTION_COMPRESSION]) if protocol.OPTION_COMPRESSION in options else None
+            fec_option = fec.parse_group_option(options[protocol.OPTION_FEC]) if protocol.OPTION_FEC in options else None
+        except ValueError as e:
+            self.send_error(client_address, f"ERROR 400 {e}\n")
+            logging.error(f"Requisição de {client_address} recusada: {e}")
+            return
+        flow = options.get(protocol.OPTION_FLOW, protocol.FLOW_FIXED)
+        if flow not in (protocol.FLOW_WINDOW, protocol.FLOW_FIXED):
+            self.send_error(client_address, f"ERROR 400 Unsupported Flow: {flow}\n")
+            logging.error(f"Modo de fluxo {flow} não suportado, requisitado por {client_address}")
+            return
+
+        session = None
+        try:
+            cached_file = self.cache.get(filename_req, payload_size, codec) # FileNotFoundError se não existir
+            if cached_file is None:
+                self.prepare_image(filename_req, payload_size, codec, client_address, lambda: self.handle_get(request_str, client_address))
+                return
+
+            if protocol.OPTION_VERSION in options and options[protocol.OPTION_VERSION] != cached_file.version:
+                # Retomada de uma cópia parcial (ou delta) de outra versão do arquivo
+                self.send_error(client_address, "ERROR 412 Precondition Failed: File Changed\n")
+                logging.warning(f"Cliente {client_address} pediu a versão {options[protocol.OPTION_VERSION]} de {filename_req}, que mudou ({cached_file.version})")
+                return
+
+            segment_range = None
+            if protocol.OPTION_RANGE in options:
+                try:
+                    segment_range = protocol.parse_range(options[protocol.OPTION_RANGE], cached_file.total_segments)
+                except ValueError as e:
+                    self.send_error(client_address, f"ERROR 416 Range Not Satisfiable: {e}\n")
+                    logging.error(f"Requisição de {client_address} recusada: {e}")
+                    return
+
+            # Abre a sessão com o arquivo (e o intervalo) que este cliente está tentando baixar
+            now = time.monotonic()
+            if self.sessions.full():
+                self.expire_sessions(now)
+            session = self.sessions.open(client_address, legacy, cached_file, algorithm, segment_range, metrics.TransferMetrics(filename_req), now)
+            if session is None:
+                self.send_error(client_address, "ERROR 503 Too Many Sessions\n")
+                logging.warning(f"Requisição de {client_address} recusada: {len(self.sessions)} sessões abertas (limite)")
+                return
+            self.metrics.transfers_started += 1
+
+            file_size = cached_file.size
+            if file_size == 0:
+                logging.warning(f"Arquivo {filename_req} está vazio. Enviando um único segmento vazio.")
+
+            accepted = {protocol.OPTION_CHECKSUM: algorithm.name, protocol.OPTION_SIZE: file_size, protocol.OPTION_PAYLOAD: payload_size,
+                        protocol.OPTION_VERSION: cached_file.version}
+            if not legacy:
+                accepted[protocol.OPTION_SESSION] = session.session_id
+            if codec is not None:
+                accepted[protocol.OPTION_COMPRESSION] = codec.name
+                accepted[protocol.OPTION_ORIGINAL_SIZE] = cached_file.original_size
+            if segment_range is not None:
+                accepted[protocol.OPTION_RANGE] = protocol.format_range(segment_range[0], segment_range[1] - 1)
+
+            if options.get(protocol.OPTION_RESUME) == 'yes':
+                # O cliente já tem parte do arquivo e vai pedir o restante por NACK
+                accepted[protocol.OPTION_RESUME] = 'yes'
+                self.sock.sendto(protocol.build_ok_response(accepted), client_address)
+                logging.info(f"Cliente {client_address} retomando o download de {filename_req} ({file_size} bytes, sessão {session.label()})")
+                return
+
+            fec_sizer = None
+            if fec_option is not None:
+                fec_sizer = fec.GroupSizer(*fec_option)
+                accepted[protocol.OPTION_FEC] = fec.AUTO if fec_sizer.adaptive else fec_sizer.group_size
+            if flow == protocol.FLOW_WINDOW:
+                transfer = WindowedTransfer(session, fec_sizer)
             else:
-                 logging.warning(f"Mensagem desconhecida recebida de {client_address}: {message_str[:100]}")
+                transfer = Transfer(session, fec_sizer)
+
+            if options:
+                accepted[protocol.OPTION_FLOW] = flow
+                self.sock.sendto(protocol.build_ok_response(accepted), client_address)
+            logging.info(f"Iniciando transmissão de {filename_req} ({file_size} bytes, fluxo {flow}, checksum {algorithm.name}, segmentos de {payload_size} bytes"
+                         f"{f', compressão {codec.name}' if codec is not None else ''}"
+                         f"{f', FEC {accepted[protocol.OPTION_FEC]}' if fec_sizer is not None else ''}) para {client_address}"
+                         f"{f', sessão {session.session_id:08x}' if not legacy else ''}")
+            session.transfer = transfer
+            self.reschedule(transfer, now)
+
+        except FileNotFoundError:
+            self.send_error(client_address, "ERROR 404 File Not Found\n", session)
+            logging.error(f"Arquivo {filename_req} não encontrado. Enviado erro para {client_address}")
+        except IOError as e:
+            self.send_error(client_address, f"ERROR 500 Server IO Error: {e}\n", session)
+            logging.error(f"Erro de I/O ao ler {filename_req}: {e}")
         except Exception as e:
-            logging.error(f"Erro fatal no loop principal do servidor: {e}", exc_info=True)
+            self.send_error(client_address, "ERROR 500 Internal Server Error\n", session)
+            logging.error(f"Erro inesperado durante transmissão para {client_address}: {e}")
+
+    def handle_head(self, request_str, client_address):
+        """Responde só com o tamanho do arquivo, usado pelo cliente para dividir o download em intervalos."""
+        filename_req, options = protocol.parse_get_request(request_str)
+        try:
+            payload_size = protocol.parse_payload_size(options.get(protocol.OPTION_PAYLOAD, DATA_PAYLOAD_SIZE))
+            codec = compression.get_codec(options[protocol.OPTION_COMPRESSION]) if protocol.OPTION_COMPRESSION in options else None
+            cached_file = self.cache.get(filename_req, payload_size, codec)
+            if cached_file is None:
+                self.prepare_image(filename_req, payload_size, codec, client_address, lambda: self.handle_head(request_str, client_address))
+                return
+        except ValueError as e:
+            self.send_error(client_address, f"ERROR 400 {e}\n")
+            return
+        except FileNotFoundError:
+            self.send_error(client_address, "ERROR 404 File Not Found\n")
+            logging.error(f"Arquivo {filename_req} não encontrado. Enviado erro para {client_address}")
+            return
+        except OSError as e:
+            self.send_error(client_address, f"ERROR 500 Server IO Error: {e}\n")
+            logging.error(f"Erro de I/O ao abrir {filename_req}: {e}")
+            return
+        accepted = {protocol.OPTION_SIZE: cached_file.size, protocol.OPTION_SEGMENTS: cached_file.total_segments, protocol.OPTION_PAYLOAD: payload_size}
+        if codec is not None:
+            accepted[protocol.OPTION_COMPRESSION] = codec.name
+            accepted[protocol.OPTION_ORIGINAL_SIZE] = cached_file.original_size
+        response = protocol.build_ok_response(accepted)
+        try:
+            self.sock.sendto(response, client_address)
+        except socket.error as e:
+            logging.error(f"Erro ao responder HEAD para {client_address}: {e}")
+
+    def prepare_image(self, filename, payload_size, codec, client_address, retry):
+        """Comprime o arquivo em segundo plano e chama retry() (o pedido de novo) quando a imagem estiver pronta."""
+        source = self.cache.get(filename, payload_size)
+
+        def done(data, error):
+            if error is not None:
+                self.send_error(client_address, f"ERROR 500 Compression Failed: {error}\n")
+                logging.error(f"Erro ao comprimir {filename} com {codec.name}: {error}")
+                return
+            self.cache.add_image(source, codec, data)
+            retry()
+
+        self.background.submit(('compress', filename, source.version, codec.name), lambda: source.compress(codec), done)
+
+    def prepare_manifest(self, cached_file, block_segments, client_address, retry):
+        """Calcula o manifesto em segundo plano e chama retry() (o pedido de novo) quando estiver pronto."""
+
+        def done(digests, error):
+            if error is not None:
+                self.send_error(client_address, f"ERROR 500 Manifest Failed: {error}\n")
+                logging.error(f"Erro ao calcular o manifesto de {cached_file.filename}: {error}")
+                return
+            cached_file.add_manifest(block_segments, digests)
+            retry()
+
+        key = ('manifest', cached_file.filename, cached_file.version, block_segments * cached_file.payload_size)
+        self.background.submit(key, lambda: cached_file.compute_manifest(block_segments), done)
 
-    udp_socket.close()
-    logging.info("Servidor encerrado.")
+    def handle_manifest(self, request_str, client_address):
+        """Responde com o tamanho e a versão do arquivo e as páginas pedidas do manifesto de blocos."""
+        filename_req, options = protocol.parse_get_request(request_str)
+        try:
+            payload_size = protocol.parse_payload_size(options.get(protocol.OPTION_PAYLOAD, DATA_PAYLOAD_SIZE))
+            block_segments = protocol.parse_block_segments(options.get(protocol.OPTION_BLOCK, protocol.DEFAULT_BLOCK_SEGMENTS))
+            cached_file = self.cache.get(filename_req, payload_size)
+        except ValueError as e:
+            self.send_error(client_address, f"ERROR 400 {e}\n")
+            return
+        except FileNotFoundError:
+            self.send_error(client_address, "ERROR 404 File Not Found\n")
+            logging.error(f"Arquivo {filename_req} não encontrado. Enviado erro para {client_address}")
+            return
+        except OSError as e:
+            self.send_error(client_address, f"ERROR 500 Server IO Error: {e}\n")
+            logging.error(f"Erro de I/O ao abrir {filename_req}: {e}")
+            return
+
+        digests = cached_file.manifest(block_segments)
+        if digests is None:
+            self.prepare_manifest(cached_file, block_segments, client_address, lambda: self.handle_manifest(request_str, client_address))
+            return
+        blocks = len(digests) // protocol.MANIFEST_DIGEST_SIZE
+        pages = protocol.manifest_pages(blocks)
+        try:
+            first, end = protocol.parse_range(options[protocol.OPTION_PAGES], pages) if protocol.OPTION_PAGES in options else (0, pages)
+        except ValueError as e:
+            self.send_error(client_address, f"ERROR 416 Range Not Satisfiable: {e}\n")
+            return
+        end = min(end, first + protocol.MAX_MANIFEST_PAGES)
+
+        accepted = {protocol.OPTION_SIZE: cached_file.size, protocol.OPTION_PAYLOAD: payload_size, protocol.OPTION_VERSION: cached_file.version,
+                    protocol.OPTION_BLOCK: block_segments, protocol.OPTION_BLOCKS: blocks, protocol.OPTION_PAGES: pages}
+        try:
+            self.sock.sendto(protocol.build_ok_response(accepted), client_address)
+            for page in range(first, end):
+                self.sock.sendto(protocol.build_manifest_page(page, digests), client_address)
+        except socket.error as e:
+            logging.error(f"Erro ao enviar o manifesto de {filename_req} para {client_address}: {e}")
+            return
+        if TRACER.enabled and TRACER.sample():
+            TRACER.debug(f"Enviadas as páginas {first} a {end - 1} do manifesto de {filename_req} para {client_address}")
+
+    def handle_probe(self, message_str, client_address):
+        """Responde a uma sondagem de MTU com um datagrama de cada tamanho pedido, sem fragmentação.
+
+        Com a flag DF ligada, uma sonda maior que a MTU da interface falha já no envio
+        (EMSGSIZE) e uma maior que a MTU de algum trecho do caminho é descartada no roteador;
+        o cliente escolhe o maior tamanho que recebeu.
+        """
+        sizes = protocol.parse_probe_request(message_str)
+        previous = sendpath.set_dont_fragment(self.sock, sendpath.IP_PMTUDISC_DO)
+        try:
+            for payload_size in sizes:
+                try:
+                    self.sock.sendto(protocol.build_probe_reply(payload_size), client_address)
+                except OSError as e:
+                    logging.debug(f"Sonda de {payload_size} bytes para {client_address} não enviada: {e}")
+        finally:
+            if previous is not None:
+                sendpath.set_dont_fragment(self.sock, previous)
+
+    def lookup_session(self, session_id, client_address, now):
+        """Sessão de uma mensagem de controle: pelo ID, se houver, senão pelo endereço (cliente original)."""
+        if session_id is None:
+            session = self.sessions.find(client_address)
+        else:
+            session = self.sessions.get(session_id)
+            if session is not None and session.client_address != client_address:
+                logging.info(f"Sessão {session.label()} passou a usar o endereço {client_address}")
+                self.sessions.migrate(session, client_address)
+        if session is not None:
+            self.sessions.touch(session, now)
+        return session
+
+    def handle_retrans(self, message_str, client_address):
+        session = self.lookup_session(None, client_address, time.monotonic())
+        if session is None:
+            logging.warning(f"Recebido RETRANS de {client_address}, mas não há transferência ativa registrada.")
+            return # Ignora se não sabemos qual arquivo
+
+        try:
+            seq_num_to_resend = int(message_str.split()[1])
+            session.metrics.nacks += 1
+            handle_retransmission(self.sender, session, seq_num_to_resend)
+        except (ValueError, IndexError):
+            logging.warning(f"Formato inválido de RETRANS recebido de {client_address}: {message_str}")
+        except Exception as e:
+            logging.error(f"Erro ao processar RETRANS de {client_address}: {e}")
+
+    def handle_nack(self, message, client_address):
+        try:
+            session_id, ranges = protocol.parse_nack(message)
+        except ValueError as e:
+            logging.warning(f"NACK inválido recebido de {client_address}: {e}")
+            return
+        session = self.lookup_session(session_id, client_address, time.monotonic())
+        if session is None:
+            logging.warning(f"Recebido NACK de {client_address}, mas não há transferência ativa registrada.")
+            return
+        if not ranges:
+            return
+
+        session.metrics.nacks += 1
+        if TRACER.enabled and TRACER.sample():
+            TRACER.debug(f"Cliente {client_address} solicitou retransmissão de {len(ranges)} intervalos do arquivo {session.cached_file.filename}")
+        job = session.resend
+        if job is not None:
+            job.add(ranges) # Já agendado: os segmentos novos entram na fila dele
+            return
+        job = ResendJob(session, ranges)
+        if job.finished():
+            job.close()
+            return
+        session.resend = job
+        self.reschedule(job, time.monotonic())
+
+    def handle_ack(self, message_str, client_address):
+        try:
+            session_id, cumulative, selective = protocol.parse_ack(message_str)
+        except ValueError:
+            logging.warning(f"Formato inválido de ACK recebido de {client_address}: {message_str[:100]}")
+            return
+        now = time.monotonic()
+        session = self.lookup_session(session_id, client_address, now)
+        transfer = session.transfer if session is not None else None
+        if not isinstance(transfer, WindowedTransfer):
+            return # ACK atrasado de uma transferência já concluída
+        transfer.metrics.acks += 1
+        transfer.on_ack(cumulative, selective, now)
+        if transfer.finished():
+            self.finish_transfer(transfer)
+        else:
+            self.reschedule(transfer, now) # A janela pode ter aberto espaço para novos envios
+
+    def handle_stats(self, message_str, client_address):
+        """Responde com as métricas do servidor; só para clientes locais, pois expõe nomes de arquivos e endereços."""
+        if not ipaddress.ip_address(client_address[0]).is_loopback:
+            logging.warning(f"Pedido STATS de {client_address} ignorado: só é aceito a partir de loopback.")
+            return
+        if metrics.parse_stats_request(message_str) == metrics.FORMAT_PROMETHEUS:
+            reply = self.metrics.prometheus(self.session_metrics(), self.flat_stats()).encode('utf-8')
+        else:
+            snapshot = self.metrics.snapshot(self.session_metrics(), self.extra_stats())
+            reply = json.dumps(snapshot).encode('utf-8')
+            if len(reply) > MAX_STATS_REPLY:
+                snapshot['active'] = {} # Muitos clientes: só os totais cabem em um datagrama
+                reply = json.dumps(snapshot).encode('utf-8')
+        try:
+            self.sock.sendto(reply[:MAX_STATS_REPLY], client_address)
+        except socket.error as e:
+            logging.error(f"Erro ao responder STATS para {client_address}: {e}")
+
+    def close_session(self, session):
+        """Encerra a sessão, somando suas métricas aos totais do servidor."""
+        self.cancel_transfer(session)
+        self.sessions.remove(session)
+        self.metrics.retire(session.metrics)
+        session.close()
+
+    def expire_sessions(self, now):
+        expired = self.sessions.expire(now)
+        for session in expired:
+            logging.debug(f"Sessão {session.label()} ({session.cached_file.filename}) expirada por inatividade")
+            self.metrics.retire(session.metrics)
+            session.close()
+        if expired:
+            logging.info(f"{len(expired)} sessões expiradas por inatividade; {len(self.sessions)} abertas")
+
+    def send_error(self, client_address, error_msg, session=None):
+        if session is not None:
+            self.close_session(session) # Limpa estado
+        try:
+            self.sock.sendto(error_msg.encode('utf-8'), client_address)
+        except socket.error as e:
+            logging.error(f"Erro ao enviar mensagem de erro para {client_address}: {e}")
+
+    def reschedule(self, transfer, when):
+        transfer.schedule_id = next(self.schedule_counter)
+        heapq.heappush(self.schedule, (when, transfer.schedule_id, transfer))
+
+    def cancel_transfer(self, session):
+        for transfer in (session.transfer, session.resend):
+            if transfer is not None:
+                transfer.cancelled = True
+                transfer.close()
+        session.transfer = None
+        session.resend = None
+
+    def finish_transfer(self, transfer):
+        if isinstance(transfer, ResendJob):
+            logging.debug(f"Reenvio de {transfer.filename} para {transfer.client_address} concluído ({transfer.summary()}).")
+        else:
+            if transfer.aborted:
+                self.metrics.transfers_aborted += 1
+            else:
+                self.metrics.transfers_completed += 1
+            logging.info(f"Transmissão de {transfer.filename} para {transfer.client_address} concluída ({transfer.summary()}; {transfer.metrics.summary()}).")
+            logging.debug(f"Cache de arquivos: {self.cache.stats()}")
+        if transfer.session.transfer is transfer:
+            transfer.session.transfer = None
+        elif transfer.session.resend is transfer:
+            transfer.session.resend = None
+        transfer.cancelled = True # Invalida entradas restantes no heap
+        transfer.close()
+
+    def service_transfers(self):
+        """Atende as transferências cujo horário de envio já chegou.
+
+        O heap é ordenado pelo horário do próximo envio, então transferências com o mesmo
+        ritmo se alternam em round-robin e nenhuma monopoliza o socket.
+        """
+        now = time.monotonic()
+        while self.schedule and self.schedule[0][0] <= now:
+            _, schedule_id, transfer = heapq.heappop(self.schedule)
+            if transfer.cancelled or schedule_id != transfer.schedule_id:
+                continue # Entrada obsoleta (transferência encerrada ou reagendada)
+
+            try:
+                next_time = transfer.on_timer(self.sender, now)
+            except BlockingIOError:
+                # Buffer de envio cheio: tenta novamente no próximo ciclo
+                self.reschedule(transfer, now + SEGMENT_INTERVAL)
+                return
+
+            if transfer.finished():
+                self.finish_transfer(transfer)
+            elif next_time is not None:
+                self.reschedule(transfer, next_time)
+
+
+def create_server_socket(host, port, reuse_port=False):
+    """Cria o socket UDP do servidor; com reuse_port vários processos podem compartilhar a porta."""
+    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if reuse_port:
+        udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    udp_socket.bind((host, port))
+    return udp_socket
+
+
+def start_server(host='0.0.0.0', port=9999, reuse_port=False, cache_bytes=DEFAULT_CACHE_BYTES, cache_files=DEFAULT_CACHE_FILES, metrics_file=None, trace_every=0,
+                 max_sessions=sessions.DEFAULT_MAX_SESSIONS, idle_timeout=sessions.DEFAULT_IDLE_TIMEOUT):
+    """Inicializa e executa o servidor UDP."""
+    try:
+        udp_socket = create_server_socket(host, port, reuse_port)
+        logging.info(f"Servidor UDP escutando em {host}:{port}")
+    except socket.error as e:
+        logging.error(f"Falha ao fazer bind na porta {port}: {e}")
+        return
+
+    TRACER.configure(trace_every)
+    server = UDPFileServer(udp_socket, cache_bytes, cache_files, metrics_file, max_sessions, idle_timeout)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logging.info(f"Estatísticas do cache de arquivos: {server.cache.stats()}")
+        logging.info(f"Estatísticas de envio: {server.sender.stats()}")
+        logging.info(f"Totais das transferências: {server.metrics.totals([session.metrics for session in server.sessions]).summary()}")
+        if server.metrics_file:
+            server.write_metrics_file()
+        server.background.close()
+        udp_socket.close()
+        logging.info("Servidor encerrado.")
+
+
+def start_workers(host='0.0.0.0', port=9999, workers=1, cache_bytes=DEFAULT_CACHE_BYTES, cache_files=DEFAULT_CACHE_FILES, metrics_file=None, trace_every=0,
+                  max_sessions=sessions.DEFAULT_MAX_SESSIONS, idle_timeout=sessions.DEFAULT_IDLE_TIMEOUT):
+    """Executa vários processos servidores na mesma porta usando SO_REUSEPORT.
+
+    O kernel distribui os datagramas entre os sockets pelo hash do endereço de origem, então
+    todos os pedidos (GET e RETRANS) de um mesmo cliente chegam sempre ao mesmo processo.
+    Cada processo grava o próprio arquivo de métricas (com o índice do processo no nome), e
+    um pedido STATS é respondido pelo processo que o kernel escolher para o endereço de origem.
+    """
+    if workers <= 1:
+        start_server(host, port, False, cache_bytes, cache_files, metrics_file, trace_every, max_sessions, idle_timeout)
+        return
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        logging.error("SO_REUSEPORT não suportado nesta plataforma; use --workers 1.")
+        return
+
+    processes = []
+    for index in range(workers):
+        worker_metrics_file = None
+        if metrics_file:
+            base, ext = os.path.splitext(metrics_file)
+            worker_metrics_file = f"{base}.{index}{ext}"
+        process = multiprocessing.Process(target=start_server, args=(host, port, True, cache_bytes, cache_files, worker_metrics_file, trace_every,
+                                                                          max_sessions, idle_timeout))
+        process.start()
+        processes.append(process)
+    logging.info(f"{workers} processos servidores iniciados em {host}:{port}")
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
 
 
 if __name__ == "__main__":
-    start_server(port=9999)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Servidor UDP para transferência confiável de arquivos.")
+    parser.add_argument("--host", type=str, default="0.0.0.0", help="Endereço local para escutar (padrão: 0.0.0.0)")
+    parser.add_argument("-p", "--port", type=int, default=9999, help="Porta UDP para escutar (padrão: 9999)")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="Número de processos servidores compartilhando a porta via SO_REUSEPORT (padrão: 1)")
+    parser.add_argument("--cache-mb", type=int, default=DEFAULT_CACHE_BYTES // (1024 * 1024), help="Limite (MB) de arquivos mapeados no cache, por processo (padrão: 256)")
+    parser.add_argument("--cache-files", type=int, default=DEFAULT_CACHE_FILES, help="Número máximo de arquivos no cache, por processo (padrão: 64)")
+    parser.add_argument("--max-sessions", type=int, default=sessions.DEFAULT_MAX_SESSIONS, help=f"Máximo de sessões abertas por processo; acima disso novos GETs são recusados (padrão: {sessions.DEFAULT_MAX_SESSIONS})")
+    parser.add_argument("--idle-timeout", type=float, default=sessions.DEFAULT_IDLE_TIMEOUT, help=f"Segundos sem mensagens do cliente até a sessão expirar (padrão: {sessions.DEFAULT_IDLE_TIMEOUT:g})")
+    parser.add_argument("--metrics-file", type=str, default=None, help="Grava as métricas periodicamente neste arquivo (formato Prometheus se terminar em .prom, JSON caso contrário)")
+    parser.add_argument("--trace", type=int, default=0, metavar="N", help="Registra em nível DEBUG um a cada N eventos de pacote (padrão: 0, desligado)")
+
+    args = parser.parse_args()
+    start_workers(args.host, args.port, args.workers, args.cache_mb * 1024 * 1024, args.cache_files, args.metrics_file, args.trace,
+                  args.max_sessions, args.idle_timeout)
@@ -0,0 +1,129 @@
+"""Tabela de sessões do servidor: o estado de cada transferência, com limite e expiração.
+
+Cada GET abre uma sessão. Um cliente que pede a opção session recebe o ID dela no OK e o
+repete nos ACKs e NACKs; os demais (cliente original) são identificados pelo endereço, e um
+novo GET do mesmo endereço substitui a sessão anterior. As sessões ficam em um OrderedDict
+em ordem de atividade, então buscar, atualizar e expirar custam O(1) por sessão, e cada
+sessão é um objeto com __slots__.
+
+Uma sessão expira depois de idle_timeout segundos sem mensagens do cliente (enquanto o
+servidor ainda está enviando o arquivo ela é mantida). Com max_sessions sessões abertas, um
+novo GET é recusado até que alguma expire.
+"""
+import collections
+import secrets
+
+import protocol
+
+DEFAULT_MAX_SESSIONS = 10000
+DEFAULT_IDLE_TIMEOUT = 60.0 # Segundos sem mensagens do cliente até a sessão expirar
+
+
+class Session:
+    """Estado de uma transferência: arquivo, checksum, intervalo, métricas e o envio em andamento."""
+
+    __slots__ = ('session_id', 'client_address', 'legacy', 'cached_file', 'algorithm', 'header', 'segment_range',
+                 'metrics', 'transfer', 'resend', 'last_seen')
+
+    def __init__(self, session_id, client_address, legacy, cached_file, algorithm, segment_range, transfer_metrics, now):
+        self.session_id = session_id
+        self.client_address = client_address
+        self.legacy = legacy # Sem ID nos segmentos: identificada só pelo endereço
+        self.cached_file = cached_file
+        self.algorithm = algorithm
+        self.header = protocol.segment_header(algorithm) if legacy else protocol.SessionSegmentHeader(algorithm, session_id)
+        self.segment_range = segment_range
+        self.metrics = transfer_metrics
+        self.transfer = None # Transfer com o envio inicial ainda em andamento
+        self.resend = None # ResendJob com os reenvios pedidos por NACK ainda pendentes
+        self.last_seen = now
+
+    def label(self):
+        host, port = self.client_address[:2]
+        return f"{self.session_id:08x}@{host}:{port}"
+
+    def close(self):
+        self.transfer = None
+        self.resend = None
+        self.cached_file = None # O mapeamento pertence ao cache
+
+
+class SessionTable:
+    """Sessões abertas, indexadas pelo ID e pelo endereço do cliente."""
+
+    def __init__(self, max_sessions=DEFAULT_MAX_SESSIONS, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.sessions = collections.OrderedDict() # session_id -> Session, da menos para a mais recentemente ativa
+        self.by_address = {} # client_address -> sessão mais recente aberta por esse endereço
+        self.expired = 0
+        self.refused = 0
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __iter__(self):
+        return iter(self.sessions.values())
+
+    def full(self):
+        return len(self.sessions) >= self.max_sessions
+
+    def open(self, client_address, legacy, cached_file, algorithm, segment_range, transfer_metrics, now):
+        """Abre uma sessão com um ID aleatório (difícil de adivinhar); retorna None se a tabela estiver cheia."""
+        if self.full():
+            self.refused += 1
+            return None
+        session_id = secrets.randbits(32)
+        while not session_id or session_id in self.sessions:
+            session_id = secrets.randbits(32)
+        session = Session(session_id, client_address, legacy, cached_file, algorithm, segment_range, transfer_metrics, now)
+        self.sessions[session_id] = session
+        self.by_address[client_address] = session
+        return session
+
+    def get(self, session_id):
+        return self.sessions.get(session_id)
+
+    def find(self, client_address):
+        """Sessão mais recente do endereço (mensagens sem ID de sessão)."""
+        return self.by_address.get(client_address)
+
+    def touch(self, session, now):
+        session.last_seen = now
+        self.sessions.move_to_end(session.session_id)
+
+    def migrate(self, session, client_address):
+        """O cliente da sessão passou a usar outro endereço (NAT, troca de rede)."""
+        if self.by_address.get(session.client_address) is session:
+            del self.by_address[session.client_address]
+        session.client_address = client_address
+        self.by_address[client_address] = session
+
+    def remove(self, session):
+        self.sessions.pop(session.session_id, None)
+        if self.by_address.get(session.client_address) is session:
+            del self.by_address[session.client_address]
+
+    def expire(self, now):
+        """Remove e retorna as sessões sem atividade há mais de idle_timeout segundos."""
+        expired = []
+        deadline = now - self.idle_timeout
+        while self.sessions:
+            session = next(iter(self.sessions.values()))
+            if session.last_seen > deadline:
+                break
+            if session.transfer is not None or session.resend is not None:
+                self.touch(session, now) # Ainda enviando: o cliente não precisa falar nada
+                continue
+            self.remove(session)
+            expired.append(session)
+        self.expired += len(expired)
+        return expired
+
+    def stats(self):
+        return {
+            'open': len(self.sessions),
+            'sending': sum(1 for session in self.sessions.values() if session.transfer is not None or session.resend is not None),
+            'expired': self.expired,
+            'refused': self.refused,
+        }
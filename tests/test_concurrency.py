@@ -0,0 +1,46 @@
+"""Vazão agregada do servidor com clientes simultâneos (modo --clients do benchmark).
+
+Com o fluxo fixo, cada transferência envia um segmento a cada SEGMENT_INTERVAL: um cliente
+sozinho fica limitado pelo espaçamento, não pela CPU. Um servidor que intercala as
+transferências atende N clientes no mesmo tempo de um, e a vazão agregada cresce com N; o
+servidor original, que enviava um arquivo inteiro antes de ler a próxima requisição, a
+manteria constante. Os testes rodam servidor e clientes em processos, como o benchmark.
+"""
+import os
+import socket
+import statistics
+
+import pytest
+
+import benchmark
+import protocol
+
+SIZE = 1024 * 1024 # 749 segmentos: cerca de 0,75 s por cliente no fluxo fixo
+CLIENTS = 4
+REPEAT = 3
+MIN_GAIN = 2.0 # Ganho mínimo da vazão agregada de CLIENTS clientes sobre a de um (ideal: CLIENTS)
+WORKER_TOLERANCE = 0.7 # Fração mínima da vazão com um processo que vários processos devem manter
+
+
+def median_mbps(results, workers, clients):
+    rows = [row for row in results if row['workers'] == workers and row['clients'] == clients]
+    assert all(row['ok'] for row in rows), rows
+    return statistics.median(row['aggregate_mbps'] for row in rows)
+
+
+def test_aggregate_throughput_grows_with_clients(tmp_path):
+    results = benchmark.run_concurrency([1], [1, CLIENTS], SIZE, REPEAT, str(tmp_path),
+                                        client_options=['-f', protocol.FLOW_FIXED])
+
+    assert median_mbps(results, 1, CLIENTS) >= MIN_GAIN * median_mbps(results, 1, 1)
+
+
+@pytest.mark.skipif(not hasattr(socket, 'SO_REUSEPORT'), reason="SO_REUSEPORT não suportado nesta plataforma")
+def test_reuseport_workers_keep_aggregate_throughput(tmp_path):
+    # Com um núcleo só, os processos disputam a CPU e não há ganho a exigir: só que repartir
+    # os clientes entre eles via SO_REUSEPORT não custe mais que a tolerância
+    workers = max(2, min(CLIENTS, os.cpu_count() or 1))
+    results = benchmark.run_concurrency([1, workers], [CLIENTS], SIZE, REPEAT, str(tmp_path),
+                                        client_options=['-f', protocol.FLOW_FIXED])
+
+    assert median_mbps(results, workers, CLIENTS) >= WORKER_TOLERANCE * median_mbps(results, 1, CLIENTS)
@@ -0,0 +1,100 @@
+"""Recuperação de segmentos pela paridade XOR (fec.py)."""
+import os
+
+import pytest
+
+import fec
+from reassembly import Reassembler
+
+PAYLOAD_SIZE = 64
+
+
+@pytest.fixture
+def reassembler(tmp_path):
+    reassembler = Reassembler(str(tmp_path / 'out.bin'), 'remoto.bin', PAYLOAD_SIZE)
+    yield reassembler
+    reassembler.close()
+
+
+def make_group(count, last_size=PAYLOAD_SIZE):
+    payloads = [os.urandom(PAYLOAD_SIZE) for _ in range(count - 1)]
+    payloads.append(os.urandom(last_size))
+    return payloads
+
+
+@pytest.mark.parametrize('lost', [0, 3, 7])
+def test_single_loss_is_rebuilt(reassembler, lost):
+    payloads = make_group(8)
+    for seq_num, payload in enumerate(payloads):
+        if seq_num != lost:
+            reassembler.add(seq_num, payload)
+
+    rebuilt = fec.Recovery(reassembler).add_parity(0, fec.build_parity(payloads), final=False)
+
+    assert rebuilt == [(lost, payloads[lost], False)]
+    assert reassembler.read(lost) == payloads[lost]
+
+
+def test_short_last_segment_is_rebuilt_with_its_size(reassembler):
+    first = 16
+    payloads = make_group(5, last_size=13)
+    for offset, payload in enumerate(payloads[:-1]):
+        reassembler.add(first + offset, payload)
+
+    rebuilt = fec.Recovery(reassembler).add_parity(first, fec.build_parity(payloads), final=True)
+
+    assert rebuilt == [(first + 4, payloads[-1], True)]
+    assert reassembler.total_segments == first + 5
+    assert reassembler.read(first + 4) == payloads[-1]
+
+
+def test_parity_waits_for_retransmission(reassembler):
+    payloads = make_group(6)
+    for seq_num in (0, 1, 3, 5):
+        reassembler.add(seq_num, payloads[seq_num])
+    recovery = fec.Recovery(reassembler)
+
+    assert recovery.add_parity(0, fec.build_parity(payloads), final=False) == [] # Dois faltando
+
+    reassembler.add(4, payloads[4])
+    assert recovery.on_segment(4) == [(2, payloads[2], False)]
+    assert recovery.groups == {} and recovery.waiting == {}
+
+
+def test_complete_group_needs_nothing(reassembler):
+    payloads = make_group(4)
+    for seq_num, payload in enumerate(payloads):
+        reassembler.add(seq_num, payload)
+    assert fec.Recovery(reassembler).add_parity(0, fec.build_parity(payloads), final=False) == []
+
+
+def test_inconsistent_parity_is_ignored(reassembler):
+    payloads = make_group(4)
+    for seq_num in (0, 1, 2):
+        reassembler.add(seq_num, payloads[seq_num])
+    other = make_group(4)
+    other[0] = os.urandom(PAYLOAD_SIZE) + b'x' # De outro grupo: o reconstruído não cabe num segmento
+
+    assert fec.Recovery(reassembler).add_parity(0, fec.build_parity(other), final=False) == []
+    assert 3 not in reassembler
+
+
+@pytest.mark.parametrize('data', [b'', b'\x00', b'\x00\x00\x00\x00', b'\x01\x00\x00'])
+def test_malformed_parity_is_rejected(data):
+    with pytest.raises(ValueError):
+        fec.parse_parity(data)
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('auto', (fec.DEFAULT_GROUP_SIZE, True)),
+    (str(fec.MIN_GROUP_SIZE), (fec.MIN_GROUP_SIZE, False)),
+    (str(fec.MAX_GROUP_SIZE), (fec.MAX_GROUP_SIZE, False)),
+])
+def test_parse_group_option(value, expected):
+    assert fec.parse_group_option(value) == expected
+
+
+@pytest.mark.parametrize('value', ['', 'x', '1', str(fec.MAX_GROUP_SIZE + 1), '-4'])
+def test_parse_group_option_rejects_invalid(value):
+    with pytest.raises(ValueError):
+        fec.parse_group_option(value)
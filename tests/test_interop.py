@@ -0,0 +1,83 @@
+"""Interoperação do cliente com o servidor original (GET simples, sem opções nem sessões)."""
+import os
+import socket
+import struct
+import threading
+
+import pytest
+
+import client
+import protocol
+
+
+class OriginalServer:
+    """Responde como o server.py original: o nome é todo o resto da mensagem após 'GET /'."""
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.settimeout(0.1)
+        self.requests = []
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    @property
+    def address(self):
+        return f"127.0.0.1:{self.sock.getsockname()[1]}"
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                message, address = self.sock.recvfrom(65536)
+            except socket.timeout:
+                continue
+            message_str = message.decode('utf-8', errors='ignore').strip()
+            if not message_str.startswith('GET /'):
+                continue # RETRANS e NACKs: sem perdas, nada a reenviar
+            filename = message_str[5:]
+            self.requests.append(filename)
+            if not os.path.exists(filename):
+                self.sock.sendto(b"ERROR 404 File Not Found\n", address)
+                continue
+            with open(filename, 'rb') as f:
+                data = f.read()
+            total = max(1, (len(data) + 1399) // 1400)
+            for seq_num in range(total):
+                payload = data[seq_num * 1400:(seq_num + 1) * 1400]
+                flags = protocol.FLAG_LAST if seq_num == total - 1 else 0
+                self.sock.sendto(struct.pack('!I H B', seq_num, sum(payload) % 65536, flags) + payload, address)
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        self.sock.close()
+
+
+@pytest.fixture
+def original_server():
+    server = OriginalServer()
+    yield server
+    server.close()
+
+
+def test_fixed_flow_falls_back_to_bare_get(original_server, tmp_path):
+    source = tmp_path / 'source.bin'
+    source.write_bytes(os.urandom(50 * 1400 + 123))
+    output = tmp_path / 'out.bin'
+
+    assert client.start_client(original_server.address, str(source), str(output), loss_probability=0.0, timeout_seconds=1.0,
+                               flow=protocol.FLOW_FIXED)
+
+    assert output.read_bytes() == source.read_bytes()
+    # Primeiro o GET com a sessão (recusado com 404), depois o GET original
+    assert len(original_server.requests) == 2
+    assert original_server.requests[1] == str(source)
+
+
+def test_missing_file_is_reported_after_fallback(original_server, tmp_path):
+    output = tmp_path / 'out.bin'
+
+    assert not client.start_client(original_server.address, str(tmp_path / 'missing.bin'), str(output), loss_probability=0.0,
+                                   timeout_seconds=1.0, flow=protocol.FLOW_FIXED)
+    assert len(original_server.requests) == 2
@@ -0,0 +1,137 @@
+"""Codificação dos NACKs e dos intervalos de segmentos (protocol.py)."""
+import random
+
+import pytest
+
+import protocol
+
+
+def nack_kind(datagram):
+    return datagram[4] & ~protocol.NACK_KIND_SESSION
+
+
+def decode_all(datagrams):
+    sessions = set()
+    ranges = []
+    for datagram in datagrams:
+        session_id, decoded = protocol.parse_nack(datagram)
+        sessions.add(session_id)
+        ranges.extend(decoded)
+    return sessions, ranges
+
+
+def random_ranges(rng, count, max_gap, max_length):
+    """Intervalos ordenados e separados por pelo menos um segmento (o bitmap junta os vizinhos)."""
+    ranges = []
+    start = rng.randrange(1000)
+    for _ in range(count):
+        length = rng.randint(1, max_length)
+        ranges.append((start, length))
+        start += length + rng.randint(1, max_gap)
+    return ranges
+
+
+@pytest.mark.parametrize('session_id', [None, 0, 0xFFFFFFFF])
+@pytest.mark.parametrize('max_gap', [2, 50, 100000])
+def test_nack_round_trip(session_id, max_gap):
+    rng = random.Random(max_gap)
+    for count in (1, 2, 17, protocol.MAX_NACK_RANGES, 3 * protocol.MAX_NACK_RANGES + 5):
+        ranges = random_ranges(rng, count, max_gap, 40)
+        sessions, decoded = decode_all(protocol.build_nacks(ranges, session_id))
+        assert sessions == {session_id}
+        assert decoded == ranges
+
+
+def test_dense_ranges_use_bitmap():
+    ranges = [(seq_num, 1) for seq_num in range(100, 400, 2)]
+    datagrams = protocol.build_nacks(ranges)
+    assert [nack_kind(datagram) for datagram in datagrams] == [protocol.NACK_KIND_BITMAP]
+    assert len(datagrams[0]) < protocol.NACK_HEADER.size + len(ranges) * protocol.NACK_RANGE.size
+    assert protocol.parse_nack(datagrams[0]) == (None, ranges)
+
+
+def test_sparse_ranges_use_ranges():
+    ranges = [(seq_num, 3) for seq_num in range(0, 100000, 1000)]
+    datagrams = protocol.build_nacks(ranges, session_id=7)
+    assert [nack_kind(datagram) for datagram in datagrams] == [protocol.NACK_KIND_RANGES]
+    assert protocol.parse_nack(datagrams[0]) == (7, ranges)
+
+
+def test_single_long_range_uses_ranges():
+    datagrams = protocol.build_nacks([(5, 1 << 20)])
+    assert [nack_kind(datagram) for datagram in datagrams] == [protocol.NACK_KIND_RANGES]
+    assert protocol.parse_nack(datagrams[0]) == (None, [(5, 1 << 20)])
+
+
+def test_bitmap_keeps_ranges_at_byte_boundaries():
+    ranges = [(0, 1), (7, 2), (15, 1), (17, 8), (30, 1)]
+    datagram, = protocol.build_nacks(ranges)
+    assert nack_kind(datagram) == protocol.NACK_KIND_BITMAP
+    assert protocol.parse_nack(datagram) == (None, ranges)
+
+
+def test_nacks_fit_in_one_datagram():
+    rng = random.Random(1)
+    for max_gap in (2, 8, 64, 100000):
+        ranges = random_ranges(rng, 2000, max_gap, 20)
+        datagrams = protocol.build_nacks(ranges, session_id=1)
+        assert len(datagrams) == -(-len(ranges) // protocol.MAX_NACK_RANGES)
+        assert all(len(datagram) <= protocol.DEFAULT_PAYLOAD_SIZE for datagram in datagrams)
+
+
+def test_no_ranges_no_datagrams():
+    assert protocol.build_nacks([]) == []
+
+
+@pytest.mark.parametrize('ranges', [[(3, 2), (10, 1)], [(seq_num, 1) for seq_num in range(0, 64, 2)]])
+@pytest.mark.parametrize('session_id', [None, 42])
+def test_truncated_nack_is_rejected(ranges, session_id):
+    datagram, = protocol.build_nacks(ranges, session_id)
+    for size in range(len(datagram)):
+        with pytest.raises(ValueError):
+            protocol.parse_nack(datagram[:size])
+
+
+def test_nack_with_bad_magic_is_rejected():
+    datagram, = protocol.build_nacks([(1, 1)])
+    with pytest.raises(ValueError):
+        protocol.parse_nack(b'NACX' + datagram[4:])
+
+
+def test_nack_with_unknown_kind_is_rejected():
+    with pytest.raises(ValueError):
+        protocol.parse_nack(protocol.NACK_HEADER.pack(protocol.NACK_MAGIC, 3, 0, 0))
+
+
+def test_nack_with_oversized_count_is_rejected():
+    # Quantidade maior que o corpo: não pode ler além do datagrama
+    for kind in (protocol.NACK_KIND_RANGES, protocol.NACK_KIND_BITMAP):
+        with pytest.raises(ValueError):
+            protocol.parse_nack(protocol.NACK_HEADER.pack(protocol.NACK_MAGIC, kind, 0, 0xFFFFFFFF) + bytes(16))
+
+
+def test_empty_bitmap_has_no_ranges():
+    message = protocol.NACK_HEADER.pack(protocol.NACK_MAGIC, protocol.NACK_KIND_BITMAP, 10, 16) + bytes(2)
+    assert protocol.parse_nack(message) == (None, [])
+
+
+def test_missing_ranges_groups_consecutive():
+    assert protocol.missing_ranges([]) == []
+    assert protocol.missing_ranges([1, 2, 3, 7, 9, 10]) == [(1, 3), (7, 1), (9, 2)]
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('0-9', (0, 10)),
+    ('3-3', (3, 4)),
+    ('5-', (5, 100)),
+    ('90-500', (90, 100)), # Limitado ao fim do arquivo
+    (protocol.format_range(10, 19), (10, 20)),
+])
+def test_parse_range(value, expected):
+    assert protocol.parse_range(value, 100) == expected
+
+
+@pytest.mark.parametrize('value', ['', '5', 'a-b', '-3', '3-x', '100-', '100-200', '10-5', '-1-3'])
+def test_parse_range_rejects_malformed(value):
+    with pytest.raises(ValueError):
+        protocol.parse_range(value, 100)
@@ -0,0 +1,140 @@
+"""Segmentos faltantes e retomada pelo arquivo de estado (reassembly.py)."""
+import json
+import os
+
+import pytest
+
+import reassembly
+from reassembly import Reassembler
+
+PAYLOAD_SIZE = 32
+
+
+def segment(seq_num):
+    return bytes([seq_num % 256]) * PAYLOAD_SIZE
+
+
+@pytest.fixture
+def output(tmp_path):
+    return str(tmp_path / 'out.bin')
+
+
+def test_missing_ranges_with_known_total(output):
+    reassembler = Reassembler(output, 'remoto.bin', PAYLOAD_SIZE)
+    reassembler.set_total(40)
+    for seq_num in list(range(0, 5)) + [7, 8] + list(range(10, 30)):
+        reassembler.add(seq_num, segment(seq_num))
+
+    assert reassembler.missing_ranges() == [(5, 2), (9, 1), (30, 10)]
+    reassembler.close()
+
+
+def test_missing_ranges_with_unknown_total_end_open(output):
+    reassembler = Reassembler(output, 'remoto.bin', PAYLOAD_SIZE)
+    for seq_num in (0, 1, 3):
+        reassembler.add(seq_num, segment(seq_num))
+    assert reassembler.missing_ranges() == [(2, 1), (4, reassembly.OPEN_TAIL - 4)]
+
+    reassembler.add(2, segment(2))
+    assert reassembler.missing_ranges() == [(4, reassembly.OPEN_TAIL - 4)]
+    reassembler.close()
+
+
+def test_missing_ranges_use_remote_sequence_numbers(output):
+    reassembler = Reassembler(output, 'remoto.bin', PAYLOAD_SIZE, first_segment=100)
+    reassembler.set_total(20)
+    for seq_num in range(100, 120):
+        if seq_num not in (103, 111, 112):
+            reassembler.add(seq_num, segment(seq_num))
+
+    assert reassembler.missing_ranges() == [(103, 1), (111, 2)]
+    assert not reassembler.add(99, segment(99)) # Fora do intervalo deste fluxo
+    reassembler.close()
+
+
+def test_last_segment_sets_total(output):
+    reassembler = Reassembler(output, 'remoto.bin', PAYLOAD_SIZE)
+    reassembler.add(0, segment(0))
+    reassembler.add(3, b'fim', is_last=True)
+
+    assert reassembler.total_segments == 4
+    assert reassembler.missing_ranges() == [(1, 2)]
+    assert not reassembler.add(4, segment(4))
+    reassembler.close()
+
+
+def test_state_is_reloaded(output):
+    reassembler = Reassembler(output, 'remoto.bin', PAYLOAD_SIZE)
+    reassembler.version = 'v1'
+    reassembler.set_total(25, 24 * PAYLOAD_SIZE + 3)
+    for seq_num in (0, 1, 2, 9, 17, 18):
+        reassembler.add(seq_num, segment(seq_num))
+    missing = reassembler.missing_ranges()
+    reassembler.close()
+
+    resumed = Reassembler(output, 'remoto.bin', PAYLOAD_SIZE)
+    assert resumed.resumed
+    assert len(resumed) == 6
+    assert resumed.version == 'v1'
+    assert resumed.missing_ranges() == missing
+    assert resumed.read(9) == segment(9)
+
+    for start, count in missing:
+        for seq_num in range(start, start + count):
+            resumed.add(seq_num, segment(seq_num)[:3] if seq_num == 24 else segment(seq_num))
+    assert resumed.complete()
+    resumed.finish()
+    assert not os.path.exists(output + reassembly.STATE_SUFFIX)
+    with open(output, 'rb') as f:
+        assert f.read() == b''.join(segment(seq_num) for seq_num in range(24)) + segment(24)[:3]
+
+
+@pytest.mark.parametrize('remote_filename, payload_size', [('outro.bin', PAYLOAD_SIZE), ('remoto.bin', PAYLOAD_SIZE * 2)])
+def test_state_of_another_download_is_discarded(output, remote_filename, payload_size):
+    reassembler = Reassembler(output, 'remoto.bin', PAYLOAD_SIZE)
+    reassembler.version = 'v1'
+    reassembler.add(0, segment(0))
+    reassembler.close()
+
+    fresh = Reassembler(output, remote_filename, payload_size)
+    assert not fresh.resumed
+    assert 0 not in fresh
+    fresh.close()
+
+
+def test_state_without_version_is_discarded(output):
+    reassembler = Reassembler(output, 'remoto.bin', PAYLOAD_SIZE)
+    reassembler.add(0, segment(0))
+    reassembler.close()
+    assert reassembly.saved_payload_size(output, 'remoto.bin') is None
+
+    fresh = Reassembler(output, 'remoto.bin', PAYLOAD_SIZE)
+    assert not fresh.resumed
+    fresh.close()
+
+
+def test_unreadable_state_is_discarded(output):
+    reassembler = Reassembler(output, 'remoto.bin', PAYLOAD_SIZE)
+    reassembler.version = 'v1'
+    reassembler.add(0, segment(0))
+    reassembler.close()
+    assert reassembly.saved_payload_size(output, 'remoto.bin') == PAYLOAD_SIZE
+    with open(output + reassembly.STATE_SUFFIX, 'wb') as f:
+        f.write(b'{nao e json\n')
+
+    fresh = Reassembler(output, 'remoto.bin', PAYLOAD_SIZE)
+    assert not fresh.resumed
+    fresh.close()
+
+
+def test_adopted_local_copy_asks_only_for_other_blocks(output):
+    with open(output, 'wb') as f:
+        f.write(os.urandom(10 * PAYLOAD_SIZE))
+    reassembly.adopt_local_copy(output, 'remoto.bin', PAYLOAD_SIZE, 12, 12 * PAYLOAD_SIZE, [(0, 4), (8, 2)], 'v2')
+    with open(output + reassembly.STATE_SUFFIX, 'rb') as f:
+        assert json.loads(f.readline())['version'] == 'v2'
+
+    reassembler = Reassembler(output, 'remoto.bin', PAYLOAD_SIZE)
+    assert len(reassembler) == 6
+    assert reassembler.missing_ranges() == [(4, 4), (10, 2)]
+    reassembler.close()